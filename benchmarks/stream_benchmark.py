@@ -0,0 +1,254 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+"""
+Benchmark of the data streaming path of srsinst.sr860 without an instrument.
+
+For each combination of channels, data format and packet size, it measures:
+the decode cost per packet of StreamReader.receive_packet() and receive_packets()
+with replayed synthetic packets, the append cost of add_data_block() for the stream buffers,
+the cost of TwoByTwoShareXPlot.request_plot_update() with the redraw of the figure on Agg,
+and the sustainable sample rate
+from the packet source to the buffer, with replayed packets and optionally with
+StreamEmulator over the UDP loopback. With --pool-workers, the decode rate of threaded replay
+is measured without and with DecoderPool for each number of worker processes.
+
+    python benchmarks/stream_benchmark.py --output stream_benchmark.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+from srsinst.sr860 import SR860, __version__
+from srsinst.sr860.instruments.components import DataStream, DataStreamBuffer
+from srsinst.sr860.instruments.streambuffers import RollingDataStreamBuffer, CompactDataStreamBuffer
+from srsinst.sr860.instruments.streamemulator import StreamPacketGenerator, StreamEmulator
+
+BufferClassDict = {
+    'fixed': DataStreamBuffer,
+    'rolling': RollingDataStreamBuffer,
+    'compact': CompactDataStreamBuffer,
+}
+
+
+def bench_decode(stream, file_name, packet_count, batch_size):
+    stream.replay(file_name)
+    t0 = time.perf_counter()
+    for _ in range(packet_count):
+        stream.reader.receive_packet()
+    single = (time.perf_counter() - t0) / packet_count
+    stream.stop()
+
+    stream.replay(file_name)
+    received = 0
+    t0 = time.perf_counter()
+    while received < packet_count:
+        _, numbers = stream.reader.receive_packets(min(batch_size, packet_count - received))
+        received += len(numbers)
+    batch = (time.perf_counter() - t0) / packet_count
+    stream.stop()
+    return {
+        'receive_packet_us_per_packet': single * 1e6,
+        'receive_packets_us_per_packet': batch * 1e6,
+    }
+
+
+def bench_append(channel, data_format, block, block_count):
+    results = {}
+    for name, buffer_class in BufferClassDict.items():
+        data = buffer_class(block.shape[1] * block_count, channel, data_format)
+        rows = block if len(block) == 4 else (block[0], block[0], block[0], block[0])
+        t0 = time.perf_counter()
+        for _ in range(block_count):
+            data.add_data_block(*rows)
+        elapsed = time.perf_counter() - t0
+        results[name + '_append_us_per_block'] = elapsed / block_count * 1e6
+        results[name + '_append_ns_per_sample'] = elapsed / block_count / block.shape[1] * 1e9
+    return results
+
+
+def bench_plot(channel, data_format, block, block_count, repeat=20):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from srsinst.sr860.plots.twobytwosharexplot import TwoByTwoShareXPlot
+    except ImportError:
+        return {}
+
+    results = {}
+    for name, buffer_class in BufferClassDict.items():
+        data = buffer_class(block.shape[1] * block_count, channel, data_format)
+        rows = block if len(block) == 4 else (block[0], block[0], block[0], block[0])
+        for _ in range(block_count):
+            data.add_data_block(*rows)
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        plot = TwoByTwoShareXPlot(figure, data)
+        figure.canvas.draw()
+        set_data = 0.0
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            plot.last_updated_time = 0
+            t1 = time.perf_counter()
+            plot.request_plot_update()
+            set_data += time.perf_counter() - t1
+            figure.canvas.draw()
+        results[name + '_plot_set_data_ms'] = set_data / repeat * 1e3
+        results[name + '_plot_update_ms'] = (time.perf_counter() - t0) / repeat * 1e3
+    return results
+
+
+def bench_end_to_end_replay(stream, file_name, packet_count, batch_size):
+    stream.set_data_buffer(RollingDataStreamBuffer(1000000))
+    stream.replay(file_name)
+    samples = 0
+    t0 = time.perf_counter()
+    reader = stream.reader
+    while reader.packet_count < packet_count:
+        block, _ = reader.receive_packets(min(batch_size, packet_count - reader.packet_count))
+        stream.data.add_data_block(*block)
+        samples += block.shape[1]
+    elapsed = time.perf_counter() - t0
+    stream.stop()
+    return {'replay_sustainable_samples_per_second': samples / elapsed}
+
+
+def bench_decoder_pool(stream, file_name, repeat, workers_list):
+    results = {}
+    for workers in [0] + workers_list:
+        stream.replay(file_name, threaded=True, ring_size=8192, repeat=repeat)
+        reader = stream.reader
+        if workers:
+            reader.start_decoder_pool(workers)
+        samples = 0
+        t0 = time.perf_counter()
+        while True:
+            block, numbers = reader.receive_pooled_blocks() if workers else reader.receive_blocks()
+            if len(numbers) == 0:
+                break
+            samples += block.shape[1]
+        elapsed = time.perf_counter() - t0
+        stream.stop()
+        results['pool_{}_workers_samples_per_second'.format(workers)] = samples / elapsed
+    return results
+
+
+def bench_end_to_end_udp(stream, channel, data_format, packet_size, duration):
+    stream.set_data_buffer(RollingDataStreamBuffer(1000000))
+    stream.listen(channel, data_format, packet_size, StreamPacketGenerator.MaxRate,
+                  port=0, threaded=True, ring_size=8192)
+    port = stream.udp_socket.getsockname()[1]
+    emulator = StreamEmulator(StreamPacketGenerator(channel, data_format, packet_size),
+                              port=port, duration=duration, rate_limit=False)
+    reader = stream.reader
+    samples = 0
+    emulator.start()
+    t0 = time.perf_counter()
+    while emulator.is_alive() or reader.receiver.ring.get_pending_size():
+        block, numbers = reader.receive_blocks(timeout=0.1)
+        if len(numbers):
+            stream.data.add_data_block(*block)
+            samples += block.shape[1]
+    elapsed = time.perf_counter() - t0
+    emulator.stop()
+    counters = stream.get_receiver_counters()
+    stream.stop()
+    loss = stream.get_loss_counters()
+    sent = emulator.get_counters()['sent']
+    stored = counters['received'] - counters['dropped']
+    return {
+        'udp_sent_packets': sent,
+        'udp_received_packets': counters['received'],
+        'udp_ring_dropped_packets': counters['dropped'],
+        'udp_lost_packets': sent - counters['received'],
+        'udp_detected_lost_packets': loss['lost'],
+        'udp_stored_samples_per_second': samples / elapsed,
+        'udp_loss_fraction': (sent - stored) / sent if sent else 0.0,
+    }
+
+
+def run(args):
+    stream = SR860().stream
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for channel in args.channels:
+            for data_format in args.formats:
+                for packet_size in args.packet_sizes:
+                    file_name = os.path.join(directory, 'packets.dat')
+                    generator = StreamPacketGenerator(channel, data_format, packet_size)
+                    generator.write_packet_file(file_name, args.packets)
+                    result = {
+                        'channel': channel,
+                        'format': data_format,
+                        'packet_size': packet_size,
+                        'samples_per_packet': generator.samples_per_packet,
+                    }
+                    result.update(bench_decode(stream, file_name, args.packets, args.batch_size))
+
+                    block = np.atleast_2d(stream.decoder.decode(generator.make_packets(1)[0]).copy())
+                    block_count = max(args.samples // block.shape[1], 1)
+                    result.update(bench_append(channel, data_format, block, block_count))
+                    if not args.no_plot:
+                        result.update(bench_plot(channel, data_format, block, block_count))
+                    result.update(bench_end_to_end_replay(stream, file_name, args.packets, args.batch_size))
+                    if args.pool_workers:
+                        result.update(bench_decoder_pool(stream, file_name, args.pool_repeat, args.pool_workers))
+                    if args.udp_duration > 0:
+                        result.update(bench_end_to_end_udp(stream, channel, data_format,
+                                                           packet_size, args.udp_duration))
+                    results.append(result)
+                    print(json.dumps(result))
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'srsinst.sr860': __version__,
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'packets': args.packets,
+            'samples': args.samples,
+            'batch_size': args.batch_size,
+            'pool_repeat': args.pool_repeat,
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data streaming path of srsinst.sr860')
+    parser.add_argument('--output', default='stream_benchmark.json', help='JSON file to write the results')
+    parser.add_argument('--packets', type=int, default=2000, help='packets to decode per configuration')
+    parser.add_argument('--samples', type=int, default=200000, help='samples to append per configuration')
+    parser.add_argument('--batch-size', type=int, default=64, help='packets per receive_packets() call')
+    parser.add_argument('--udp-duration', type=float, default=0.0,
+                        help='seconds of StreamEmulator over the UDP loopback per configuration, 0 to skip')
+    parser.add_argument('--pool-workers', nargs='*', type=int, default=[],
+                        help='numbers of DecoderPool worker processes to compare, none to skip')
+    parser.add_argument('--pool-repeat', type=int, default=20,
+                        help='times the packets are replayed for the DecoderPool benchmark')
+    parser.add_argument('--no-plot', action='store_true', help='skip the plot update benchmark')
+    parser.add_argument('--channels', nargs='+', default=list(DataStream.ChannelDict.keys()))
+    parser.add_argument('--formats', nargs='+', default=list(DataStream.FormatDict.keys()))
+    parser.add_argument('--packet-sizes', nargs='+', type=int, default=list(DataStream.PacketSizeDict.keys()))
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
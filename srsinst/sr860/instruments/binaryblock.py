@@ -0,0 +1,145 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import select
+
+from srsgui import TcpipInterface, SerialInterface
+from srsgui.inst.exceptions import InstCommunicationError
+
+
+class BinaryBlockReader:
+    """
+    Read IEEE 488.2 definite-length binary blocks, '#<digits><length><data>',
+    from an interface into a buffer supplied by the caller.
+
+    Data is read directly into the buffer with socket.recv_into() for TcpipInterface,
+    serial.Serial.readinto() for SerialInterface, or the _read_binary_into() method
+    of an interface that has one. Other interfaces, such as Vxi11Interface and VisaInterface,
+    are read with _read_binary() and copied into the buffer once.
+    _read_binary() may return more bytes than requested, as VXI-11 read_raw() does.
+    The surplus bytes are kept, and used first by the next read from the same interface.
+    A terminator left after a block is skipped before the next header.
+
+    Use get_binary_block_reader() to share a reader, and its surplus bytes, for an interface.
+    The lock of the interface should be held while reading.
+    """
+    Whitespace = b' \t\r\n'
+    DiscardSize = 65536
+
+    def __init__(self, interface):
+        self.interface = interface
+        self._surplus = bytearray()
+        self._discard = None
+
+    def clear(self):
+        """
+        Drop the surplus bytes, after the interface buffer is cleared
+        """
+        self._surplus.clear()
+
+    def get_surplus_size(self):
+        return len(self._surplus)
+
+    def read_header(self):
+        """
+        Read the header of a binary block
+
+        :returns: the length of the data in the block
+        """
+        header = bytearray(1)
+        view = memoryview(header)
+        self.read_into(view)
+        while header[0] in self.Whitespace:
+            self.read_into(view)
+        if header[0] != 35:  # '#'
+            raise ValueError('Invalid binary block header: {}'.format(bytes(header)))
+        self.read_into(view)
+        digits = header[0] - 48
+        if not 1 <= digits <= 9:
+            raise ValueError('Binary block with indefinite or invalid length: #{}'.format(chr(header[0])))
+        length = bytearray(digits)
+        self.read_into(memoryview(length))
+        return int(length)
+
+    def read_block_into(self, buffer):
+        """
+        Read a binary block into buffer. Data beyond the size of buffer is read and discarded.
+
+        :param buffer: writable bytes-like object, such as a bytearray or a numpy array
+        :returns: the number of bytes written in buffer
+        """
+        length = self.read_header()
+        view = memoryview(buffer).cast('B')
+        size = min(length, len(view))
+        self.read_into(view[:size])
+        self.skip(length - size)
+        return size
+
+    def read_block(self):
+        """
+        Read a binary block into a new bytearray
+        """
+        length = self.read_header()
+        data = bytearray(length)
+        self.read_into(memoryview(data))
+        return data
+
+    def skip(self, count):
+        if count <= 0:
+            return
+        if self._discard is None:
+            self._discard = memoryview(bytearray(self.DiscardSize))
+        while count > 0:
+            size = min(count, len(self._discard))
+            self.read_into(self._discard[:size])
+            count -= size
+
+    def read_into(self, view):
+        """
+        Fill a memoryview with bytes from the surplus bytes and the interface
+        """
+        received = 0
+        if self._surplus:
+            received = min(len(self._surplus), len(view))
+            view[:received] = self._surplus[:received]
+            del self._surplus[:received]
+        while received < len(view):
+            count = self._read_some(view[received:])
+            if count <= 0:
+                raise InstCommunicationError('Timeout or connection closed while reading a binary block')
+            received += count
+
+    def _read_some(self, view):
+        interface = self.interface
+        if hasattr(interface, '_read_binary_into'):
+            return interface._read_binary_into(view)
+
+        if isinstance(interface, TcpipInterface):
+            ready, _, _ = select.select([interface.socket], [], [], interface._timeout)
+            if not ready:
+                return 0
+            return interface.socket.recv_into(view)
+
+        if isinstance(interface, SerialInterface):
+            return interface._serial.readinto(view)
+
+        data = interface._read_binary(len(view))
+        size = min(len(data), len(view))
+        view[:size] = data[:size]
+        if len(data) > size:
+            self._surplus += data[size:]
+        return size
+
+
+def get_binary_block_reader(interface):
+    """
+    Return the BinaryBlockReader of an interface, created at the first call,
+    so that bytes read ahead from the interface are kept for the next read
+    """
+    reader = getattr(interface, '_binary_block_reader', None)
+    if reader is None or reader.interface is not interface:
+        reader = BinaryBlockReader(interface)
+        interface._binary_block_reader = reader
+    return reader
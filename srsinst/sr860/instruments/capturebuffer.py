@@ -0,0 +1,131 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import collections
+import numpy as np
+
+
+class CaptureBuffer:
+    """
+    Lazy view of the capture buffer that reads only the part requested by an index or a slice.
+
+    buffer[10000:20000] returns the data points 10000 to 19999 in the format of
+    DataCapture.get_all_data(), and buffer[i] returns the columns of a single data point.
+    The kilobytes covering the points are read with as few CAPTUREGET? requests as possible,
+    and kept in an LRU cache, so that reading the same region again sends no request.
+    The configuration and the number of data points are queried at the first access.
+    Call refresh() after the capture buffer changes.
+    """
+    def __init__(self, capture, cache_size=4096):
+        """
+        :param capture: DataCapture of the instrument
+        :param cache_size: number of kilobytes kept in the cache
+        """
+        self.capture = capture
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # Kilobyte index: uint8 array of 1024 bytes
+        self.request_count = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self._columns = None
+        self._length = 0
+
+    def refresh(self):
+        """
+        Clear the cache and query the configuration and the number of data points again at the next access
+        """
+        self.cache.clear()
+        self._columns = None
+
+    def _update(self):
+        if self._columns is not None:
+            return
+        config = self.capture.config
+        if config not in self.capture.ColumnCountDict:
+            raise ValueError('Invalid data type {} in CaptureBuffer'.format(config))
+        self._columns = self.capture.ColumnCountDict[config]
+        self._length = self.capture.data_size_in_bytes // (4 * self._columns)
+
+    @property
+    def columns(self):
+        self._update()
+        return self._columns
+
+    def __len__(self):
+        self._update()
+        return self._length
+
+    @property
+    def shape(self):
+        return self.columns, len(self)
+
+    def __getitem__(self, key):
+        length = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+            indices = range(start, stop, step)
+            if len(indices) == 0:
+                return np.empty((self.columns, 0), dtype=self.capture.DataType)
+            first, last = min(indices[0], indices[-1]), max(indices[0], indices[-1])
+            rows = self._get_rows(first, last + 1)
+            return rows[indices[0] - first:: step][:len(indices)].T
+
+        index = int(key)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('Index {} is out of the capture buffer with {} data points'.format(key, length))
+        return self._get_rows(index, index + 1)[0]
+
+    def _get_rows(self, start, stop):
+        # Return rows from start to stop as an array with a column for each channel
+        row_size = 4 * self.columns
+        first_kb = start * row_size // 1024
+        stop_kb = (stop * row_size + 1023) // 1024
+        self._fetch(first_kb, stop_kb)
+        raw = np.concatenate([self._get_cached(kb) for kb in range(first_kb, stop_kb)])
+        offset = start * row_size - first_kb * 1024
+        return raw[offset: offset + (stop - start) * row_size].view(self.capture.DataType) \
+            .reshape(-1, self.columns)
+
+    def _get_cached(self, kb):
+        self.cache.move_to_end(kb)
+        return self.cache[kb]
+
+    def _fetch(self, first_kb, stop_kb):
+        # Read runs of kilobytes missing in the cache, up to MaxBlockKilobytes in a request
+        missing = []
+        for kb in range(first_kb, stop_kb):
+            if kb in self.cache:
+                self.cache.move_to_end(kb)
+            else:
+                missing.append(kb)
+        self.hit_count += stop_kb - first_kb - len(missing)
+        self.miss_count += len(missing)
+        runs = []
+        for kb in missing:
+            if runs and runs[-1][1] == kb and runs[-1][1] - runs[-1][0] < self.capture.MaxBlockKilobytes:
+                runs[-1][1] = kb + 1
+            else:
+                runs.append([kb, kb + 1])
+
+        for run_start, run_stop in runs:
+            raw = np.empty((run_stop - run_start) * 1024, dtype=np.uint8)
+            with self.capture.comm.get_lock():
+                self.capture._read_blocks_into(raw, run_start)
+            self.request_count += 1
+            for i, kb in enumerate(range(run_start, run_stop)):
+                self.cache[kb] = raw[i * 1024: (i + 1) * 1024]
+        # Keep the kilobytes requested even when they are more than the cache size
+        while len(self.cache) > max(self.cache_size, stop_kb - first_kb):
+            self.cache.popitem(last=False)
+
+    def get_counters(self):
+        return {
+            'requests': self.request_count,
+            'cached_kilobytes': len(self.cache),
+            'hits': self.hit_count,
+            'misses': self.miss_count,
+        }
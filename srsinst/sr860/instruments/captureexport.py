@@ -0,0 +1,156 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import os
+import time
+import numpy as np
+
+from .keys import Keys
+
+
+class CaptureExporter:
+    """
+    Write the capture buffer to a file block by block as each CAPTUREGET? block arrives,
+    without holding the whole buffer in memory.
+
+    The file format is one of:
+
+    - 'raw': a 64-byte header followed by the data points as little-endian float32,
+      with the columns of each data point together, as in the capture buffer
+    - 'npy': a numpy .npy file with an array of (data points, columns). np.load() reads it,
+      and its transpose is in the format of DataCapture.get_all_data()
+    - 'csv': a line of column names followed by a line for each data point,
+      with the 9 significant digits needed to read back the same float32 values
+    """
+    Raw = 'raw'
+    Npy = 'npy'
+    Csv = 'csv'
+    FormatList = [Raw, Npy, Csv]
+
+    Magic = b'SR86XCAP'
+    Version = 1
+    HeaderSize = 64
+    HeaderType = np.dtype([
+        ('magic', 'S8'),
+        ('version', '<u4'),
+        ('channel', '<u4'),
+        ('columns', '<u4'),
+        ('reserved', '<u4'),
+        ('sample_rate', '<f8'),
+        ('data_points', '<u8'),
+        ('start_time', '<f8'),
+    ])
+    ColumnNameDict = {
+        Keys.X:    ('X',),
+        Keys.XY:   ('X', 'Y'),
+        Keys.RT:   ('R', 'Theta'),
+        Keys.XYRT: ('X', 'Y', 'R', 'Theta')
+    }
+
+    def __init__(self, capture, block_kilobytes=None):
+        """
+        :param capture: DataCapture of the instrument
+        :param block_kilobytes: size of a CAPTUREGET? request, up to DataCapture.MaxBlockKilobytes
+        """
+        self.capture = capture
+        self.block_kilobytes = min(block_kilobytes if block_kilobytes else capture.MaxBlockKilobytes,
+                                   capture.MaxBlockKilobytes)
+        self._block = np.empty(self.block_kilobytes * 1024, dtype=np.uint8)
+
+    @classmethod
+    def get_format(cls, file_name):
+        """
+        Return the file format from the file name extension, 'raw' if it is not .npy or .csv
+        """
+        extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+        return extension if extension in (cls.Npy, cls.Csv) else cls.Raw
+
+    def export(self, file_name, file_format=None, callback=None):
+        """
+        Write the capture buffer to a file.
+
+        :param file_format: 'raw', 'npy' or 'csv'. It is found from the extension of file_name if None.
+        :param callback: optional function called after each block with the bytes written so far,
+            the total bytes and the transfer rate in MB/s
+        :returns: a dictionary of the data points and bytes transferred, the elapsed time and the rate
+        """
+        file_format = file_format if file_format else self.get_format(file_name)
+        if file_format not in self.FormatList:
+            raise ValueError('Invalid file format: {}'.format(file_format))
+        config = self.capture.config
+        if config not in self.capture.ColumnCountDict:
+            raise ValueError('Invalid data type {} in export()'.format(config))
+        columns = self.capture.ColumnCountDict[config]
+        row_size = 4 * columns
+        data_points = self.capture.data_size_in_bytes // row_size
+        total = data_points * row_size
+        sample_rate = self.capture.rate
+
+        start_time = time.time()
+        transferred = 0
+        start_kb = 0
+        with open(file_name, 'w' if file_format == self.Csv else 'wb') as f:
+            self._write_header(f, file_format, config, columns, data_points, sample_rate, start_time)
+            while transferred < total:
+                count_kb = min(self.block_kilobytes, (total - transferred + 1023) // 1024)
+                block = self._block[:min(count_kb * 1024, total - transferred)]
+                with self.capture.comm.get_lock():
+                    size = self.capture._read_block_into(block, start_kb, count_kb)
+                if size < len(block):
+                    raise ValueError('CAPTUREGET? returned {} bytes instead of {}'.format(size, len(block)))
+                if file_format == self.Csv:
+                    np.savetxt(f, block.view(self.capture.DataType).reshape(-1, columns),
+                               fmt='%.9g', delimiter=',')
+                else:
+                    f.write(block.data)
+                transferred += size
+                start_kb += count_kb
+                if callback is not None:
+                    callback(transferred, total, self._get_rate(transferred, start_time))
+
+        return {
+            'file_name': file_name,
+            'format': file_format,
+            'data_points': data_points,
+            'bytes': transferred,
+            'elapsed_time': time.time() - start_time,
+            'mb_per_s': self._get_rate(transferred, start_time),
+        }
+
+    @staticmethod
+    def _get_rate(transferred, start_time):
+        return transferred / 1e6 / max(time.time() - start_time, 1e-9)
+
+    def _write_header(self, f, file_format, config, columns, data_points, sample_rate, start_time):
+        if file_format == self.Csv:
+            f.write(','.join(self.ColumnNameDict[config]) + '\n')
+        elif file_format == self.Npy:
+            np.lib.format.write_array_header_1_0(
+                f, {'descr': self.capture.DataType.str, 'fortran_order': False,
+                    'shape': (data_points, columns)})
+        else:
+            header = np.zeros((), dtype=self.HeaderType)
+            header['magic'] = self.Magic
+            header['version'] = self.Version
+            header['channel'] = self.capture.ChannelDict[config]
+            header['columns'] = columns
+            header['sample_rate'] = sample_rate if sample_rate else 0.0
+            header['data_points'] = data_points
+            header['start_time'] = start_time
+            f.write(header.tobytes().ljust(self.HeaderSize, b'\0'))
+
+    @classmethod
+    def read_raw(cls, file_name):
+        """
+        Read a raw file written by export() into a memory map in the format of DataCapture.get_all_data()
+
+        :returns: the header as a numpy structured scalar and the data
+        """
+        header = np.fromfile(file_name, dtype=cls.HeaderType, count=1)[0]
+        if bytes(header['magic']) != cls.Magic:
+            raise ValueError('{} is not a capture data file'.format(file_name))
+        data = np.memmap(file_name, dtype='<f4', mode='r', offset=cls.HeaderSize,
+                         shape=(int(header['data_points']), int(header['columns'])))
+        return header, data.T
@@ -0,0 +1,128 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import numpy as np
+
+from .keys import Keys
+
+
+class CaptureFollower:
+    """
+    Read the new samples of a running capture incrementally, without transferring
+    the whole capture buffer again, like following the tail of a growing file.
+
+    Each read() queries CAPTUREBYTES and CAPTURESTAT, and fetches only the kilobyte blocks
+    written since the last read with CAPTUREGET?. The kilobyte holding the write position
+    is fetched again by the next read, and only the new rows in it are returned.
+    In continuous mode, CAPTUREBYTES is taken as the write position in the circular buffer
+    after the Wrapped bit is set, and the samples before and after the wraparound are joined.
+    Samples are lost if the writer goes around the buffer between two reads.
+    It is detected from the Wrapped bit and the capture rate, counted in overruns,
+    and the whole buffer is read, from the oldest sample, to resynchronize.
+    """
+    def __init__(self, capture, poll_interval=0.1):
+        """
+        :param capture: DataCapture of the instrument, configured and started
+        :param poll_interval: time between reads in seconds, when iterated
+        """
+        self.capture = capture
+        self.poll_interval = poll_interval
+        self.reset()
+
+    def reset(self):
+        """
+        Read the capture configuration and start following from the beginning of the buffer
+        """
+        config = self.capture.config
+        if config not in self.capture.ColumnCountDict:
+            raise ValueError('Invalid data type {} in CaptureFollower'.format(config))
+        self.config = config
+        self.columns = self.capture.ColumnCountDict[config]
+        self.row_size = 4 * self.columns
+        self.buffer_size = self.capture.buffer_size_in_kilobytes * 1024
+        self.sample_rate = self.capture.rate
+
+        self.position = 0       # Byte position of the next sample to read in the capture buffer
+        self.wrapped = False    # Wrapped bit of the last read
+        self.state = {}         # Capture state bits queried by the last read
+        self.read_bytes = 0     # Total bytes returned
+        self.read_rows = 0      # Total rows returned
+        self.overruns = 0
+        self.last_read_time = time.time()
+
+    def get_state(self):
+        """
+        Return a dictionary of the capture state bits
+        """
+        state = self.capture.state
+        return {key: bool(state & (1 << bit)) for key, bit in self.capture.CaptureStateBitDict.items()}
+
+    def read(self):
+        """
+        Fetch the samples written since the last read.
+
+        :returns: a float32 array with one, two, or four columns as rows,
+            in the format of DataCapture.get_all_data(), with no columns if nothing is new
+        """
+        # The state is queried first, so that no sample is left when it shows the capture stopped
+        self.state = self.get_state()
+        wrapped = self.state[Keys.Wrapped]
+        write_position = self.capture.data_size_in_bytes
+        now = time.time()
+        write_position -= write_position % self.row_size
+        if write_position >= self.buffer_size:
+            write_position = self.buffer_size if not wrapped else 0
+
+        # Bytes written since the last read, estimated from the capture rate
+        written = (now - self.last_read_time) * self.sample_rate * self.row_size if self.sample_rate else 0.0
+        overrun = wrapped and (written > self.buffer_size or
+                               (not self.wrapped and self.position > 0 and write_position >= self.position))
+        if overrun:
+            self.overruns += 1
+            ranges = [(write_position, self.buffer_size), (0, write_position)]
+        elif write_position < self.position:
+            ranges = [(self.position, self.buffer_size), (0, write_position)]
+        else:
+            ranges = [(self.position, write_position)]
+
+        blocks = [self._read_range(start, stop) for start, stop in ranges if stop > start]
+        self.position = write_position % self.buffer_size if wrapped else write_position
+        self.wrapped = wrapped
+        self.last_read_time = now
+
+        if not blocks:
+            return np.empty((self.columns, 0), dtype=self.capture.DataType)
+        block = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        self.read_bytes += block.nbytes
+        self.read_rows += len(block)
+        return block.T
+
+    def _read_range(self, start, stop):
+        # Fetch the kilobytes covering the byte range and return a view of the rows in it
+        start_kb = start // 1024
+        stop_kb = (stop + 1023) // 1024
+        raw = np.empty((stop_kb - start_kb) * 1024, dtype=np.uint8)
+        with self.capture.comm.get_lock():
+            self.capture._read_blocks_into(raw, start_kb)
+        offset = start - start_kb * 1024
+        return raw[offset: offset + stop - start].view(self.capture.DataType).reshape(-1, self.columns)
+
+    def follow(self, duration=None):
+        """
+        Generate blocks of new samples, read every poll_interval,
+        until the capture stops and all its samples are read, or for duration seconds
+        """
+        start_time = time.time()
+        while duration is None or time.time() - start_time < duration:
+            block = self.read()
+            if block.shape[1]:
+                yield block
+            elif not self.state[Keys.InProgress]:
+                break
+            time.sleep(self.poll_interval)
+
+    def __iter__(self):
+        return self.follow()
@@ -3,8 +3,8 @@
 ##! Subject to the MIT License
 ##! 
 
+import time
 import socket
-from struct import unpack_from
 import numpy as np
 
 from srsgui import Component
@@ -20,6 +20,15 @@ from srsgui import IndexCommand, IndexGetCommand, \
                    FloatIndexCommand, FloatIndexGetCommand, \
                    DictIndexCommand
 from .keys import Keys
+from .streamdecoder import StreamDecoder
+from .streamrecorder import PacketRecorder, PacketReplay
+from .streamreader import StreamReader
+from .streamtimebase import StreamTimebase
+from .streamasync import StreamProtocol
+from .capturefollower import CaptureFollower
+from .capturebuffer import CaptureBuffer
+from .captureexport import CaptureExporter
+from .binaryblock import get_binary_block_reader
 
 
 class Reference(Component):
@@ -558,7 +567,17 @@ class DataCapture(Component):
         Keys.Triggered:  1,
         Keys.Wrapped:    2
     }
-    
+    ColumnCountDict = {
+        Keys.X:    1,
+        Keys.XY:   2,
+        Keys.RT:   2,
+        Keys.XYRT: 4
+    }
+    DataType = np.dtype('<f4')    # Capture data is in little-endian float32
+    MaxBlockKilobytes = 64        # Largest block of a CAPTUREGET? request
+
+    _capture_buffer = None
+
     buffer_size_in_kilobytes = IntCommand('CAPTURELEN')
     config = DictCommand('CAPTURECFG', ChannelDict)
     max_rate = FloatGetCommand('CAPTURERATEMAX')
@@ -568,7 +587,19 @@ class DataCapture(Component):
     data_size_in_bytes = IntGetCommand('CAPTUREBYTES')
     data_size_in_kilobytes = IntGetCommand('CAPTUREPROG')
 
+    @property
+    def buffer(self):
+        """
+        CaptureBuffer to read a part of the capture buffer with an index or a slice,
+        such as lia.capture.buffer[10000:20000]. It is refreshed when a capture starts.
+        """
+        if self._capture_buffer is None:
+            self._capture_buffer = CaptureBuffer(self)
+        return self._capture_buffer
+
     def start(self, run_mode=0, trigger_mode=0):
+        if self._capture_buffer is not None:
+            self._capture_buffer.refresh()
         self.comm.send('CAPTURESTART {}, {}'.format(run_mode, trigger_mode))
 
     def stop(self):
@@ -587,52 +618,73 @@ class DataCapture(Component):
         """
         Use the CAPTUREGET? binary transfer command to retrieve the entire capture buffer. 
 
+        The data is read block by block into one float32 array preallocated from CAPTUREBYTES,
+        without converting each value to a Python float.
+
         :returns: a numpy array of single precision floats, with one, two, or four columns 
         depending on the value of CAPTURECFG.
         The length of each column depends on the number of data points in the capture buffer.
+        Each column is a view of the array holding the data in the order of the capture buffer.
         """
-        data_type = self.config                
-        bytes_remaining = self.data_size_in_bytes
-        start_index_kb = 0
-        vals = []
-        
+        data_type = self.config
+        if data_type not in self.ColumnCountDict:
+            raise ValueError('Invalid data type {} in get_all_data()'.format(data_type))
+        column = self.ColumnCountDict[data_type]
+        row = self.data_size_in_bytes // (4 * column)
+
+        arr = np.empty((row, column), dtype=self.DataType)
         with self.comm.get_lock():
-            while(bytes_remaining > 0):
-                stop_index_kb = min(64, int(np.ceil(bytes_remaining / 1024.0)))
-                self.comm._send(f'CAPTUREGET? {start_index_kb:d}, {stop_index_kb:d}')
-                buffer = self.comm._read_binary(2)
-                # buffer[0] should be 35            
-                digits = buffer[1] - 48
-                
-                buffer += self.comm._read_binary(digits)
-                offset = digits + 2
-                buffer_size = int(buffer[2: offset])
-                buffer += self.comm._read_binary(buffer_size)
-            
-                data_size_bytes = (len(buffer) - offset)
-                bytes_to_unpack = min(bytes_remaining, data_size_bytes)
-                self.unpack_format = '<{}f'.format(bytes_to_unpack // 4)
-                block_vals = unpack_from(self.unpack_format, buffer, offset)
-                vals += block_vals
-                start_index_kb += stop_index_kb
-                bytes_remaining -= stop_index_kb * 1024
-
-            if data_type == Keys.X:
-                column = 1
-            elif data_type == Keys.XY or data_type == Keys.RT:
-                column = 2
-            elif data_type == Keys.XYRT:
-                column = 4
-            else:
-                ValueError('Invalid data type {} in get_all_data()'.format(data_type))
-                    
-            row = len(vals) // column
-            arr = np.transpose(np.reshape(vals, (row, column))).astype(np.float32)    
-        return arr
+            self._read_blocks_into(arr.reshape(-1).view(np.uint8), 0)
+        return arr.T
+
+    def get_follower(self, poll_interval=0.1):
+        """
+        Return a CaptureFollower that reads only the samples written since its last read.
+        Iterate it after start() to get new samples as numpy blocks until the capture stops.
+        """
+        return CaptureFollower(self, poll_interval)
+
+    def export(self, file_name, file_format=None, callback=None):
+        """
+        Write the capture buffer to a file as each CAPTUREGET? block arrives,
+        without holding the whole buffer in memory. See CaptureExporter for the file formats.
+
+        :param file_format: 'raw', 'npy' or 'csv'. It is found from the extension of file_name if None.
+        :param callback: optional function called after each block with the bytes written so far,
+            the total bytes and the transfer rate in MB/s
+        :returns: a dictionary of the data points and bytes transferred, the elapsed time and the rate
+        """
+        return CaptureExporter(self).export(file_name, file_format, callback)
+
+    def _read_blocks_into(self, out, start_kb):
+        """
+        Read len(out) bytes of the capture buffer starting at start_kb kilobytes into out,
+        with CAPTUREGET? requests of up to MaxBlockKilobytes. The lock of comm should be held.
+
+        :param out: writable uint8 array
+        """
+        received = 0
+        while received < len(out):
+            count_kb = min(self.MaxBlockKilobytes, (len(out) - received + 1023) // 1024)
+            received += self._read_block_into(out[received:], start_kb, count_kb)
+            start_kb += count_kb
+
+    def _read_block_into(self, out, start_kb, count_kb):
+        """
+        Send a CAPTUREGET? request and read its binary block into out, up to the size of out
+
+        :returns: number of bytes read into out
+        """
+        self.comm._send(f'CAPTUREGET? {start_kb:d}, {count_kb:d}')
+        return get_binary_block_reader(self.comm).read_block_into(out)
 
 
 class DataStreamBuffer:
-    def __init__(self, size=10000000):
+    def __init__(self, size=10000000, channel=Keys.XYRT, data_format=Keys.Float32, sample_rate=None):
+        self.channel = channel
+        self.data_format = data_format
+        self.sample_rate = sample_rate
+        self.timebase = StreamTimebase(sample_rate)
         self._data_buffer_size = size
         self._data_points = 0
         self.reset(size)
@@ -646,13 +698,57 @@ class DataStreamBuffer:
         self.r = np.empty(self._data_buffer_size)
         self.th = np.empty(self._data_buffer_size)
 
+    def set_stream_config(self, channel, data_format, sample_rate=None):
+        """
+        Set the stream configuration before reset().
+        It is used by subclasses that store data depending on the configuration.
+        """
+        self.channel = channel
+        self.data_format = data_format
+        self.sample_rate = sample_rate
+        self.timebase.reset(sample_rate)
+
     def get_buffer_size(self):
         return self._data_buffer_size
 
     def get_data_size(self):
         return self._data_points
 
-    def add_data_block(self, x, y, r, th):
+    def get_first_index(self):
+        """
+        Return the sample index of the first data point in the buffer
+        """
+        return 0
+
+    def find_index(self, time_values):
+        """
+        Return the buffer indices where time_values would be inserted to keep the time order
+        """
+        return np.searchsorted(self.time[:self.get_data_size()], time_values)
+
+    def get_datetime(self, key=slice(None)):
+        """
+        Return the host time of an index or a slice of the data points in the buffer as datetime64,
+        computed from the timebase. The sample rate is required.
+        """
+        indices = range(self.get_data_size())[key]
+        if isinstance(indices, range):
+            indices = np.arange(indices.start, indices.stop, indices.step)
+        return self.timebase.get_datetime64(indices + self.get_first_index())
+
+    def get_latest(self, count):
+        """
+        Return views of time, x, y, r and th for the latest count data points
+        """
+        final = self.get_data_size()
+        init = max(final - count, 0)
+        return self.time[init: final], self.x[init: final], self.y[init: final], \
+               self.r[init: final], self.th[init: final]
+
+    def add_data_block(self, x, y=None, r=None, th=None):
+        """
+        Add a block of data points. Y, R and Theta not given, as with the X channel, are NaN.
+        """
         block_size = x.size
         init = self._data_points
         final = init + block_size
@@ -661,12 +757,12 @@ class DataStreamBuffer:
         if final > self._data_buffer_size:
             raise IndexError('Data reached the data buffer size.')
 
-        ti = np.arange(init, final)
-        self.time[init: final] = ti
+        # Time in seconds with the sample rate, or the sample index without it
+        self.time[init: final] = self.timebase.get_seconds(np.arange(init, final))
         self.x[init: final] = x
-        self.y[init: final] = y
-        self.r[init: final] = r
-        self.th[init: final] = th
+        self.y[init: final] = np.nan if y is None else y
+        self.r[init: final] = np.nan if r is None else r
+        self.th[init: final] = np.nan if th is None else th
         self._data_points = final
 
 
@@ -700,69 +796,292 @@ class DataStream(Component):
         super().__init__(parent)
         self.data_buffer_size = buffer_size
         self.data = DataStreamBuffer(self.data_buffer_size)
+        self.reader = None
+        self.replaying = False
+        self.instrument_enabled = False
+        self.receiving = False
+        self.decimator = None
+        self.statistics = None
+        self.publisher = None
+
+    def set_data_buffer(self, data_buffer):
+        """
+        Replace the data buffer with an instance of DataStreamBuffer or its subclass.
+        The buffer will be reset with its current buffer size when streaming starts.
+        """
+        self.data = data_buffer
+        self.data_buffer_size = data_buffer.get_buffer_size()
+
+    def get_option_value(self, little_endian=False, integrity_check=False):
+        """
+        Return the value of STREAMOPTION with the given option bits
+        """
+        option = 0
+        if little_endian:
+            option |= self.OptionBitDict[Keys.LittleEndian]
+        if integrity_check:
+            option |= self.OptionBitDict[Keys.DataIntegrityChecking]
+        return option
+
+    def set_decimator(self, decimator):
+        """
+        Set a decimator used by store_block() before the data buffer, or None to store every sample.
+        Set it before streaming starts, so that the data buffer gets the decimated sample rate.
+        Decimated int16 data is stored as float32, because averages are not integers.
+
+        :param decimator: an instance of a subclass of Decimator, such as
+            BlockMeanDecimator, CicDecimator or MinMaxDecimator
+        :raises ValueError: if a decimator is set while streaming into a buffer of int16 values
+        """
+        if decimator is not None and self.receiving and \
+                getattr(self.data, 'data_format', None) == Keys.Int16 and hasattr(self.data, 'raw'):
+            raise ValueError('A decimator cannot be set while streaming int16 data into {}. '
+                             'Set it before streaming starts.'.format(type(self.data).__name__))
+        self.decimator = decimator
+
+    def get_storage_format(self, data_format):
+        """
+        Return the data format stored in the data buffer for the streamed data format:
+        float32 with a decimator, or the streamed format without it
+        """
+        return Keys.Float32 if self.decimator is not None else data_format
+
+    def set_statistics(self, statistics):
+        """
+        Set a RunningStatistics updated by store_block() with the blocks stored, or None.
+        It is reset with the sample rate of the data buffer when streaming starts.
+        """
+        self.statistics = statistics
+
+    def set_publisher(self, publisher):
+        """
+        Set a StreamPublisher that store_block() publishes the blocks stored to, or None.
+        Its sample index is reset when streaming starts.
+        """
+        self.publisher = publisher
+
+    def store_block(self, block):
+        """
+        Add a decoded block to the data buffer after the decimator, if set,
+        update the running statistics, if set, and publish the block to the subscribers, if set
 
-    def _prepare(self):
+        :returns: the block added to the data buffer
+        """
+        self.update_timebase()
+        if self.decimator is not None:
+            block = self.decimator.process(block)
+        if block.shape[1]:
+            self.data.add_data_block(*block)
+            if self.statistics is not None:
+                self.statistics.add_block(block)
+            if self.publisher is not None:
+                self.publisher.publish(block)
+        return block
+
+    def update_timebase(self):
+        """
+        Anchor the timebase of the data buffer to the host clock with the first block,
+        and re-anchor it at the gaps of lost packets found by the tracker since the last call,
+        so that times in the data buffer stay in line with the host clock after packet loss.
+        It is called by store_block() after receiving a block and before storing it.
+        """
+        timebase = getattr(self.data, 'timebase', None)
+        if timebase is None or not timebase.period or not self.sample_rate or self.reader is None:
+            return
+        tracker = self.reader.tracker
+        now = time.time()
+        received = tracker.sample_index
+        # Data points in the buffer for each sample received, with decimation
+        scale = timebase.sample_rate / self.sample_rate
+        if self._timebase_gaps is None:
+            # The first sample is assumed to be received at the rate of the stream until now
+            timebase.set_anchor(0, now - (received + tracker.lost_samples) / self.sample_rate)
+            self._timebase_gaps = 0
+
+        samples_per_packet = tracker.samples_per_packet
+        wrap_period = 256 * samples_per_packet / self.sample_rate
+        for sample_index, lost in tracker.gaps[self._timebase_gaps:]:
+            timebase.add_gap(int(round(sample_index * scale)),
+                             lost * samples_per_packet / self.sample_rate,
+                             now - (received - sample_index) / self.sample_rate,
+                             wrap_period)
+        self._timebase_gaps = len(tracker.gaps)
+
+    def _prepare(self, little_endian=False, integrity_check=False):
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.udp_socket.bind(('', self.port))
         self.timeout = 10
-        self.option = 2
+        option = self.get_option_value(little_endian, integrity_check)
+        self.option = option
         self.udp_socket.settimeout(self.timeout)
-        self.prepared_channel = self.channel
-
-        self.prepared_packet_size = self.packet_size
-        self.unpack_format = '>{}h'.format(self.prepared_packet_size // 2) if self.format == 'int16' else\
-                             '>{}f'.format(self.prepared_packet_size // 4)
+        self._prepare_decoding(self.channel, self.format, self.packet_size,
+                               self.max_rate / 2 ** self.rate, option)
+
+    def _prepare_decoding(self, channel, data_format, packet_size, sample_rate, option=0):
+        self.prepared_option = option
+        self.prepared_channel = channel
+        self.prepared_format = data_format
+        self.prepared_packet_size = packet_size
+        self.decoder = StreamDecoder(self.prepared_channel, self.prepared_format, self.prepared_packet_size,
+                                     bool(option & self.OptionBitDict[Keys.LittleEndian]))
+        if option & self.OptionBitDict[Keys.DataIntegrityChecking]:
+            # Content code in the packet header: the channel code, plus 4 for int16 data
+            self.decoder.set_header_check(self.ChannelDict[channel] + 4 * self.FormatDict[data_format],
+                                          self.PacketSizeDict[packet_size])
+        self.sample_rate = sample_rate
+        data_rate = self.sample_rate
+        if self.decimator is not None:
+            self.decimator.reset()
+            data_rate = self.decimator.get_output_rate(self.sample_rate)
+        if self.statistics is not None:
+            self.statistics.reset()
+            self.statistics.sample_rate = data_rate
+        if self.publisher is not None:
+            self.publisher.sample_index = 0
+        self.data.set_stream_config(self.prepared_channel, self.get_storage_format(self.prepared_format),
+                                    data_rate)
         self.data.reset(self.data_buffer_size)
+        self._timebase_gaps = None  # Number of tracker gaps applied to the timebase
 
     def receive_packet(self):
-        buffer, _ = self.udp_socket.recvfrom(self.prepared_packet_size + 4)
-        header = unpack_from('>I', buffer)[0]
-        packet_number = header & 0xff
-
-        # from the manual page 172
-        packet_content = (header >> 8) & 0x0f
-        packet_size = (header >> 12) & 0x0f
-        packet_rate = (header >> 16) & 0xff
-        packet_status = (header >> 24) & 0xff
-
-        vals = unpack_from(self.unpack_format, buffer, 4)
-
-        arr = None
-        if self.prepared_channel == Keys.X:
-            arr = np.array(vals)
-
-        elif self.prepared_channel == Keys.XY:
-            rows = len(vals) // 2
-            mat = np.transpose(np.reshape(vals, (rows, 2)))
-            r = np.sqrt(np.square(mat[0]) + np.square(mat[1]))
-            th = 180.0 / np.pi * np.arctan2(mat[1], mat[0])
-            arr = np.append(np.append(mat, np.reshape(r, (1, rows)), axis=0),
-                            np.reshape(th, (1,rows)), axis=0)
-
-        elif self.prepared_channel == Keys.RT:
-            rows = len(vals) // 2
-            mat = np.transpose(np.reshape(vals, (rows, 2)))
-            angle = np.pi / 180.0 * mat[1]
-            x = mat[0] * np.cos(angle)
-            y = mat[0] * np.sin(angle)
-            arr = np.append(np.append(np.reshape(x, (1, rows)),
-                                      np.reshape(y, (1, rows)), axis=0),
-                            mat, axis=0)
-
-        elif self.prepared_channel == Keys.XYRT:
-            row = len(vals) // 4
-            arr = np.transpose(np.reshape(vals, (row, 4)))
-        else:
-            raise ValueError(f'{self.prepared_channel} is not in ChannelDict')
-        return arr, packet_number
+        """
+        Receive a packet from the UDP socket and decode it.
+        Other ways to receive packets are in self.reader, a StreamReader created when streaming starts.
 
-    def start(self):
-        self._prepare()
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and the packet number. The array is reused by the next call; copy it to keep it.
+        """
+        return self.reader.receive_packet()
+
+    def get_loss_counters(self):
+        """
+        Return the packet counters from the packet headers: received, lost, lost_samples,
+        reordered, duplicates, corrupt and gaps. See PacketTracker for the status of the packets.
+        """
+        if self.reader is None:
+            return {}
+        return self.reader.get_loss_counters()
+
+    def get_receiver_counters(self):
+        """
+        Return the packet counters of the receiver thread or the asyncio protocol of self.reader
+        while streaming, or an empty dictionary
+        """
+        if self.reader is None:
+            return {}
+        return self.reader.get_receiver_counters()
+
+    async def blocks(self, max_packets=64, queue_size=4096, policy=StreamProtocol.DropOldest,
+                     start=True, little_endian=False, integrity_check=False):
+        """
+        Asynchronous generator of decoded blocks using an asyncio DatagramProtocol,
+        so that many instruments can stream into one event loop.
+
+            async for block, packet_numbers in lia.stream.blocks():
+                lia.stream.store_block(block)
+
+        Streaming stops with STREAM OFF when the loop ends, or the task is cancelled.
+        See StreamReader.blocks() for the parameters.
+
+        :param start: if True, streaming starts on the instrument. Use False to receive
+            with the socket bound by listen().
+        """
+        if start:
+            self._prepare(little_endian, integrity_check)
+            self.replaying = False
+            self._start_receiving(False, 0, None)
+        reader_blocks = self.reader.blocks(max_packets, queue_size, policy)
+        try:
+            if start:
+                self.enable = True
+                self.instrument_enabled = True
+            async for block in reader_blocks:
+                yield block
+        finally:
+            await reader_blocks.aclose()
+            self.stop()
+
+    def start(self, threaded=False, ring_size=4096, record_file_name=None,
+              little_endian=False, integrity_check=False):
+        """
+        Start streaming.
+
+        :param threaded: if True, a receiver thread drains the UDP socket into a ring of
+            ring_size packets, and reader.receive_blocks() is used instead of receive_packet().
+        :param record_file_name: if given, received packets are recorded to the file
+            to be used with replay() later.
+        :param little_endian: if True, data is streamed in little-endian byte order,
+            which is decoded without byte swapping on x86 computers.
+        :param integrity_check: if True, data integrity checking is enabled, and the length and
+            header of every packet are verified. Samples of corrupt packets are replaced with NaN
+            and counted in get_loss_counters(). It is off by default, because the content code
+            expected in the header, the channel code plus 4 for int16 data, is not confirmed
+            with every firmware. If every packet fails the check, an error is logged once.
+        """
+        self._prepare(little_endian, integrity_check)
+        self.replaying = False
+        self._start_receiving(threaded, ring_size, record_file_name)
         self.enable = True
+        self.instrument_enabled = True
+
+    def listen(self, channel, data_format, packet_size, sample_rate=None, port=0,
+               threaded=False, ring_size=4096, record_file_name=None,
+               little_endian=False, integrity_check=False):
+        """
+        Receive packets on a UDP port from a source other than the instrument,
+        such as StreamEmulator, with the given stream configuration.
+        No command is sent to the instrument.
+
+        :param port: UDP port to bind. With 0, a free port is used, available from udp_socket.getsockname()
+        """
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind(('', port))
+        self.timeout = 10
+        self.udp_socket.settimeout(self.timeout)
+        self._prepare_decoding(channel, data_format, packet_size, sample_rate,
+                               self.get_option_value(little_endian, integrity_check))
+        self.replaying = False
+        self.instrument_enabled = False
+        self._start_receiving(threaded, ring_size, record_file_name)
+
+    def replay(self, file_name, threaded=False, ring_size=4096, repeat=1):
+        """
+        Decode packets recorded in a file with start(record_file_name=...) instead of packets
+        from the UDP socket. Packets are returned as fast as requested by receive_packet(),
+        or reader.receive_packets() and reader.receive_blocks(), repeat times.
+        With threaded=True, the receiver thread waits for the consumer when the ring is full,
+        so that no packet is dropped, and it exits at the end of the file. Then reader.receive_blocks()
+        returns empty arrays without waiting for the timeout, and reader.receiver.finished is True.
+        No command is sent to the instrument.
+        """
+        self.udp_socket = PacketReplay(file_name, repeat)
+        self.timeout = 1
+        self.udp_socket.settimeout(self.timeout)
+        self._prepare_decoding(self.udp_socket.channel, self.udp_socket.data_format,
+                               self.udp_socket.packet_size, self.udp_socket.sample_rate,
+                               self.udp_socket.option)
+        self.replaying = True
+        self.instrument_enabled = False
+        self._start_receiving(threaded, ring_size, None)
+
+    def _start_receiving(self, threaded, ring_size, record_file_name):
+        recorder = None
+        if record_file_name:
+            recorder = PacketRecorder(record_file_name, self.prepared_channel, self.prepared_format,
+                                      self.prepared_packet_size, self.prepared_option, self.sample_rate)
+        self.reader = StreamReader(self.udp_socket, self.decoder, self.timeout, self.replaying, recorder,
+                                   self.sample_rate)
+        self.receiving = True
+        if threaded:
+            self.reader.start_receiver(ring_size)
 
     def stop(self):
-        self.enable = False
-        self.udp_socket.close()
+        if self.instrument_enabled:
+            self.enable = False
+            self.instrument_enabled = False
+        if self.reader is not None:
+            self.reader.close()
+        self.receiving = False
 
 
 class System(Component):
@@ -0,0 +1,100 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import asyncio
+import collections
+
+
+class StreamProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol that collects streamed packets in a bounded queue
+    for DataStream.blocks().
+
+    When the queue is full, the oldest packet is dropped with the 'drop-oldest' policy.
+    With the 'block' policy, the transport stops reading until the consumer takes
+    half of the queue, and packets wait in the socket buffer instead. If the transport
+    cannot pause reading, the packets that do not fit in the queue are dropped.
+    """
+    DropOldest = 'drop-oldest'
+    Block = 'block'
+
+    def __init__(self, max_packets=4096, policy=DropOldest):
+        if policy not in (self.DropOldest, self.Block):
+            raise ValueError(f'Invalid policy: {policy}')
+        self.max_packets = max_packets
+        self.policy = policy
+        self.queue = collections.deque()
+        self.transport = None
+        self.error = None
+        self.closed = False
+        self.paused = False
+
+        self.received_packets = 0
+        self.dropped_packets = 0
+        self._waiter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received_packets += 1
+        if len(self.queue) >= self.max_packets:
+            if self.policy == self.Block and not self.paused and hasattr(self.transport, 'pause_reading'):
+                # Keep this packet and leave the following ones in the socket buffer
+                self.transport.pause_reading()
+                self.paused = True
+            else:
+                self.dropped_packets += 1
+                if self.policy == self.Block:
+                    return
+                self.queue.popleft()
+        self.queue.append((data, time.time()))
+        self._wake_up()
+
+    def error_received(self, exc):
+        self.error = exc
+        self._wake_up()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._wake_up()
+
+    def _wake_up(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get_packets(self, max_count, timeout=None):
+        """
+        Wait for packets and return a list of up to max_count (packet, timestamp) tuples.
+        It returns an empty list when the transport is closed.
+
+        :raises asyncio.TimeoutError: if no packet arrives before timeout
+        """
+        while not self.queue:
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            if self.closed:
+                return []
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            finally:
+                self._waiter = None
+
+        count = min(max_count, len(self.queue))
+        packets = [self.queue.popleft() for _ in range(count)]
+        if self.paused and len(self.queue) <= self.max_packets // 2:
+            self.paused = False
+            self.transport.resume_reading()
+        return packets
+
+    def get_counters(self):
+        return {
+            'received': self.received_packets,
+            'dropped': self.dropped_packets,
+            'pending': len(self.queue),
+        }
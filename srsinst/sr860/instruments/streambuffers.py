@@ -0,0 +1,583 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import os
+import time
+import numpy as np
+
+from .keys import Keys
+from .components import DataStreamBuffer, DataCapture, DataStream
+from .streampool import attach_shared_memory, create_shared_memory, unlink_shared_memory
+
+try:
+    from multiprocessing import shared_memory
+    SHARED_MEMORY_AVAILABLE = True
+except (ImportError, ModuleNotFoundError):
+    SHARED_MEMORY_AVAILABLE = False
+
+
+class RollingDataStreamBuffer(DataStreamBuffer):
+    """
+    DataStreamBuffer that keeps the latest size data points instead of raising IndexError.
+
+    Every data point is written at two positions, index % size and index % size + size,
+    so the latest data points are always available as contiguous views
+    of time, x, y, r and th, without copying the buffer.
+    """
+    _Rows = ('time', 'x', 'y', 'r', 'th')
+
+    def reset(self, size=10000000):
+        self._data_buffer_size = size
+        self._data_points = 0  # Total number of data points added since reset
+        self._storage = np.empty((len(self._Rows), 2 * size))
+
+    def _window(self, row):
+        size = self._data_buffer_size
+        count = min(self._data_points, size)
+        end = self._data_points % size + size
+        return self._storage[row, end - count: end]
+
+    @property
+    def time(self):
+        return self._window(0)
+
+    @property
+    def x(self):
+        return self._window(1)
+
+    @property
+    def y(self):
+        return self._window(2)
+
+    @property
+    def r(self):
+        return self._window(3)
+
+    @property
+    def th(self):
+        return self._window(4)
+
+    def get_data_size(self):
+        """
+        Return the number of data points available in the buffer
+        """
+        return min(self._data_points, self._data_buffer_size)
+
+    def get_first_index(self):
+        return self._data_points - self.get_data_size()
+
+    def get_total_size(self):
+        """
+        Return the total number of data points added since reset
+        """
+        return self._data_points
+
+    def get_latest(self, count):
+        size = self._data_buffer_size
+        count = min(count, self.get_data_size())
+        end = self._data_points % size + size
+        return tuple(self._storage[:, end - count: end])
+
+    def add_data_block(self, x, y=None, r=None, th=None):
+        block_size = x.size
+        size = self._data_buffer_size
+        init = self._data_points
+        final = init + block_size
+
+        # Only the latest size points of a block larger than the buffer are kept
+        skip = max(block_size - size, 0)
+        rows = (self.timebase.get_seconds(np.arange(init + skip, final)), x[skip:],
+                *(np.full(block_size - skip, np.nan) if values is None else values[skip:]
+                  for values in (y, r, th)))
+
+        start = (init + skip) % size
+        first = min(block_size - skip, size - start)
+        for i, values in enumerate(rows):
+            self._storage[i, start: start + first] = values[:first]
+            self._storage[i, start + size: start + size + first] = values[:first]
+            remaining = len(values) - first
+            if remaining > 0:
+                self._storage[i, :remaining] = values[first:]
+                self._storage[i, size: size + remaining] = values[first:]
+        self._data_points = final
+
+
+class LazyColumn:
+    """
+    Column of a CompactDataStreamBuffer that is computed only for the requested index or slice
+    """
+    def __init__(self, data_buffer, name):
+        self.data_buffer = data_buffer
+        self.name = name
+
+    def __len__(self):
+        return self.data_buffer.get_data_size()
+
+    def __getitem__(self, key):
+        return self.data_buffer.get_column(self.name, key)
+
+
+class CompactDataStreamBuffer(DataStreamBuffer):
+    """
+    DataStreamBuffer that stores only the streamed channels in their native float32 or int16 type.
+
+    X, Y, R and Theta that are not streamed are computed for the requested slice,
+    and time is computed from the sample index with the timebase.
+    Without the sample rate, time is the sample index.
+
+    In int16 storage, NaN of corrupt packets is stored as InvalidInt16, which the instrument
+    does not send, and the columns are returned as float32 with NaN for it.
+    """
+    ColumnDict = {
+        Keys.X:    ('x',),
+        Keys.XY:   ('x', 'y'),
+        Keys.RT:   ('r', 'th'),
+        Keys.XYRT: ('x', 'y', 'r', 'th')
+    }
+    DataTypeDict = {
+        Keys.Float32: np.float32,
+        Keys.Int16:   np.int16
+    }
+    InvalidInt16 = -32768  # Int16 data from the instrument ranges from -32767 to 32767
+
+    def reset(self, size=10000000):
+        self._data_buffer_size = size
+        self._data_points = 0
+        self.columns = self.ColumnDict[self.channel]
+        self.raw = np.empty((size, len(self.columns)), dtype=self.DataTypeDict[self.data_format])
+        self._add_lazy_columns()
+
+    def _add_lazy_columns(self):
+        self.time = LazyColumn(self, 'time')
+        self.x = LazyColumn(self, 'x')
+        self.y = LazyColumn(self, 'y')
+        self.r = LazyColumn(self, 'r')
+        self.th = LazyColumn(self, 'th')
+
+    def _get_stored(self, name, key):
+        values = self.raw[:self.get_data_size(), self.columns.index(name)][key]
+        if values.dtype == np.int16:
+            values = np.where(values == self.InvalidInt16, np.float32(np.nan), values.astype(np.float32))[()]
+        return values
+
+    def get_column(self, name, key=slice(None)):
+        """
+        Return values of a column for an index or a slice of the data points in the buffer
+
+        :param name: one of 'time', 'x', 'y', 'r' or 'th'
+        """
+        if name == 'time':
+            indices = range(self.get_data_size())[key]
+            if isinstance(indices, range):
+                indices = np.arange(indices.start, indices.stop, indices.step)
+            return self.timebase.get_seconds(indices + self.get_first_index())
+
+        if name in self.columns:
+            return self._get_stored(name, key)
+
+        if self.channel == Keys.XY:
+            x = self._get_stored('x', key)
+            y = self._get_stored('y', key)
+            if name == 'r':
+                return np.hypot(x, y)
+            return np.degrees(np.arctan2(y, x))
+
+        if self.channel == Keys.RT:
+            r = self._get_stored('r', key)
+            angle = np.radians(self._get_stored('th', key))
+            if name == 'x':
+                return r * np.cos(angle)
+            return r * np.sin(angle)
+
+        # Y, R and Theta are not available with the X channel only
+        return np.full_like(self._get_stored('x', key), np.nan, dtype=np.float32)
+
+    def find_index(self, time_values):
+        indices = self.timebase.find_sample_index(time_values) - self.get_first_index()
+        # Round off the floating point error before ceil()
+        indices = np.ceil(np.round(indices, 6))
+        return np.clip(indices, 0, self.get_data_size()).astype(np.int64)
+
+    def get_latest(self, count):
+        final = self.get_data_size()
+        s = slice(max(final - count, 0), final)
+        return tuple(self.get_column(name, s) for name in ('time', 'x', 'y', 'r', 'th'))
+
+    def _reserve(self, final):
+        """
+        Make sure that the buffer can hold final data points
+        """
+        if final > self._data_buffer_size:
+            raise IndexError('Data reached the data buffer size.')
+
+    def add_data_block(self, x, y=None, r=None, th=None):
+        values = {'x': x, 'y': y, 'r': r, 'th': th}
+        init = self._data_points
+        final = init + x.size
+        self._reserve(final)
+
+        for i, name in enumerate(self.columns):
+            column = values[name]
+            if self.raw.dtype == np.int16 and column.dtype.kind == 'f':
+                invalid = np.isnan(column)
+                if invalid.any():
+                    column = np.where(invalid, self.InvalidInt16, column)
+            self.raw[init: final, i] = column
+        self._set_data_points(final)
+
+    def add_raw_block(self, mat):
+        """
+        Add a block of the streamed channels without conversion,
+        such as the return value of StreamDecoder.decode_raw()
+
+        :param mat: array with a column for each streamed channel
+        """
+        mat = mat.reshape(-1, len(self.columns))
+        init = self._data_points
+        final = init + len(mat)
+        self._reserve(final)
+
+        self.raw[init: final] = mat
+        self._set_data_points(final)
+
+    def _set_data_points(self, data_points):
+        self._data_points = data_points
+
+
+class MappedDataStreamBuffer(CompactDataStreamBuffer):
+    """
+    CompactDataStreamBuffer stored in a memory-mapped file for acquisitions larger than RAM.
+
+    The file starts with a header holding the channel, format, sample rate and
+    the number of data points written, followed by the streamed channels in their native type.
+    The file grows by size data points when it is full. Another process can open
+    the file with read_only=True while it is being written, and the number of
+    data points available is updated from the header.
+
+    The anchors of the timebase at the gaps of lost packets are saved in a side file,
+    file_name + '.anchors', replaced when they change, so that a reader computes
+    the same times as the writer.
+    """
+    Magic = b'SR86XSTR'
+    Version = 1
+    HeaderSize = 64
+    HeaderType = np.dtype([
+        ('magic', 'S8'),
+        ('version', '<u4'),
+        ('channel', '<u4'),
+        ('format', '<u4'),
+        ('columns', '<u4'),
+        ('sample_rate', '<f8'),
+        ('data_points', '<u8'),
+        ('start_time', '<f8'),
+    ])
+    ChannelCodeDict = DataCapture.ChannelDict
+    FormatCodeDict = DataStream.FormatDict
+    AnchorFileSuffix = '.anchors'
+
+    def __init__(self, size=1000000, channel=Keys.XYRT, data_format=Keys.Float32, sample_rate=None,
+                 file_name='stream.dat', read_only=False):
+        self.file_name = file_name
+        self.read_only = read_only
+        self.chunk_size = size
+        self.header = None
+        self._saved_anchors = None
+        self._anchor_file_state = None
+        super().__init__(size, channel, data_format, sample_rate)
+
+    @property
+    def anchor_file_name(self):
+        return self.file_name + self.AnchorFileSuffix
+
+    def reset(self, size=1000000):
+        self.close()
+        self.chunk_size = size
+        if self.read_only:
+            self._open_read_only()
+            return
+
+        self.columns = self.ColumnDict[self.channel]
+        self.dtype = np.dtype(self.DataTypeDict[self.data_format])
+        with open(self.file_name, 'wb') as f:
+            f.truncate(self.HeaderSize)
+        self._map_header('r+')
+        self.header['magic'] = self.Magic
+        self.header['version'] = self.Version
+        self.header['channel'] = self.ChannelCodeDict[self.channel]
+        self.header['format'] = self.FormatCodeDict[self.data_format]
+        self.header['columns'] = len(self.columns)
+        self.header['sample_rate'] = self.sample_rate if self.sample_rate else 0.0
+        self.header['data_points'] = 0
+        self.header['start_time'] = time.time()
+
+        self._data_points = 0
+        self._data_buffer_size = 0
+        self._reserve(size)
+        self._add_lazy_columns()
+        self.timebase.reset(self.sample_rate, float(self.header['start_time']))
+        self._save_anchors()
+
+    def _save_anchors(self):
+        # Replaced at once, so that a reader never reads a partly written file
+        anchors = self.timebase.get_anchors()
+        if anchors is self._saved_anchors:
+            return
+        self.header['start_time'] = self.timebase.start_time
+        temp_file_name = self.anchor_file_name + '.tmp'
+        anchors.tofile(temp_file_name)
+        os.replace(temp_file_name, self.anchor_file_name)
+        self._saved_anchors = anchors
+
+    def _load_anchors(self):
+        try:
+            stat = os.stat(self.anchor_file_name)
+        except FileNotFoundError:
+            return
+        state = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if state == self._anchor_file_state:
+            return
+        self._anchor_file_state = state
+        self.timebase.set_anchors(np.fromfile(self.anchor_file_name, dtype=self.timebase.AnchorType))
+
+    def _map_header(self, mode):
+        self.header = np.memmap(self.file_name, dtype=self.HeaderType, mode=mode, shape=())
+
+    def _map_data(self, capacity, mode):
+        self.raw = np.memmap(self.file_name, dtype=self.dtype, mode=mode, offset=self.HeaderSize,
+                             shape=(capacity, len(self.columns)))
+        self._data_buffer_size = capacity
+
+    def _open_read_only(self):
+        self._map_header('r')
+        if bytes(self.header['magic']) != self.Magic:
+            raise ValueError('{} is not a stream data file'.format(self.file_name))
+        channels = {v: k for k, v in self.ChannelCodeDict.items()}
+        formats = {v: k for k, v in self.FormatCodeDict.items()}
+        self.channel = channels[int(self.header['channel'])]
+        self.data_format = formats[int(self.header['format'])]
+        rate = float(self.header['sample_rate'])
+        self.sample_rate = rate if rate > 0 else None
+        self.timebase.reset(self.sample_rate, float(self.header['start_time']))
+        self._anchor_file_state = None
+        self.columns = self.ColumnDict[self.channel]
+        self.dtype = np.dtype(self.DataTypeDict[self.data_format])
+        self._data_points = 0
+        self.raw = np.empty((0, len(self.columns)), dtype=self.dtype)
+        self._data_buffer_size = 0
+        self._add_lazy_columns()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Update the number of data points from the header, map the grown file
+        and load the anchors of the timebase saved by the writer in read-only mode
+        """
+        self._load_anchors()
+        data_points = int(self.header['data_points'])
+        if data_points > self._data_buffer_size:
+            row_size = self.dtype.itemsize * len(self.columns)
+            capacity = (os.path.getsize(self.file_name) - self.HeaderSize) // row_size
+            self._map_data(capacity, 'r')
+        self._data_points = min(data_points, self._data_buffer_size)
+
+    def get_data_size(self):
+        if self.read_only and self.header is not None:
+            self.refresh()
+        return self._data_points
+
+    def _reserve(self, final):
+        if self.read_only:
+            raise ValueError('{} is opened in read-only mode'.format(self.file_name))
+        if final <= self._data_buffer_size:
+            return
+        chunks = (final - self._data_buffer_size + self.chunk_size - 1) // self.chunk_size
+        capacity = self._data_buffer_size + chunks * self.chunk_size
+        if self._data_buffer_size:
+            self.raw.flush()
+        row_size = self.dtype.itemsize * len(self.columns)
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(self.HeaderSize + capacity * row_size)
+        self._map_data(capacity, 'r+')
+
+    def _set_data_points(self, data_points):
+        self._data_points = data_points
+        # The anchors are updated by DataStream before the data points of a block are added
+        self._save_anchors()
+        # Written after the data, so that a reader never sees data points not written yet
+        self.header['data_points'] = data_points
+
+    def flush(self):
+        """
+        Write the changes in the memory maps to the file
+        """
+        if self.header is not None and not self.read_only:
+            self.raw.flush()
+            self.header.flush()
+
+    def close(self):
+        """
+        Flush and release the memory maps
+        """
+        self.flush()
+        self.header = None
+        self.raw = None
+
+
+class SharedDataStreamBuffer(RollingDataStreamBuffer):
+    """
+    RollingDataStreamBuffer stored in a named multiprocessing.shared_memory block,
+    so that other processes can read the latest data points without copying or sockets.
+
+    The block starts with the header of MappedDataStreamBuffer and the buffer size,
+    followed by the mirrored rows of time, x, y, r and th. The number of data points
+    in the header is updated after the data is written. A reader attaches with create=False,
+    and its view follows the writer. A reader has to read the latest data points
+    before the writer overwrites them, within size data points.
+
+    The time row is computed by the writer with the anchors of its timebase at the gaps
+    of lost packets, and the writer updates the start time in the header when the first
+    data point is anchored, so that get_datetime() of a reader gives the times of the writer.
+    """
+    Magic = b'SR86XSHM'
+    Version = 1
+    HeaderSize = MappedDataStreamBuffer.HeaderSize
+    HeaderType = np.dtype(MappedDataStreamBuffer.HeaderType.descr + [('buffer_size', '<u8')])
+    ChannelCodeDict = MappedDataStreamBuffer.ChannelCodeDict
+    FormatCodeDict = MappedDataStreamBuffer.FormatCodeDict
+
+    def __init__(self, size=1000000, channel=Keys.XYRT, data_format=Keys.Float32, sample_rate=None,
+                 name='sr860_stream', create=True):
+        if not SHARED_MEMORY_AVAILABLE:
+            raise ImportError('multiprocessing.shared_memory is not available. Python 3.8 or later is required.')
+        self.name = name
+        self.create = create
+        self.memory = None
+        self.header = None
+        self._unlinked = True
+        self._saved_anchors = None
+        super().__init__(size, channel, data_format, sample_rate)
+
+    def reset(self, size=1000000):
+        self.close()
+        if not self.create:
+            self._attach()
+            return
+
+        rows = len(self._Rows)
+        try:
+            self.memory = create_shared_memory(self.name, self.HeaderSize + rows * 2 * size * 8)
+        except FileExistsError:
+            # Left over from a writer that did not close
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+            self.memory = create_shared_memory(self.name, self.HeaderSize + rows * 2 * size * 8)
+        self._unlinked = False
+        self._map(size)
+        self.header['magic'] = self.Magic
+        self.header['version'] = self.Version
+        self.header['channel'] = self.ChannelCodeDict[self.channel]
+        self.header['format'] = self.FormatCodeDict[self.data_format]
+        self.header['columns'] = rows
+        self.header['sample_rate'] = self.sample_rate if self.sample_rate else 0.0
+        self.header['data_points'] = 0
+        self.header['buffer_size'] = size
+        self.timebase.reset(self.sample_rate)
+        self.header['start_time'] = self.timebase.start_time
+        self._saved_anchors = self.timebase.get_anchors()
+
+    def _map(self, size):
+        # np.frombuffer() keeps the buffer of the block exported while a view is in use,
+        # so that the block cannot be unmapped under it
+        rows = len(self._Rows)
+        self.header = np.frombuffer(self.memory.buf, self.HeaderType, 1).reshape(())
+        self._storage = np.frombuffer(self.memory.buf, np.float64, rows * 2 * size,
+                                      self.HeaderSize).reshape(rows, 2 * size)
+        self._data_buffer_size = size
+        self._data_points = 0
+
+    def _attach(self):
+        self.memory = attach_shared_memory(self.name)
+        header = np.frombuffer(self.memory.buf, self.HeaderType, 1).reshape(())
+        if bytes(header['magic']) != self.Magic:
+            del header
+            self.close()
+            raise ValueError('{} is not a shared stream buffer'.format(self.name))
+        channels = {v: k for k, v in self.ChannelCodeDict.items()}
+        formats = {v: k for k, v in self.FormatCodeDict.items()}
+        self.channel = channels[int(header['channel'])]
+        self.data_format = formats[int(header['format'])]
+        rate = float(header['sample_rate'])
+        self.sample_rate = rate if rate > 0 else None
+        self.timebase.reset(self.sample_rate, float(header['start_time']))
+        size = int(header['buffer_size'])
+        del header
+        self._map(size)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Update the number of data points from the header in a reader
+        """
+        if not self.create and self.header is not None:
+            self._data_points = int(self.header['data_points'])
+
+    def _window(self, row):
+        self.refresh()
+        return super()._window(row)
+
+    def get_data_size(self):
+        self.refresh()
+        return super().get_data_size()
+
+    def get_total_size(self):
+        self.refresh()
+        return self._data_points
+
+    def get_latest(self, count):
+        self.refresh()
+        return super().get_latest(count)
+
+    def add_data_block(self, x, y=None, r=None, th=None):
+        if not self.create:
+            raise ValueError('{} is attached as a reader'.format(self.name))
+        super().add_data_block(x, y, r, th)
+        if self.timebase.get_anchors() is not self._saved_anchors:
+            self._saved_anchors = self.timebase.get_anchors()
+            self.header['start_time'] = self.timebase.start_time
+        # Written after the data, so that a reader never sees data points not written yet
+        self.header['data_points'] = self._data_points
+
+    def get_datetime(self, key=slice(None)):
+        """
+        Return the host time of an index or a slice of the data points in the buffer as datetime64,
+        from the time row and the start time written by the writer. The sample rate is required.
+        """
+        if not self.sample_rate:
+            raise ValueError('Sample rate is not set')
+        self.refresh()
+        start = np.datetime64(int(round(float(self.header['start_time']) * 1e9)), 'ns')
+        return start + np.round(np.asarray(self.time[key]) * 1e9).astype('timedelta64[ns]')
+
+    def close(self):
+        """
+        Release the shared memory block. The writer removes its name first,
+        so that a new block can be created with the name.
+        The views of the data, such as x or the arrays of get_latest(), are views of the block.
+        Release them, or copy the data to keep it, before closing.
+
+        :raises BufferError: if views of the data are still in use. The block stays mapped,
+            and close() can be called again after they are released.
+        """
+        if self.memory is None:
+            return
+        self.header = None
+        self._storage = None
+        if self.create and not self._unlinked:
+            unlink_shared_memory(self.memory)
+            self._unlinked = True
+        self.memory.close()
+        self.memory = None
+
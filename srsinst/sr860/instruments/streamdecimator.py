@@ -0,0 +1,143 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import numpy as np
+
+
+class Decimator:
+    """
+    Base class of decimators of decoded stream blocks between DataStream and its data buffer.
+
+    process() takes a float32 array with rows of X, Y, R and Theta (or a single row of X)
+    and returns the decimated rows. Samples that do not complete an output sample are kept
+    for the next block, so the output does not depend on how the samples are split into packets.
+    """
+    def __init__(self, factor):
+        if factor < 1:
+            raise ValueError('Decimation factor should be 1 or larger')
+        self.factor = int(factor)
+        self.reset()
+
+    def reset(self):
+        self._pending = None
+
+    def get_output_rate(self, sample_rate):
+        """
+        Return the rate of the output samples for the input sample_rate
+        """
+        return sample_rate / self.factor if sample_rate else None
+
+    def _join(self, block):
+        if self._pending is None or self._pending.shape[1] == 0:
+            return block
+        return np.concatenate((self._pending, block), axis=1)
+
+    def process(self, block):
+        raise NotImplementedError
+
+    @staticmethod
+    def update_polar(out):
+        """
+        Recompute R and Theta from the decimated X and Y, because
+        averaging Theta is wrong where it wraps around at +/-180 degrees
+        """
+        if len(out) == 4:
+            x, y, r, th = out
+            np.hypot(x, y, out=r)
+            np.arctan2(y, x, out=th)
+            np.multiply(th, 180.0 / np.pi, out=th)
+        return out
+
+
+class FirDecimator(Decimator):
+    """
+    Decimator that applies an FIR filter kernel and keeps every factor-th output.
+    Only the outputs kept are computed. The last len(kernel) - 1 input samples are
+    carried over to the next block. The first output is available after len(kernel) samples.
+    """
+    def __init__(self, factor, kernel):
+        self.kernel = np.asarray(kernel, dtype=np.float32)[::-1].copy()
+        super().__init__(factor)
+
+    def process(self, block):
+        data = self._join(block)
+        length = len(self.kernel)
+        count = (data.shape[1] - length) // self.factor + 1 if data.shape[1] >= length else 0
+        if count == 0:
+            self._pending = data.copy()
+            return data[:, :0]
+
+        # A view with a window of the kernel length at every factor-th sample
+        windows = np.lib.stride_tricks.as_strided(
+            data, (data.shape[0], count, length),
+            (data.strides[0], self.factor * data.strides[1], data.strides[1]))
+        out = np.matmul(windows, self.kernel)
+        self._pending = data[:, count * self.factor:].copy()
+        return self.update_polar(out)
+
+
+class BlockMeanDecimator(FirDecimator):
+    """
+    Decimator that averages every factor samples
+    """
+    def __init__(self, factor):
+        super().__init__(factor, np.full(int(factor), 1.0 / factor))
+
+
+class CicDecimator(Decimator):
+    """
+    Decimator with the response of a CIC filter of order stages and a differential delay of 1,
+    normalized to the DC gain of 1. Each stage is a moving sum of factor samples, an integrator
+    and a comb computed with a cumulative sum in float64 over the block, and the last stage is
+    computed only at the outputs kept. The cost is proportional to order per input sample,
+    and the integrator values do not grow beyond a block as in floating point CIC filters.
+    The last order * (factor - 1) input samples are carried over to the next block.
+    """
+    def __init__(self, factor, order=3):
+        if order < 1:
+            raise ValueError('CIC filter order should be 1 or larger')
+        self.order = int(order)
+        super().__init__(factor)
+        self.length = self.order * (self.factor - 1) + 1  # Length of the equivalent FIR kernel
+        self.gain = float(self.factor) ** self.order
+
+    def process(self, block):
+        data = self._join(block)
+        count = (data.shape[1] - self.length) // self.factor + 1 if data.shape[1] >= self.length else 0
+        if count == 0:
+            self._pending = data.copy()
+            return data[:, :0]
+
+        sums = data.astype(np.float64)
+        for _ in range(self.order - 1):
+            cumulative = np.cumsum(sums, axis=1)
+            sums = cumulative[:, self.factor - 1:].copy()
+            sums[:, 1:] -= cumulative[:, :-self.factor]
+        cumulative = np.zeros((sums.shape[0], sums.shape[1] + 1))
+        np.cumsum(sums, axis=1, out=cumulative[:, 1:])
+        starts = np.arange(count) * self.factor
+        out = (cumulative[:, starts + self.factor] - cumulative[:, starts]) / self.gain
+        self._pending = data[:, count * self.factor:].copy()
+        return self.update_polar(out.astype(np.float32))
+
+
+class MinMaxDecimator(Decimator):
+    """
+    Decimator that keeps the minimum and the maximum of every factor samples
+    of each row, interleaved as two output samples, to draw the envelope of the signal.
+    """
+    def get_output_rate(self, sample_rate):
+        return 2.0 * sample_rate / self.factor if sample_rate else None
+
+    def process(self, block):
+        data = self._join(block)
+        count = data.shape[1] // self.factor
+        used = count * self.factor
+        groups = data[:, :used].reshape(data.shape[0], count, self.factor)
+        out = np.empty((data.shape[0], 2 * count), dtype=data.dtype)
+        np.min(groups, axis=2, out=out[:, 0::2])
+        np.max(groups, axis=2, out=out[:, 1::2])
+        self._pending = data[:, used:].copy()
+        return out
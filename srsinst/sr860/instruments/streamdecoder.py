@@ -0,0 +1,214 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+from struct import unpack_from
+import numpy as np
+
+from .keys import Keys
+
+
+class StreamDecoder:
+    """
+    Decode the payload of SR86x UDP streaming packets with numpy.
+
+    The payload is read with np.frombuffer in the data type selected with
+    STREAMFMT, and the columns are converted into a preallocated float32 array
+    with rows of X, Y, R and Theta. For the X channel, only one row is used.
+
+    The length of each packet is verified before the payload is used, and with
+    set_header_check(), the content and size in the header as well.
+    """
+    HeaderSize = 4
+
+    ColumnDict = {
+        Keys.X:    1,
+        Keys.XY:   2,
+        Keys.RT:   2,
+        Keys.XYRT: 4
+    }
+    DataTypeDict = {
+        Keys.Float32: 'f4',
+        Keys.Int16:   'i2'
+    }
+
+    def __init__(self, channel=Keys.XYRT, data_format=Keys.Float32, packet_size=1024,
+                 little_endian=False, max_packets=1):
+        if channel not in self.ColumnDict:
+            raise ValueError(f'{channel} is not in ChannelDict')
+        if data_format not in self.DataTypeDict:
+            raise ValueError(f'{data_format} is not in FormatDict')
+
+        self.channel = channel
+        self.data_format = data_format
+        self.packet_size = packet_size
+        self.little_endian = little_endian
+        self.columns = self.ColumnDict[channel]
+        self.rows = 1 if channel == Keys.X else 4
+
+        byte_order = '<' if little_endian else '>'
+        self.dtype = np.dtype(byte_order + self.DataTypeDict[data_format])
+        self.samples_per_packet = packet_size // self.dtype.itemsize // self.columns
+        self.values_per_packet = self.samples_per_packet * self.columns
+
+        self._out = None
+        self.max_packets = 0
+        self.allocate(max_packets)
+
+        self.header_check = None  # Expected third byte of the header with the size and content
+
+    def allocate(self, max_packets):
+        """
+        Preallocate the output array to hold the samples from max_packets packets
+        """
+        if max_packets > self.max_packets:
+            self.max_packets = max_packets
+            self._out = np.empty((self.rows, max_packets * self.samples_per_packet),
+                                 dtype=np.float32)
+
+    @staticmethod
+    def parse_header(buffer):
+        """
+        Parse the 4-byte header of a streaming packet.
+        from the manual page 172
+
+        :returns: packet number, content, size, rate and status
+        """
+        header = unpack_from('>I', buffer)[0]
+        packet_number = header & 0xff
+        packet_content = (header >> 8) & 0x0f
+        packet_size = (header >> 12) & 0x0f
+        packet_rate = (header >> 16) & 0xff
+        packet_status = (header >> 24) & 0xff
+        return packet_number, packet_content, packet_size, packet_rate, packet_status
+
+    def set_header_check(self, content, size_code):
+        """
+        Enable verification of the content and the size code in the header of packets.
+        Use None for content to disable it.
+        """
+        if content is None:
+            self.header_check = None
+        else:
+            self.header_check = (size_code & 0x0f) << 4 | (content & 0x0f)
+
+    def verify(self, buffer):
+        """
+        Return True if a single packet has the expected length and header
+        """
+        if len(buffer) != self.packet_size + self.HeaderSize:
+            return False
+        return self.header_check is None or buffer[2] == self.header_check
+
+    def verify_packets(self, slab, lengths):
+        """
+        Verify packets stored in rows of a uint8 array at once
+
+        :returns: bool array that is True for valid packets
+        """
+        valid = lengths == self.packet_size + self.HeaderSize
+        if self.header_check is not None:
+            valid &= slab[:, 2] == self.header_check
+        return valid
+
+    def invalidate(self, out, valid):
+        """
+        Fill the samples of invalid packets in out, returned by decode_packets(), with NaN
+        """
+        for i in np.flatnonzero(~valid):
+            out[:, i * self.samples_per_packet: (i + 1) * self.samples_per_packet] = np.nan
+
+    def decode_raw(self, buffer, offset=HeaderSize):
+        """
+        Return a read-only view of the payload in buffer with one column per streamed channel,
+        without any copy or conversion.
+        """
+        count = (len(buffer) - offset) // self.dtype.itemsize
+        count -= count % self.columns
+        vals = np.frombuffer(buffer, dtype=self.dtype, count=count, offset=offset)
+        return vals.reshape(-1, self.columns)
+
+    def decode(self, buffer, offset=HeaderSize, out=None):
+        """
+        Decode a single packet.
+
+        :param buffer: bytes-like object containing a packet including its header
+        :param out: optional float32 array with self.rows rows to decode into
+        :returns: float32 array with rows of X, Y, R and Theta, or a single row of X.
+            If out is not given, the returned array is a view into the preallocated
+            array of the decoder, and it is overwritten by the next call.
+        """
+        mat = self.decode_raw(buffer, offset)
+        rows = mat.shape[0]
+        if out is None:
+            self.allocate((rows + self.samples_per_packet - 1) // self.samples_per_packet)
+            out = self._out[:, :rows]
+        self.convert(mat, out)
+        return out
+
+    def decode_packets(self, slab, out=None):
+        """
+        Decode packets stored in rows of a contiguous uint8 array at once.
+
+        :param slab: C-contiguous uint8 array with a packet including its header in each row.
+            A row can be longer than the packet.
+        :param out: optional float32 array with self.rows rows and
+            len(slab) * self.samples_per_packet columns to decode into
+        :returns: float32 array with rows of X, Y, R and Theta, or a single row of X,
+            and a uint8 array of the packet numbers. If out is not given, the returned array
+            is a view into the preallocated array of the decoder, and it is overwritten by the next call.
+        """
+        count = len(slab)
+        samples = count * self.samples_per_packet
+        if out is None:
+            self.allocate(count)
+            out = self._out[:, :samples]
+        if count == 0:
+            return out, np.zeros(0, dtype=np.uint8)
+        itemsize = self.dtype.itemsize
+        mat = np.ndarray((count, self.samples_per_packet, self.columns), dtype=self.dtype,
+                         buffer=slab, offset=self.HeaderSize,
+                         strides=(slab.strides[0], self.columns * itemsize, itemsize))
+        # A view of out with the samples of each packet in the last axis
+        dst = np.lib.stride_tricks.as_strided(out, (self.rows, count, self.samples_per_packet),
+                                              (out.strides[0], self.samples_per_packet * out.strides[1],
+                                               out.strides[1]))
+        self.convert(mat, dst)
+        packet_numbers = slab[:, self.HeaderSize - 1].copy()
+        return out, packet_numbers
+
+    def convert(self, mat, out):
+        """
+        Convert a raw array with the streamed channels in its last axis
+        into out with rows of X, Y, R and Theta.
+        out has to have self.rows in its first axis and the remaining shape of mat.
+        """
+        if self.channel == Keys.X:
+            out[0] = mat[..., 0]
+
+        elif self.channel == Keys.XY:
+            x, y, r, th = out
+            x[...] = mat[..., 0]
+            y[...] = mat[..., 1]
+            np.hypot(x, y, out=r)
+            np.arctan2(y, x, out=th)
+            np.multiply(th, 180.0 / np.pi, out=th)
+
+        elif self.channel == Keys.RT:
+            x, y, r, th = out
+            r[...] = mat[..., 0]
+            th[...] = mat[..., 1]
+            # Use y as a scratch row for the angle in radians
+            np.multiply(th, np.pi / 180.0, out=y)
+            np.cos(y, out=x)
+            np.sin(y, out=y)
+            np.multiply(x, r, out=x)
+            np.multiply(y, r, out=y)
+
+        elif self.channel == Keys.XYRT:
+            for i in range(4):
+                out[i] = mat[..., i]
+        else:
+            raise ValueError(f'{self.channel} is not in ChannelDict')
+        return out
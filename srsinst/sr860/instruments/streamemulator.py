@@ -0,0 +1,239 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+
+from .keys import Keys
+from .components import DataStream
+from .streamrecorder import PacketRecorder
+
+
+class StreamPacketGenerator:
+    """
+    Build packets in the streaming format of the SR86x for testing without an instrument.
+
+    The data is a phasor rotating at signal_frequency with amplitude,
+    converted to the streamed channels. The header has the packet number,
+    content, packet size, rate and status as described in the manual page 172.
+    The content is assumed to be the channel code plus 4 for the int16 format.
+    """
+    MaxRate = 1.25e6  # Maximum streaming rate of SR865A
+
+    def __init__(self, channel=Keys.XYRT, data_format=Keys.Float32, packet_size=1024, rate_exponent=0,
+                 status=0, little_endian=False, amplitude=1.0, signal_frequency=1.0, max_rate=MaxRate):
+        if channel not in DataStream.ChannelDict:
+            raise ValueError(f'{channel} is not in ChannelDict')
+        if data_format not in DataStream.FormatDict:
+            raise ValueError(f'{data_format} is not in FormatDict')
+        if packet_size not in DataStream.PacketSizeDict:
+            raise ValueError(f'{packet_size} is not in PacketSizeDict')
+
+        self.channel = channel
+        self.data_format = data_format
+        self.packet_size = packet_size
+        self.rate_exponent = rate_exponent
+        self.sample_rate = max_rate / 2 ** rate_exponent
+        self.status = status
+        self.amplitude = amplitude
+        self.signal_frequency = signal_frequency
+
+        byte_order = '<' if little_endian else '>'
+        self.dtype = np.dtype(byte_order + ('f4' if data_format == Keys.Float32 else 'i2'))
+        self.columns = {Keys.X: 1, Keys.XY: 2, Keys.RT: 2, Keys.XYRT: 4}[channel]
+        self.samples_per_packet = packet_size // self.dtype.itemsize // self.columns
+        # Scale of int16 data: 30000 for the amplitude and 32767 for 180 degrees
+        self.int16_scale = 30000.0 / amplitude
+        self.int16_phase_scale = 32767.0 / 180.0
+
+        content = DataStream.ChannelDict[channel] + 4 * DataStream.FormatDict[data_format]
+        self.header_base = (status & 0xff) << 24 | (rate_exponent & 0xff) << 16 | \
+                           DataStream.PacketSizeDict[packet_size] << 12 | content << 8
+
+        self.packet_number = 0
+        self.sample_index = 0
+
+    def make_packets(self, count):
+        """
+        Return a uint8 array with count packets including headers in its rows
+        """
+        slab = np.zeros((count, self.packet_size + 4), dtype=np.uint8)
+        numbers = (self.packet_number + np.arange(count)) & 0xff
+        slab[:, :4] = (self.header_base | numbers).astype('>u4').view(np.uint8).reshape(count, 4)
+
+        n = count * self.samples_per_packet
+        t = (self.sample_index + np.arange(n)) / self.sample_rate
+        phase = 2.0 * np.pi * self.signal_frequency * t
+        x = self.amplitude * np.cos(phase)
+        y = self.amplitude * np.sin(phase)
+        r = np.full(n, self.amplitude)
+        th = np.degrees(np.arctan2(y, x))
+        if self.data_format == Keys.Int16:
+            x, y, r = (np.round(v * self.int16_scale) for v in (x, y, r))
+            th = np.round(th * self.int16_phase_scale)
+        columns = {
+            Keys.X: (x,),
+            Keys.XY: (x, y),
+            Keys.RT: (r, th),
+            Keys.XYRT: (x, y, r, th)
+        }[self.channel]
+        values = np.stack(columns, axis=-1)
+        payload = values.astype(self.dtype).reshape(count, -1).view(np.uint8)
+        slab[:, 4: 4 + payload.shape[1]] = payload
+
+        self.packet_number = (self.packet_number + count) & 0xff
+        self.sample_index += n
+        return slab
+
+    def write_packet_file(self, file_name, packet_count, chunk_size=2000):
+        """
+        Write packet_count packets to a file for PacketReplay, chunk_size packets at a time,
+        with receive timestamps of 0
+        """
+        recorder = PacketRecorder(file_name, self.channel, self.data_format, self.packet_size,
+                                  sample_rate=self.sample_rate)
+        try:
+            for i in range(0, packet_count, chunk_size):
+                slab = self.make_packets(min(packet_count - i, chunk_size))
+                recorder.write_packets(slab, [slab.shape[1]] * len(slab), [0.0] * len(slab))
+        finally:
+            recorder.close()
+
+
+class StreamEmulator(threading.Thread):
+    """
+    Thread that sends UDP packets of a StreamPacketGenerator to a port
+    at the packet rate corresponding to the sample rate.
+
+    Each packet can be lost, sent after the next packet or corrupted with given probabilities
+    to test the loss accounting and the integrity checking of the receiver. With rate_limit=False,
+    packets are sent as fast as possible.
+    """
+    def __init__(self, generator: StreamPacketGenerator, host='127.0.0.1', port=1865,
+                 loss=0.0, reorder=0.0, duration=None, rate_limit=True, batch_size=64, seed=None,
+                 corrupt=0.0):
+        super().__init__(daemon=True)
+        self.generator = generator
+        self.address = (host, port)
+        self.loss = loss
+        self.reorder = reorder
+        self.corrupt = corrupt
+        self.duration = duration
+        self.rate_limit = rate_limit
+        self.batch_size = batch_size
+        self.random = np.random.default_rng(seed)
+
+        self.sent_packets = 0
+        self.lost_packets = 0       # Packets not sent on purpose
+        self.reordered_packets = 0  # Packets sent after the following packet
+        self.corrupted_packets = 0  # Packets sent with a wrong header and a short length
+        self.packet_rate = generator.sample_rate / generator.samples_per_packet
+
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._pending = None        # Packet held to be sent after the next packet
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start_time = time.perf_counter()
+        generated = 0
+        while not self._stop_event.is_set():
+            elapsed = time.perf_counter() - start_time
+            if self.duration is not None and elapsed >= self.duration:
+                break
+
+            count = self.batch_size
+            if self.rate_limit:
+                count = min(count, int(elapsed * self.packet_rate) + 1 - generated)
+                if count <= 0:
+                    time.sleep(min(0.001, (generated - elapsed * self.packet_rate) / self.packet_rate))
+                    continue
+
+            slab = self.generator.make_packets(count)
+            generated += count
+            self._send(slab)
+        if self._pending is not None:
+            self._send_packet(self._pending)
+            self._pending = None
+
+    def _send(self, slab):
+        # Loss, reordering and corruption are drawn for each packet. A reordered packet is held
+        # and sent after the next valid packet sent, which may be in the next slab.
+        count = len(slab)
+        lost = self.random.random(count) < self.loss
+        held = self.random.random(count) < self.reorder
+        corrupted = self.random.random(count) < self.corrupt
+        for i in range(count):
+            if lost[i]:
+                self.lost_packets += 1
+                continue
+            if corrupted[i]:
+                # Sent as it is. The receiver takes the packet number of a corrupt packet as the next one.
+                slab[i, 2] ^= 0xff
+                self._send_packet(slab[i, :-2])
+                self.corrupted_packets += 1
+                continue
+            if held[i] and self._pending is None:
+                self._pending = slab[i]
+                continue
+            self._send_packet(slab[i])
+            if self._pending is not None:
+                self._send_packet(self._pending)
+                self._pending = None
+                self.reordered_packets += 1
+
+    def _send_packet(self, packet):
+        self.udp_socket.sendto(packet.data, self.address)
+        self.sent_packets += 1
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.udp_socket.close()
+
+    def get_counters(self):
+        return {
+            'sent': self.sent_packets,
+            'lost': self.lost_packets,
+            'reordered': self.reordered_packets,
+            'corrupted': self.corrupted_packets,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send UDP packets in the SR86x streaming format')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1865)
+    parser.add_argument('--channel', default=Keys.XYRT, choices=list(DataStream.ChannelDict.keys()))
+    parser.add_argument('--format', default=Keys.Float32, choices=list(DataStream.FormatDict.keys()))
+    parser.add_argument('--packet-size', type=int, default=1024, choices=list(DataStream.PacketSizeDict.keys()))
+    parser.add_argument('--rate', type=int, default=0, help='rate divider exponent, rate = max_rate / 2^n')
+    parser.add_argument('--max-rate', type=float, default=StreamPacketGenerator.MaxRate)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of a lost packet')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability of a packet sent after the next one')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='probability of a corrupted packet')
+    parser.add_argument('--little-endian', action='store_true')
+    args = parser.parse_args()
+
+    generator = StreamPacketGenerator(args.channel, args.format, args.packet_size, args.rate,
+                                      little_endian=args.little_endian, max_rate=args.max_rate)
+    emulator = StreamEmulator(generator, args.host, args.port, args.loss, args.reorder, args.duration,
+                              corrupt=args.corrupt)
+    print('Sending {} {} packets of {} bytes at {:.1f} packets/s to {}:{}'
+          .format(args.channel, args.format, args.packet_size, emulator.packet_rate, args.host, args.port))
+    emulator.start()
+    try:
+        emulator.join()
+    except KeyboardInterrupt:
+        emulator.stop()
+    print(emulator.get_counters())
+
+
+if __name__ == '__main__':
+    main()
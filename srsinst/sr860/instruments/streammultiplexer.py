@@ -0,0 +1,144 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import logging
+import selectors
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StreamStatistics:
+    """
+    Rate and latency statistics of a DataStream registered to a StreamMultiplexer.
+
+    The latency is the time from the selector reporting the socket ready
+    to the end of the dispatch of the decoded block, that is, the delay added by
+    draining, decoding and the other streams served in the same poll.
+    """
+    def __init__(self, name, stream, callback=None):
+        self.name = name
+        self.stream = stream
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.packet_count = 0
+        self.sample_count = 0
+        self.block_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add(self, packets, samples, latency):
+        self.packet_count += packets
+        self.sample_count += samples
+        self.block_count += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def get_statistics(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        statistics = {
+            'packets': self.packet_count,
+            'samples': self.sample_count,
+            'packets_per_second': self.packet_count / elapsed,
+            'samples_per_second': self.sample_count / elapsed,
+            'mean_latency': self.latency_sum / self.block_count if self.block_count else 0.0,
+            'max_latency': self.latency_max,
+        }
+        statistics.update(self.stream.get_loss_counters())
+        return statistics
+
+
+class StreamMultiplexer:
+    """
+    Serve the UDP sockets of many DataStream instances from one selector loop,
+    instead of a thread blocking on each socket.
+
+    Streams are registered after start() or listen() without a receiver thread.
+    The ready sockets are drained in batches with StreamReader.receive_packets() of the streams,
+    and the decoded blocks are stored with DataStream.store_block(), through the decimator,
+    the statistics and the publisher of each stream, or passed to a callback given at registration.
+    """
+    def __init__(self, max_packets=64):
+        self.max_packets = max_packets
+        self.selector = selectors.DefaultSelector()
+        self.streams = {}
+        self._stop_event = threading.Event()
+
+    def register(self, name, stream, callback=None):
+        """
+        Add a stream to serve.
+
+        :param name: key of the stream in get_statistics()
+        :param callback: optional function called with name, the decoded block and
+            the packet numbers, instead of storing the block with stream.store_block(). The block is
+            reused by the next poll; copy it to keep it.
+        """
+        if name in self.streams:
+            raise KeyError(f'{name} is already registered')
+        entry = StreamStatistics(name, stream, callback)
+        stream.udp_socket.setblocking(False)
+        self.selector.register(stream.udp_socket, selectors.EVENT_READ, entry)
+        self.streams[name] = entry
+
+    def unregister(self, name):
+        entry = self.streams.pop(name)
+        self.selector.unregister(entry.stream.udp_socket)
+
+    def poll(self, timeout=1.0):
+        """
+        Wait for ready sockets up to timeout, and drain and dispatch them
+
+        :returns: number of packets received
+        """
+        total = 0
+        for key, _ in self.selector.select(timeout):
+            ready_time = time.time()
+            entry = key.data
+            block, packet_numbers = entry.stream.reader.receive_packets(self.max_packets, wait=False)
+            count = len(packet_numbers)
+            if count == 0:
+                continue
+            if entry.callback is not None:
+                entry.callback(entry.name, block, packet_numbers)
+            else:
+                entry.stream.store_block(block)
+            entry.add(count, block.shape[1], time.time() - ready_time)
+            total += count
+        return total
+
+    def run(self, duration=None, timeout=0.2):
+        """
+        Poll until stop() is called, or for duration seconds.
+        It can run in a separate thread.
+        """
+        self._stop_event.clear()
+        start_time = time.time()
+        while not self._stop_event.is_set():
+            if duration is not None and time.time() - start_time >= duration:
+                break
+            try:
+                self.poll(timeout)
+            except IndexError as e:
+                logger.error(e)
+                break
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_statistics(self):
+        """
+        Return a dictionary of the rate, latency and loss statistics of each stream by name
+        """
+        return {name: entry.get_statistics() for name, entry in self.streams.items()}
+
+    def close(self):
+        for name in list(self.streams.keys()):
+            self.unregister(name)
+        self.selector.close()
@@ -0,0 +1,164 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import os
+import collections
+import concurrent.futures
+import numpy as np
+
+from .streamdecoder import StreamDecoder
+
+try:
+    from multiprocessing import shared_memory
+    SHARED_MEMORY_AVAILABLE = True
+except (ImportError, ModuleNotFoundError):
+    SHARED_MEMORY_AVAILABLE = False
+
+# State of a worker process, set by _init_worker()
+_worker = {}
+
+# Names of the shared memory blocks created with create_shared_memory() and not unlinked yet
+_created_names = set()
+
+
+def create_shared_memory(name, size):
+    """
+    Create a named shared memory block, to be removed with unlink_shared_memory()
+    """
+    memory = shared_memory.SharedMemory(name, create=True, size=size)
+    _created_names.add(memory.name)
+    return memory
+
+
+def unlink_shared_memory(memory):
+    memory.unlink()
+    _created_names.discard(memory.name)
+
+
+def attach_shared_memory(name, child=False):
+    """
+    Attach to a shared memory block created by another process, so that it is not removed
+    when this process exits. From Python 3.13, the block is attached with track=False.
+    Before, attaching registers the block to the resource tracker, which removes it
+    when the process exits, while the creator is still using it. It is unregistered here,
+    except in the creator, or in a child process of the creator (child=True),
+    which share the resource tracker of the creator: unregistering it there would remove
+    the registration of the creator, and registering it again is harmless.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass  # Before Python 3.13
+    memory = shared_memory.SharedMemory(name=name)
+    if not child and memory.name not in _created_names and os.name == 'posix':
+        from multiprocessing import resource_tracker
+        # Registered with the leading slash of the POSIX name
+        resource_tracker.unregister('/' + memory.name, 'shared_memory')
+    return memory
+
+
+def _init_worker(input_name, output_name, input_shape, output_shape, decoder_args):
+    _worker['input_memory'] = attach_shared_memory(input_name, child=True)
+    _worker['output_memory'] = attach_shared_memory(output_name, child=True)
+    _worker['slabs'] = np.ndarray(input_shape, dtype=np.uint8, buffer=_worker['input_memory'].buf)
+    _worker['outputs'] = np.ndarray(output_shape, dtype=np.float32, buffer=_worker['output_memory'].buf)
+    _worker['decoder'] = StreamDecoder(*decoder_args)
+
+
+def _decode_slot(slot, count):
+    decoder = _worker['decoder']
+    out = _worker['outputs'][slot, :, :count * decoder.samples_per_packet]
+    decoder.decode_packets(_worker['slabs'][slot, :count], out)
+
+
+class DecoderPool:
+    """
+    Decode packet slabs in worker processes, so that decoding and the conversion to
+    X, Y, R and Theta run on other cores than the socket receiver.
+
+    Slabs are copied into slots of a shared memory block, and each worker decodes a slot
+    into a shared float32 block. Results are returned in the order submitted,
+    so samples stay in order whichever worker finishes first.
+
+    The copy and the dispatch cost about as much as decoding a small slab, so the pool pays off
+    only with spare cores and large slabs. Compare the rates with
+    'python benchmarks/stream_benchmark.py --pool-workers 1 2 4' on the computer used.
+    """
+    def __init__(self, decoder: StreamDecoder, workers=None, slots=None, max_packets=256):
+        if not SHARED_MEMORY_AVAILABLE:
+            raise ImportError('multiprocessing.shared_memory is not available. Python 3.8 or later is required.')
+        self.workers = workers if workers else os.cpu_count()
+        self.slot_count = slots if slots else 2 * self.workers
+        self.max_packets = max_packets
+        self.decoder = decoder
+
+        input_shape = (self.slot_count, max_packets, decoder.packet_size + decoder.HeaderSize)
+        output_shape = (self.slot_count, decoder.rows, max_packets * decoder.samples_per_packet)
+        self._input_memory = shared_memory.SharedMemory(create=True, size=int(np.prod(input_shape)))
+        self._output_memory = shared_memory.SharedMemory(create=True, size=4 * int(np.prod(output_shape)))
+        self.slabs = np.ndarray(input_shape, dtype=np.uint8, buffer=self._input_memory.buf)
+        self.outputs = np.ndarray(output_shape, dtype=np.float32, buffer=self._output_memory.buf)
+
+        decoder_args = (decoder.channel, decoder.data_format, decoder.packet_size, decoder.little_endian)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_init_worker,
+            initargs=(self._input_memory.name, self._output_memory.name,
+                      input_shape, output_shape, decoder_args))
+
+        self._free_slots = collections.deque(range(self.slot_count))
+        self._pending = collections.deque()
+        self._returned_slot = None
+
+    def has_free_slot(self):
+        return len(self._free_slots) > 0
+
+    def get_pending_size(self):
+        return len(self._pending)
+
+    def submit(self, slab, lengths):
+        """
+        Copy up to max_packets packets in rows of slab into a free slot and start decoding it
+
+        :returns: number of packets submitted, 0 if no slot is free
+        """
+        if not self._free_slots:
+            return 0
+        count = min(len(slab), self.max_packets)
+        slot = self._free_slots.popleft()
+        self.slabs[slot, :count] = slab[:count]
+        # The headers are checked here while the payload is decoded in a worker
+        valid = self.decoder.verify_packets(slab[:count], lengths[:count])
+        packet_numbers = slab[:count, self.decoder.HeaderSize - 1].copy()
+        statuses = slab[:count, 0].copy()
+        future = self.executor.submit(_decode_slot, slot, count)
+        self._pending.append((future, slot, count, packet_numbers, statuses, valid))
+        return count
+
+    def get_result(self, timeout=None):
+        """
+        Wait for the oldest slab submitted to be decoded.
+
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            uint8 arrays of the packet numbers and the status bytes,
+            and a bool array that is False for corrupt packets.
+            The array is in shared memory, and reused after the next call; copy it to keep it.
+        :raises concurrent.futures.TimeoutError: if the slab is not decoded before timeout
+        """
+        if self._returned_slot is not None:
+            self._free_slots.append(self._returned_slot)
+            self._returned_slot = None
+        future, slot, count, packet_numbers, statuses, valid = self._pending[0]
+        future.result(timeout)
+        self._pending.popleft()
+        self._returned_slot = slot
+        return self.outputs[slot, :, :count * self.decoder.samples_per_packet], packet_numbers, statuses, valid
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.slabs = None
+        self.outputs = None
+        for memory in (self._input_memory, self._output_memory):
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,198 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import logging
+import threading
+import collections
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class StreamSubscriber(threading.Thread):
+    """
+    Consumer of the blocks published by a StreamPublisher, such as a plot, a file writer
+    or a statistics engine, with its own bounded queue and thread.
+
+    The callback is called in the subscriber thread with each block and the sample index
+    of its first sample. When the queue is full, the oldest block is dropped with the
+    'drop-oldest' policy, the new block is dropped with 'drop-newest', and the publisher
+    waits up to block_timeout for room with 'block' before dropping the new block.
+    The lag is the time from publishing to the end of the callback, and the blocks and samples queued.
+    """
+    DropOldest = 'drop-oldest'
+    DropNewest = 'drop-newest'
+    Block = 'block'
+
+    def __init__(self, name, callback, queue_size=16, policy=DropOldest, block_timeout=1.0):
+        if policy not in (self.DropOldest, self.DropNewest, self.Block):
+            raise ValueError(f'Invalid policy: {policy}')
+        super().__init__(name=name, daemon=True)
+        self.callback = callback
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = collections.deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+
+        self.delivered_blocks = 0
+        self.delivered_samples = 0
+        self.dropped_blocks = 0
+        self.dropped_samples = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.next_index = 0  # Sample index after the last block delivered
+
+    def put(self, block, first_index, publish_time):
+        """
+        Queue a block following the policy. It is called by the publisher.
+
+        :returns: True if the block is queued
+        """
+        with self._condition:
+            if self._stopping:
+                return False
+            if len(self.queue) >= self.queue_size:
+                if self.policy == self.Block:
+                    self._condition.wait_for(lambda: len(self.queue) < self.queue_size or self._stopping,
+                                             self.block_timeout)
+                if len(self.queue) >= self.queue_size:
+                    if self.policy == self.DropOldest:
+                        self._count_dropped(self.queue.popleft()[0])
+                    else:
+                        self._count_dropped(block)
+                        return False
+            self.queue.append((block, first_index, publish_time))
+            self._condition.notify_all()
+        return True
+
+    def _count_dropped(self, block):
+        self.dropped_blocks += 1
+        self.dropped_samples += block.shape[-1]
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.queue or self._stopping)
+                if not self.queue:
+                    break
+                block, first_index, publish_time = self.queue.popleft()
+                self._condition.notify_all()
+
+            try:
+                self.callback(block, first_index)
+            except Exception as e:
+                self.errors += 1
+                logger.error('Subscriber {}: {}'.format(self.name, e))
+
+            self.delivered_blocks += 1
+            self.delivered_samples += block.shape[-1]
+            self.next_index = first_index + block.shape[-1]
+            self.last_lag = time.time() - publish_time
+            if self.last_lag > self.max_lag:
+                self.max_lag = self.last_lag
+
+    def stop(self, drain=True, timeout=None):
+        """
+        Stop the thread after delivering the queued blocks, or after the current block if not drain
+        """
+        with self._condition:
+            if not drain:
+                while self.queue:
+                    self._count_dropped(self.queue.popleft()[0])
+            self._stopping = True
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+
+    def get_lag(self):
+        """
+        Return the number of blocks and samples queued, and the age of the oldest block queued in seconds
+        """
+        with self._condition:
+            blocks = len(self.queue)
+            samples = sum(item[0].shape[-1] for item in self.queue)
+            age = time.time() - self.queue[0][2] if self.queue else 0.0
+        return blocks, samples, age
+
+    def get_counters(self):
+        blocks, samples, age = self.get_lag()
+        return {
+            'delivered_blocks': self.delivered_blocks,
+            'delivered_samples': self.delivered_samples,
+            'dropped_blocks': self.dropped_blocks,
+            'dropped_samples': self.dropped_samples,
+            'errors': self.errors,
+            'queued_blocks': blocks,
+            'queued_samples': samples,
+            'queued_age': age,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+        }
+
+
+class StreamPublisher:
+    """
+    Fan out the blocks stored by a DataStream to subscribers running in their own threads,
+    so that a slow subscriber does not stall the receiver or the other subscribers.
+
+    A published block is copied once into a read-only array shared by all subscribers,
+    because the decoded block is reused by the next receive call.
+    Set it to a stream with DataStream.set_publisher(), or call publish() with blocks.
+    """
+    def __init__(self):
+        self.subscribers = {}
+        self.sample_index = 0  # Sample index of the next block published
+        self.published_blocks = 0
+
+    def subscribe(self, name, callback, queue_size=16, policy=StreamSubscriber.DropOldest, block_timeout=1.0):
+        """
+        Start a subscriber thread calling callback(block, first_index) for each block published
+
+        :param name: key of the subscriber in get_counters()
+        :param policy: one of StreamSubscriber.DropOldest, DropNewest and Block, used when the queue is full
+        :returns: the StreamSubscriber instance
+        """
+        if name in self.subscribers:
+            raise KeyError(f'{name} is already subscribed')
+        subscriber = StreamSubscriber(name, callback, queue_size, policy, block_timeout)
+        subscriber.start()
+        self.subscribers[name] = subscriber
+        return subscriber
+
+    def unsubscribe(self, name, drain=True):
+        subscriber = self.subscribers.pop(name)
+        subscriber.stop(drain)
+
+    def publish(self, block):
+        """
+        Queue a block with rows of X, Y, R and Theta (or a single row of X) to every subscriber
+        """
+        if not self.subscribers:
+            self.sample_index += block.shape[-1]
+            return
+        shared = np.array(block, copy=True)
+        shared.setflags(write=False)
+        publish_time = time.time()
+        for subscriber in list(self.subscribers.values()):
+            subscriber.put(shared, self.sample_index, publish_time)
+        self.sample_index += shared.shape[-1]
+        self.published_blocks += 1
+
+    def get_counters(self):
+        """
+        Return a dictionary of the delivery, drop and lag counters of each subscriber by name
+        """
+        return {name: subscriber.get_counters() for name, subscriber in self.subscribers.items()}
+
+    def close(self, drain=True):
+        """
+        Stop all subscribers, after delivering the queued blocks if drain
+        """
+        for subscriber in self.subscribers.values():
+            subscriber.stop(drain)
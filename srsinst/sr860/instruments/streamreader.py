@@ -0,0 +1,355 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import socket
+import select
+import asyncio
+import logging
+import collections
+import concurrent.futures
+import numpy as np
+
+from .streamdecoder import StreamDecoder
+from .streamreceiver import PacketRing, StreamReceiver
+from .streamtracker import PacketTracker
+from .streamasync import StreamProtocol
+from .streampool import DecoderPool
+
+logger = logging.getLogger(__name__)
+
+
+class StreamReader:
+    """
+    Receive paths of a stream. Packets are received from a UDP socket, or a socket-like PacketReplay,
+    decoded with a StreamDecoder, and accounted for by a PacketTracker.
+
+    - receive_packet(): a packet at a time with recvfrom()
+    - receive_packets(): batches with recv_into() into a preallocated slab
+    - receive_blocks(): packets stored in a ring by a receiver thread, after start_receiver()
+    - receive_pooled_blocks(): the packets of the ring decoded in worker processes, after start_decoder_pool()
+    - blocks(): an asynchronous generator using an asyncio DatagramProtocol
+
+    Each returns a float32 array with rows of X, Y, R and Theta (a single row for the X channel).
+    Reordered and duplicate packets are left out, so that the samples stay in order.
+    DataStream creates a reader when streaming starts, as its reader attribute,
+    and stores the blocks in its data buffer with store_block().
+    """
+    # Packets checked before reporting that every packet failed verification
+    VerificationReportCount = 64
+
+    def __init__(self, udp_socket, decoder: StreamDecoder, timeout=10, replaying=False, recorder=None,
+                 sample_rate=None):
+        """
+        :param udp_socket: a bound UDP socket, or a PacketReplay
+        :param timeout: seconds to wait for a packet
+        :param replaying: True if udp_socket is a PacketReplay
+        :param recorder: optional PacketRecorder that records the packets received
+        :param sample_rate: samples per second of the stream. With it, the tracker counts
+            more than 255 consecutive lost packets from the timestamps of the receiver thread.
+        """
+        self.udp_socket = udp_socket
+        self.decoder = decoder
+        self.timeout = timeout
+        self.replaying = replaying
+        self.recorder = recorder
+        packet_rate = sample_rate / decoder.samples_per_packet if sample_rate else None
+        self.tracker = PacketTracker(decoder.samples_per_packet, packet_rate=packet_rate)
+        self.receiver = None
+        self.decoder_pool = None
+        self._pooled_timestamps = collections.deque()
+        self._verification_reported = False
+        self.protocol = None
+        self.slab = None
+        self.slab_lengths = None
+        self._slab_views = []
+        self.packet_count = 0
+        self.syscall_count = 0
+        self.start_time = time.time()
+
+    @property
+    def packet_buffer_size(self):
+        return self.decoder.packet_size + self.decoder.HeaderSize
+
+    def receive_packet(self):
+        """
+        Receive a packet and decode it.
+
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and the packet number. The array is reused by the next call; copy it to keep it.
+            It is empty for a reordered or duplicate packet.
+        """
+        if self.udp_socket.gettimeout() != self.timeout:
+            self.udp_socket.settimeout(self.timeout)
+        buffer, _ = self.udp_socket.recvfrom(self.packet_buffer_size)
+        self.syscall_count += 2  # A socket with a timeout polls before recvfrom
+        self.packet_count += 1
+        if self.recorder is not None:
+            self.recorder.write(buffer)
+        packet_number = buffer[3]  # The lowest byte of the big-endian header
+        arr = self.decoder.decode(buffer)
+        valid = self.decoder.verify(buffer)
+        if not valid:
+            arr[:] = np.nan
+        kept = self.tracker.add_packet(packet_number, buffer[0], valid)
+        if not valid:
+            self._check_verification()
+        if not kept:
+            return arr[:, :0], packet_number
+        return arr, packet_number
+
+    def _check_verification(self):
+        # A wrong expected header, rather than corruption, fails every packet
+        tracker = self.tracker
+        if self._verification_reported or tracker.received_packets < self.VerificationReportCount \
+                or tracker.corrupt_packets < tracker.received_packets:
+            return
+        self._verification_reported = True
+        logger.error('All of the first {} packets failed verification. Expected packet size: {} bytes, '
+                     'expected header byte 2: {}. Stream without the integrity check if the header differs.'
+                     .format(tracker.received_packets, self.packet_buffer_size, self.decoder.header_check))
+
+    def _allocate_slab(self, max_packets):
+        self.slab = np.zeros((max_packets, self.packet_buffer_size), dtype=np.uint8)
+        self.slab_lengths = np.zeros(max_packets, dtype=np.int32)
+        self._slab_views = [memoryview(self.slab[i]) for i in range(max_packets)]
+        self.decoder.allocate(max_packets)
+
+    def receive_packets(self, max_packets=64, wait=True):
+        """
+        Receive up to max_packets packets into a preallocated slab with recv_into and decode them at once.
+        It waits for a packet as long as self.timeout,
+        and then drains the packets already in the socket buffer without blocking.
+        With wait=False, it only drains the socket, when the socket is known to be ready.
+
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and a uint8 array of the packet numbers. The array is reused by the next call;
+            copy it to keep it.
+        """
+        if self.slab is None or len(self.slab) < max_packets:
+            self._allocate_slab(max_packets)
+        views = self._slab_views
+        lengths = self.slab_lengths
+        sock = self.udp_socket
+
+        # The socket stays non-blocking in this mode. A socket with a timeout
+        # would poll before every recv_into, doubling the number of syscalls.
+        if sock.gettimeout() != 0.0:
+            sock.setblocking(False)
+        if wait and not self.replaying:
+            self.syscall_count += 1
+            ready, _, _ = select.select([sock], [], [], self.timeout)
+            if not ready:
+                raise socket.timeout('timed out')
+
+        count = 0
+        try:
+            while count < max_packets:
+                self.syscall_count += 1
+                lengths[count] = sock.recv_into(views[count])
+                count += 1
+        except BlockingIOError:
+            pass
+
+        self.packet_count += count
+        if self.recorder is not None:
+            timestamp = time.time()
+            self.recorder.write_packets(self.slab[:count], lengths[:count], [timestamp] * count)
+        return self._decode_slab(self.slab[:count], lengths[:count])
+
+    def _decode_slab(self, slab, lengths, timestamps=None):
+        arr, packet_numbers = self.decoder.decode_packets(slab)
+        valid = self.decoder.verify_packets(slab, lengths)
+        if not valid.all():
+            self.decoder.invalidate(arr, valid)
+        kept = self.tracker.add_packets(packet_numbers, slab[:, 0], valid, timestamps)
+        if not valid.all():
+            self._check_verification()
+        return self._leave_out(arr, packet_numbers, kept)
+
+    def _leave_out(self, arr, packet_numbers, kept):
+        # Remove the samples of the packets that the tracker did not keep
+        if kept is None:
+            return arr, packet_numbers
+        return arr[:, np.repeat(kept, self.decoder.samples_per_packet)], packet_numbers[kept]
+
+    def _get_arrival_times(self, timestamps):
+        # Timestamps of the receiver thread are arrival times, except those of a replay
+        return None if self.replaying else timestamps
+
+    def get_receive_rates(self):
+        """
+        Return packets/s and syscalls/s of receive_packet() and receive_packets() since the start
+        """
+        elapsed = time.time() - self.start_time
+        if elapsed <= 0:
+            elapsed = 1e-9
+        return {
+            'packets_per_second': self.packet_count / elapsed,
+            'syscalls_per_second': self.syscall_count / elapsed,
+            'packets_per_syscall': self.packet_count / self.syscall_count if self.syscall_count else 0.0,
+        }
+
+    def start_receiver(self, ring_size=4096):
+        """
+        Start a receiver thread that drains the socket into a ring of ring_size packets
+        for receive_blocks(). With a PacketReplay, the thread waits for the consumer
+        when the ring is full, so that no packet is dropped, and it exits at the end of the file.
+        """
+        ring = PacketRing(ring_size, self.packet_buffer_size)
+        self.decoder.allocate(ring_size)
+        self.receiver = StreamReceiver(self.udp_socket, ring, wait_when_full=self.replaying)
+        self.receiver.start()
+
+    def receive_blocks(self, max_packets=None, timeout=1.0):
+        """
+        Decode the packets that the receiver thread stored in its ring since the last call.
+        Available after start_receiver().
+
+        :param max_packets: maximum number of packets to decode
+        :param timeout: seconds to wait for a packet if none is pending
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and a uint8 array of the packet numbers. The array is reused by the next call;
+            copy it to keep it. Both are empty if no packet arrives before the timeout,
+            or at the end of a replay.
+        """
+        ring = self.receiver.ring
+        deadline = time.time() + timeout
+        while ring.get_pending_size() == 0:
+            if time.time() > deadline or self.receiver.finished:
+                return self.decoder.decode_packets(ring.slots[:0])
+            time.sleep(0.001)
+
+        slab, lengths, timestamps = ring.peek(max_packets)
+        if self.recorder is not None:
+            self.recorder.write_packets(slab, lengths, timestamps)
+        arr, packet_numbers = self._decode_slab(slab, lengths, self._get_arrival_times(timestamps))
+        ring.release(len(slab))
+        return arr, packet_numbers
+
+    def start_decoder_pool(self, workers=None, slots=None, max_packets=256):
+        """
+        Decode packets in worker processes with receive_pooled_blocks(), after start_receiver().
+        It requires Python 3.8 or later for multiprocessing.shared_memory.
+
+        :param workers: number of worker processes. The number of CPUs if None
+        :param slots: number of slabs being decoded at once. Twice the workers if None
+        :param max_packets: maximum number of packets in a slab
+        """
+        if self.receiver is None:
+            raise ValueError('Decoder pool requires the receiver thread. Start with threaded=True')
+        self.decoder_pool = DecoderPool(self.decoder, workers, slots, max_packets)
+
+    def receive_pooled_blocks(self, timeout=1.0):
+        """
+        Hand the packets pending in the receiver ring to the decoder pool,
+        and return the oldest decoded block. Blocks are returned in the order received.
+
+        :returns: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and a uint8 array of the packet numbers. The array is reused by the next call;
+            copy it to keep it. Both are empty if no packet arrives before the timeout,
+            or at the end of a replay.
+        """
+        pool = self.decoder_pool
+        ring = self.receiver.ring
+        deadline = time.time() + timeout
+        while True:
+            while pool.has_free_slot() and ring.get_pending_size():
+                slab, lengths, timestamps = ring.peek(pool.max_packets)
+                if self.recorder is not None:
+                    self.recorder.write_packets(slab, lengths, timestamps)
+                count = pool.submit(slab, lengths)
+                self._pooled_timestamps.append(self._get_arrival_times(timestamps[:count].copy()))
+                ring.release(count)
+            if pool.get_pending_size():
+                break
+            if time.time() > deadline or (self.receiver.finished and ring.get_pending_size() == 0):
+                return self.decoder.decode_packets(ring.slots[:0])
+            time.sleep(0.001)
+
+        try:
+            arr, packet_numbers, statuses, valid = pool.get_result(max(deadline - time.time(), 0.0))
+        except concurrent.futures.TimeoutError:
+            return self.decoder.decode_packets(ring.slots[:0])
+        if not valid.all():
+            self.decoder.invalidate(arr, valid)
+        kept = self.tracker.add_packets(packet_numbers, statuses, valid, self._pooled_timestamps.popleft())
+        if not valid.all():
+            self._check_verification()
+        return self._leave_out(arr, packet_numbers, kept)
+
+    async def blocks(self, max_packets=64, queue_size=4096, policy=StreamProtocol.DropOldest):
+        """
+        Asynchronous generator of decoded blocks using an asyncio DatagramProtocol.
+        The transport closes the socket when the generator ends.
+
+        :param max_packets: maximum number of packets decoded in a block
+        :param queue_size: maximum number of packets waiting for decoding
+        :param policy: 'drop-oldest' to drop the oldest packet when the queue is full,
+            or 'block' to pause reading and let packets wait in the socket buffer
+        :yields: a float32 array with rows of X, Y, R and Theta (a single row for the X channel),
+            and a uint8 array of the packet numbers. The array is reused by the next block;
+            copy it to keep it.
+        :raises socket.timeout: if no packet arrives for self.timeout
+        """
+        if self.slab is None or len(self.slab) < max_packets:
+            self._allocate_slab(max_packets)
+
+        loop = asyncio.get_running_loop()
+        self.protocol = StreamProtocol(queue_size, policy)
+        transport, _ = await loop.create_datagram_endpoint(lambda: self.protocol, sock=self.udp_socket)
+        try:
+            while True:
+                try:
+                    packets = await self.protocol.get_packets(max_packets, self.timeout)
+                except asyncio.TimeoutError:
+                    raise socket.timeout('timed out')
+                if not packets:
+                    break
+                count = len(packets)
+                for i, (packet, _) in enumerate(packets):
+                    length = min(len(packet), self.slab.shape[1])
+                    self._slab_views[i][:length] = packet[:length]
+                    self.slab_lengths[i] = length
+                self.packet_count += count
+                if self.recorder is not None:
+                    self.recorder.write_packets(self.slab[:count], self.slab_lengths[:count],
+                                                [timestamp for _, timestamp in packets])
+                yield self._decode_slab(self.slab[:count], self.slab_lengths[:count])
+        finally:
+            transport.close()
+
+    def get_loss_counters(self):
+        """
+        Return the packet counters from the packet headers: received, lost, lost_samples,
+        reordered, duplicates, corrupt and gaps. See PacketTracker for the status of the packets.
+        """
+        return self.tracker.get_counters()
+
+    def get_receiver_counters(self):
+        """
+        Return the packet counters of the receiver thread: received, dropped, overflows and pending,
+        or those of the protocol used by blocks(): received, dropped and pending
+        """
+        if self.receiver is not None:
+            return self.receiver.ring.get_counters()
+        if self.protocol is not None:
+            return self.protocol.get_counters()
+        return {}
+
+    def close(self):
+        """
+        Stop the receiver thread and the decoder pool, and close the recorder and the socket.
+        The loss counters, and the counters of the protocol used by blocks(), are kept.
+        """
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
+        if self.decoder_pool is not None:
+            self.decoder_pool.close()
+            self.decoder_pool = None
+        if self.recorder is not None:
+            self.recorder.close()
+        self.udp_socket.close()
@@ -0,0 +1,148 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import socket
+import logging
+import threading
+import numpy as np
+
+from .streamrecorder import EndOfReplay
+
+logger = logging.getLogger(__name__)
+
+
+class PacketRing:
+    """
+    Preallocated single-producer/single-consumer ring of raw packets.
+
+    Each slot is a row of a uint8 array. Only the producer advances the head
+    and only the consumer advances the tail, so no lock is required
+    between one producer thread and one consumer thread.
+    """
+    def __init__(self, slot_count=4096, slot_size=1028):
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slots = np.zeros((slot_count, slot_size), dtype=np.uint8)
+        self.lengths = np.zeros(slot_count, dtype=np.int32)
+        self.timestamps = np.zeros(slot_count, dtype=np.float64)
+        self._views = [memoryview(self.slots[i]) for i in range(slot_count)]
+
+        self._head = 0  # Number of packets written, modified only by the producer
+        self._tail = 0  # Number of packets read, modified only by the consumer
+
+        self.received_packets = 0
+        self.dropped_packets = 0  # Packets discarded because the ring was full
+        self.overflow_count = 0   # Number of times the ring became full
+
+    def get_pending_size(self):
+        return self._head - self._tail
+
+    def get_write_slot(self):
+        """
+        Producer side: return a writable memoryview of the next free slot,
+        or None if the ring is full.
+        """
+        if self._head - self._tail >= self.slot_count:
+            return None
+        return self._views[self._head % self.slot_count]
+
+    def commit(self, length, timestamp=0.0):
+        """
+        Producer side: publish the slot returned by get_write_slot() holding length bytes.
+        """
+        index = self._head % self.slot_count
+        self.lengths[index] = length
+        self.timestamps[index] = timestamp
+        self.received_packets += 1
+        self._head += 1
+
+    def drop(self, first_of_overflow=False):
+        """
+        Producer side: count a packet discarded because the ring was full.
+        """
+        self.received_packets += 1
+        self.dropped_packets += 1
+        if first_of_overflow:
+            self.overflow_count += 1
+
+    def peek(self, max_count=None):
+        """
+        Consumer side: return views of the slots, lengths and timestamps of the oldest pending packets.
+        The views are contiguous, so fewer packets than pending are returned at the end of the ring.
+        Call release() when the packets are processed.
+        """
+        count = self._head - self._tail
+        index = self._tail % self.slot_count
+        count = min(count, self.slot_count - index)
+        if max_count is not None:
+            count = min(count, max_count)
+        s = slice(index, index + count)
+        return self.slots[s], self.lengths[s], self.timestamps[s]
+
+    def release(self, count):
+        """
+        Consumer side: free the count oldest slots.
+        """
+        self._tail += count
+
+    def get_counters(self):
+        return {
+            'received': self.received_packets,
+            'dropped': self.dropped_packets,
+            'overflows': self.overflow_count,
+            'pending': self.get_pending_size(),
+        }
+
+
+class StreamReceiver(threading.Thread):
+    """
+    Thread that drains a UDP socket into a PacketRing,
+    so that a slow consumer does not back up the socket buffer.
+
+    With wait_when_full=True, it waits for a free slot instead of dropping packets when the ring is full,
+    for a source that can wait, such as PacketReplay. It exits at the end of a PacketReplay,
+    with finished set to True.
+    """
+    def __init__(self, udp_socket, ring: PacketRing, poll_timeout=0.2, wait_when_full=False):
+        super().__init__(daemon=True)
+        self.udp_socket = udp_socket
+        self.ring = ring
+        self.wait_when_full = wait_when_full
+        self.finished = False
+        self.udp_socket.settimeout(poll_timeout)
+        self._scratch = bytearray(ring.slot_size)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        overflowing = False
+        while not self._stop_event.is_set():
+            slot = self.ring.get_write_slot()
+            if slot is None and self.wait_when_full:
+                self._stop_event.wait(0.001)
+                continue
+            try:
+                nbytes = self.udp_socket.recv_into(self._scratch if slot is None else slot)
+            except EndOfReplay:
+                self.finished = True
+                break
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop_event.is_set():
+                    logger.error(e)
+                break
+
+            if slot is None:
+                self.ring.drop(not overflowing)
+                overflowing = True
+            else:
+                self.ring.commit(nbytes, time.time())
+                overflowing = False
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
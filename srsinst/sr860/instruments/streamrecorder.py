@@ -0,0 +1,178 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import mmap
+import time
+import socket
+from struct import Struct
+
+from .keys import Keys
+
+
+class EndOfReplay(socket.timeout):
+    """
+    Raised by PacketReplay when all packets are read repeat times
+    """
+
+
+class PacketFile:
+    """
+    Layout of a raw packet file.
+
+    The file header holds the stream configuration, and each record holds
+    the packet length, the receive timestamp and the packet including its 4-byte header.
+    """
+    Magic = b'SR86XPKT'
+    Version = 1
+    FileHeader = Struct('<8sIIIIId')  # magic, version, channel, format, packet size, option, sample rate
+    RecordHeader = Struct('<Hd')      # packet length, receive timestamp
+
+    ChannelCodeDict = {
+        Keys.X:    0,
+        Keys.XY:   1,
+        Keys.RT:   2,
+        Keys.XYRT: 3
+    }
+    FormatCodeDict = {
+        Keys.Float32: 0,
+        Keys.Int16:   1
+    }
+
+
+class PacketRecorder(PacketFile):
+    """
+    Append raw stream packets with their receive timestamps to a file in large buffered writes
+    """
+    def __init__(self, file_name, channel, data_format, packet_size, option=0, sample_rate=0.0,
+                 buffer_size=4 * 1024 * 1024):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.packet_count = 0
+        self._buffer = bytearray()
+        self._file = open(file_name, 'wb')
+        self._file.write(self.FileHeader.pack(self.Magic, self.Version,
+                                              self.ChannelCodeDict[channel],
+                                              self.FormatCodeDict[data_format],
+                                              packet_size, option,
+                                              sample_rate if sample_rate else 0.0))
+
+    def write(self, packet, timestamp=None):
+        """
+        Add a packet including its header
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._buffer += self.RecordHeader.pack(len(packet), timestamp)
+        self._buffer += packet
+        self.packet_count += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_packets(self, slab, lengths, timestamps):
+        """
+        Add packets stored in rows of a uint8 array with their lengths and timestamps,
+        such as the slots of a PacketRing
+        """
+        for row, length, timestamp in zip(slab, lengths, timestamps):
+            self._buffer += self.RecordHeader.pack(length, timestamp)
+            self._buffer += row[:length].data
+        self.packet_count += len(slab)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+class PacketReplay(PacketFile):
+    """
+    Socket-like source of packets read from a file written by PacketRecorder.
+
+    It supports recvfrom() and recv_into() used by DataStream, and returns packets
+    as fast as they are requested. When all packets are read repeat times,
+    it raises EndOfReplay, a socket.timeout, after the timeout like a socket,
+    or BlockingIOError in non-blocking mode.
+    """
+    def __init__(self, file_name, repeat=1):
+        self.file_name = file_name
+        self.repeat = repeat
+        self._file = open(file_name, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        magic, version, channel, data_format, packet_size, option, sample_rate = \
+            self.FileHeader.unpack_from(self._map)
+        if magic != self.Magic:
+            raise ValueError('{} is not a packet file'.format(file_name))
+        channels = {v: k for k, v in self.ChannelCodeDict.items()}
+        formats = {v: k for k, v in self.FormatCodeDict.items()}
+        self.channel = channels[channel]
+        self.data_format = formats[data_format]
+        self.packet_size = packet_size
+        self.option = option
+        self.sample_rate = sample_rate if sample_rate > 0 else None
+
+        self._timeout = None
+        self._position = self.FileHeader.size
+        self._pass = 0
+        self.packet_count = 0
+        self.timestamp = 0.0  # Receive timestamp of the last packet returned
+
+    def _next(self):
+        if self._position >= len(self._map):
+            self._pass += 1
+            if self._pass >= self.repeat:
+                if self._timeout == 0.0:
+                    raise BlockingIOError('No more packets in {}'.format(self.file_name))
+                if self._timeout:
+                    time.sleep(self._timeout)
+                raise EndOfReplay('No more packets in {}'.format(self.file_name))
+            self._position = self.FileHeader.size
+
+        length, self.timestamp = self.RecordHeader.unpack_from(self._map, self._position)
+        start = self._position + self.RecordHeader.size
+        self._position = start + length
+        self.packet_count += 1
+        return self._view[start: start + length]
+
+    def recvfrom(self, bufsize):
+        """
+        Return a memoryview of the next packet without copying, and the file name as the address
+        """
+        return self._next()[:bufsize], (self.file_name, 0)
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        packet = self._next()
+        length = min(len(packet), nbytes if nbytes else len(buffer))
+        buffer[:length] = packet[:length]
+        return length
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def gettimeout(self):
+        return self._timeout
+
+    def setblocking(self, flag):
+        self._timeout = None if flag else 0.0
+
+    def close(self):
+        if self._map.closed:
+            return
+        self._view = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Packets returned by recvfrom() are still in use. The map is closed when released.
+        self._file.close()
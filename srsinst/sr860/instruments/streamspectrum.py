@@ -0,0 +1,158 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import numpy as np
+
+from .keys import Keys
+
+
+class WelchSpectrum:
+    """
+    Power spectral density of streamed data estimated with Welch's method as blocks arrive.
+
+    Samples are cut into overlapping segments multiplied by a window, and all segments
+    completed by a block are transformed with one batch FFT. The periodograms are averaged
+    over all segments, or with an exponential running average over the last averages segments.
+    Samples of an unfinished segment are kept for the next block.
+
+    With the XY source, X + iY is transformed as a complex signal, giving a two-sided spectrum
+    around the reference frequency. With a single row source, the one-sided spectrum is returned.
+    """
+    SourceDict = {
+        Keys.XY: (0, 1),
+        'x': (0,),
+        'y': (1,),
+        'r': (2,),
+        'th': (3,),
+    }
+    WindowDict = {
+        'hann': np.hanning,
+        'hamming': np.hamming,
+        'blackman': np.blackman,
+        'rectangular': np.ones,
+    }
+    MinSegmentSize = 16
+    MaxSegmentSize = 2 ** 20  # 8 MB for a complex64 segment
+
+    def __init__(self, sample_rate, resolution=None, segment_size=1024, overlap=0.5,
+                 window='hann', averages=None, source=Keys.XY):
+        """
+        :param sample_rate: rate of the samples in the blocks
+        :param resolution: frequency resolution in Hz. The segment size is the power of 2
+            giving a resolution at least as fine as requested. segment_size is used if None.
+            The segment size is limited to between MinSegmentSize and MaxSegmentSize,
+            and the resolution attribute has the effective resolution.
+        :param overlap: fraction of a segment overlapping with the next segment
+        :param averages: number of segments in the exponential running average,
+            or None to average all segments
+        :param source: 'XY' for X + iY, or one of 'x', 'y', 'r' and 'th'
+        """
+        if source not in self.SourceDict:
+            raise ValueError(f'Invalid source: {source}')
+        if window not in self.WindowDict:
+            raise ValueError(f'Invalid window: {window}')
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError('overlap should be between 0 and 1')
+
+        self.sample_rate = sample_rate
+        if resolution:
+            segment_size = 2 ** int(np.ceil(np.log2(sample_rate / resolution)))
+        self.segment_size = int(min(max(segment_size, self.MinSegmentSize), self.MaxSegmentSize))
+        self.resolution = sample_rate / self.segment_size
+        self.hop = max(int(round(self.segment_size * (1.0 - overlap))), 1)
+        self.window_name = window
+        self.window = self.WindowDict[window](self.segment_size).astype(np.float32)
+        self.averages = averages
+        self.source = source
+        self.complex = source == Keys.XY
+        # Scale of periodograms to a power spectral density
+        self.scale = 1.0 / (sample_rate * np.sum(self.window.astype(np.float64) ** 2))
+        self.reset()
+
+    def reset(self):
+        self._pending = np.zeros(0, dtype=np.complex64 if self.complex else np.float32)
+        self.segment_count = 0
+        self.skipped_count = 0  # Segments with NaN samples from corrupt packets
+        self.psd = None
+
+    def get_frequencies(self):
+        """
+        Return the frequencies of the spectrum bins. With the XY source,
+        they are offsets from the reference frequency from -sample_rate/2 to sample_rate/2.
+        """
+        if self.complex:
+            return np.fft.fftshift(np.fft.fftfreq(self.segment_size, 1.0 / self.sample_rate))
+        return np.fft.rfftfreq(self.segment_size, 1.0 / self.sample_rate)
+
+    def add_block(self, block):
+        """
+        Update the spectrum with a decoded block with rows of X, Y, R and Theta,
+        or a single row of X
+
+        :returns: number of segments added
+        """
+        block = np.atleast_2d(block)
+        rows = self.SourceDict[self.source]
+        if max(rows) >= block.shape[0]:
+            raise ValueError(f'Source {self.source} is not in the block')
+        if self.complex:
+            samples = block[0] + 1j * block[1]
+        else:
+            samples = block[rows[0]]
+        data = np.concatenate((self._pending, samples.astype(self._pending.dtype)))
+
+        count = (len(data) - self.segment_size) // self.hop + 1 if len(data) >= self.segment_size else 0
+        if count == 0:
+            self._pending = data
+            return 0
+
+        segments = np.lib.stride_tricks.as_strided(
+            data, (count, self.segment_size), (self.hop * data.strides[0], data.strides[0]))
+        good = ~np.isnan(segments).any(axis=1)
+        self.skipped_count += count - int(np.count_nonzero(good))
+        self._pending = data[count * self.hop:].copy()
+        segments = segments[good]
+        if len(segments):
+            self._average(self._periodograms(segments))
+        return len(segments)
+
+    def _periodograms(self, segments):
+        windowed = segments * self.window
+        if self.complex:
+            power = np.abs(np.fft.fft(windowed, axis=1)) ** 2 * self.scale
+            return np.fft.fftshift(power, axes=1)
+        power = np.abs(np.fft.rfft(windowed, axis=1)) ** 2 * self.scale
+        # One-sided spectrum: double the bins except DC and Nyquist
+        power[:, 1: (self.segment_size + 1) // 2] *= 2.0
+        return power
+
+    def _average(self, power):
+        count = len(power)
+        if self.psd is None:
+            self.psd = np.zeros(power.shape[1])
+        if self.averages is None or self.segment_count + count <= self.averages:
+            # Running mean of all segments
+            total = self.segment_count + count
+            self.psd = self.psd * (self.segment_count / total) + power.sum(axis=0) / total
+        else:
+            # Exponential average with weights (1 - a) ** k for the k-th latest segment
+            a = 1.0 / self.averages
+            weights = a * (1.0 - a) ** np.arange(count - 1, -1, -1)
+            self.psd = self.psd * (1.0 - a) ** count + weights @ power
+        self.segment_count += count
+
+    def get_spectrum(self):
+        """
+        Return the frequencies and the averaged power spectral density in unit^2/Hz,
+        or None for the density before the first segment is completed
+        """
+        return self.get_frequencies(), self.psd
+
+    def get_amplitude_spectrum(self):
+        """
+        Return the frequencies and the amplitude spectral density in unit/sqrt(Hz)
+        """
+        frequencies, psd = self.get_spectrum()
+        return frequencies, None if psd is None else np.sqrt(psd)
@@ -0,0 +1,168 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import numpy as np
+
+
+class RunningStatistics:
+    """
+    Statistics of the rows of decoded stream blocks, updated incrementally with each block.
+
+    The mean and the variance are merged block by block with the parallel form of
+    Welford's algorithm (Chan et al.), and the minimum and the maximum are tracked.
+    The overlapping Allan deviation is computed at taus of 1, 2, 4, ... samples
+    from a ring of cumulative sums, holding only the last 2 * largest tau samples,
+    so each update costs O(block size) for each tau. Like RollingDataStreamBuffer,
+    the ring is mirrored to read any range of it as a contiguous view.
+    NaN samples from corrupt packets are excluded, along with the Allan deviation windows containing them.
+    """
+    RowNames = ('x', 'y', 'r', 'th')
+
+    def __init__(self, sample_rate=None, names=RowNames, octaves=16, chunk_size=65536):
+        """
+        :param sample_rate: rate of the samples to convert taus to seconds. Taus are in samples if None.
+        :param names: rows of the blocks to compute statistics for. Rows not in a block are ignored.
+        :param octaves: number of taus for the Allan deviation, up to 2 ** (octaves - 1) samples
+        :param chunk_size: largest number of samples processed at once
+        """
+        self.sample_rate = sample_rate
+        self.names = tuple(names)
+        self.octaves = octaves
+        self.chunk_size = chunk_size
+        self.tau_samples = 2 ** np.arange(octaves)
+        self.capacity = 2 * int(self.tau_samples[-1]) + chunk_size + 1
+        self.rows = 0
+        self.reset()
+
+    def reset(self, rows=0):
+        """
+        Clear the statistics for blocks with the number of rows
+        """
+        self.rows = rows
+        self.row_indices = [i for i, name in enumerate(self.RowNames[:rows]) if name in self.names]
+        rows = len(self.row_indices)
+        self.total_samples = 0
+        self.count = np.zeros(rows, dtype=np.int64)
+        self.mean = np.zeros(rows)
+        self.m2 = np.zeros(rows)
+        self.min = np.full(rows, np.inf)
+        self.max = np.full(rows, -np.inf)
+        self._offset = None
+        self._sums = None
+        self._nans = None
+        self._allan_sum = np.zeros((rows, self.octaves))
+        self._allan_count = np.zeros((rows, self.octaves), dtype=np.int64)
+
+    def add_block(self, block):
+        """
+        Update the statistics with a block with a row for each quantity,
+        such as the float32 array returned by StreamReader.receive_blocks()
+        """
+        block = np.atleast_2d(block)
+        if self.rows != block.shape[0]:
+            self.reset(block.shape[0])
+        block = block[self.row_indices]
+        for start in range(0, block.shape[1], self.chunk_size):
+            self._add_chunk(block[:, start: start + self.chunk_size])
+
+    def _add_chunk(self, data):
+        n = data.shape[1]
+        if n == 0:
+            return
+        valid = ~np.isnan(data)
+        filled = np.where(valid, data, 0.0)
+        counts = valid.sum(axis=1)
+
+        # Merge the mean and the sum of squared deviations of the block
+        block_mean = filled.sum(axis=1, dtype=np.float64) / np.maximum(counts, 1)
+        block_m2 = (np.where(valid, data - block_mean[:, None], 0.0) ** 2).sum(axis=1)
+        total = self.count + counts
+        delta = block_mean - self.mean
+        self.mean = self.mean + delta * counts / np.maximum(total, 1)
+        self.m2 = self.m2 + block_m2 + delta ** 2 * self.count * counts / np.maximum(total, 1)
+        self.count = total
+        self.min = np.minimum(self.min, np.where(valid, data, np.inf).min(axis=1))
+        self.max = np.maximum(self.max, np.where(valid, data, -np.inf).max(axis=1))
+
+        # Cumulative sums of the samples less an offset, for precision in long runs
+        cap = self.capacity
+        if self._sums is None:
+            self._offset = block_mean
+            self._sums = np.zeros((len(self.row_indices), 2 * cap))
+            self._nans = np.zeros((len(self.row_indices), 2 * cap), dtype=np.int64)
+        last = self.total_samples % cap
+        indices = (self.total_samples + 1 + np.arange(n)) % cap
+        sums = self._sums[:, last, None] + np.cumsum(np.where(valid, data - self._offset[:, None], 0.0), axis=1)
+        if counts.sum() == valid.size:
+            nans = self._nans[:, last, None]
+        else:
+            nans = self._nans[:, last, None] + np.cumsum(~valid, axis=1)
+        for offset in (0, cap):
+            self._sums[:, indices + offset] = sums
+            self._nans[:, indices + offset] = nans
+        previous = self.total_samples
+        self.total_samples += n
+
+        for k, m in enumerate(self.tau_samples):
+            # Windows of 2 * m samples starting at j, completed by this chunk
+            first = max(previous - 2 * m + 1, 0)
+            final = self.total_samples - 2 * m
+            if final < first:
+                break
+            count = final - first + 1
+            start = first % cap
+            s0 = self._sums[:, start: start + count]
+            s1 = self._sums[:, start + m: start + m + count]
+            s2 = self._sums[:, start + 2 * m: start + 2 * m + count]
+            d = (s2 - 2.0 * s1 + s0) / m
+            n0 = self._nans[:, start: start + count]
+            n2 = self._nans[:, start + 2 * m: start + 2 * m + count]
+            if np.array_equal(n0[:, 0], n2[:, -1]):
+                # No NaN in any window
+                self._allan_sum[:, k] += np.einsum('ij,ij->i', d, d)
+                self._allan_count[:, k] += count
+            else:
+                ok = n2 == n0
+                self._allan_sum[:, k] += np.where(ok, d * d, 0.0).sum(axis=1)
+                self._allan_count[:, k] += ok.sum(axis=1)
+
+    def get_std(self):
+        return np.sqrt(self.m2 / np.maximum(self.count - 1, 1))
+
+    def get_allan_deviation(self, row=0):
+        """
+        Return taus and the overlapping Allan deviation of a row at the taus available so far
+
+        :param row: index in the rows with statistics, in the order of RowNames
+        :returns: taus in seconds, or in samples without the sample rate, and the Allan deviations
+        """
+        if row >= len(self.row_indices):
+            return np.zeros(0), np.zeros(0)
+        available = self._allan_count[row] > 0
+        taus = self.tau_samples[available].astype(float)
+        if self.sample_rate:
+            taus /= self.sample_rate
+        adev = np.sqrt(self._allan_sum[row, available] / (2.0 * self._allan_count[row, available]))
+        return taus, adev
+
+    def get_results(self):
+        """
+        Return a dictionary of the statistics of each row by name,
+        with built-in types to write with Task.add_dict_to_file()
+        """
+        results = {'samples': int(self.total_samples),
+                   'sample_rate': self.sample_rate}
+        for row, index in enumerate(self.row_indices):
+            taus, adev = self.get_allan_deviation(row)
+            results[self.RowNames[index]] = {
+                'count': int(self.count[row]),
+                'mean': float(self.mean[row]),
+                'std': float(self.get_std()[row]),
+                'min': float(self.min[row]),
+                'max': float(self.max[row]),
+                'tau': taus.tolist(),
+                'adev': adev.tolist(),
+            }
+        return results
@@ -0,0 +1,125 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import numpy as np
+
+
+class StreamTimebase:
+    """
+    Time of streamed samples from the sample index, the sample period and host-clock anchors.
+
+    An anchor pairs a sample index with the host time of the sample. The time of a sample is
+    the time of the last anchor at or before it plus the sample period for each sample after the anchor.
+    The first anchor is at sample 0, and an anchor is added at each gap of lost samples,
+    because the sample index does not count the lost samples.
+    Times are computed only for the requested sample indices, in seconds since the first sample,
+    in seconds since the epoch, or as datetime64. Without the sample rate, the time is the sample index.
+    """
+    AnchorType = np.dtype([('sample_index', '<i8'), ('time', '<f8')])
+
+    def __init__(self, sample_rate=None, start_time=None):
+        self.reset(sample_rate, start_time)
+
+    def reset(self, sample_rate=None, start_time=None):
+        """
+        Clear the anchors and anchor sample 0 at start_time, or the current time if None
+        """
+        self.sample_rate = sample_rate
+        self.period = 1.0 / sample_rate if sample_rate else None
+        self._anchors = np.zeros(1, dtype=self.AnchorType)
+        self._anchors[0] = (0, time.time() if start_time is None else start_time)
+
+    @property
+    def start_time(self):
+        """
+        Host time of sample 0 in seconds since the epoch
+        """
+        return float(self._anchors['time'][0])
+
+    def get_anchors(self):
+        return self._anchors
+
+    def set_anchor(self, sample_index, host_time):
+        """
+        Anchor the sample at sample_index to host_time. Anchors at or after sample_index are replaced.
+        """
+        keep = np.searchsorted(self._anchors['sample_index'], sample_index)
+        anchor = np.array([(sample_index, host_time)], dtype=self.AnchorType)
+        self._anchors = np.concatenate((self._anchors[:keep], anchor))
+
+    def set_anchors(self, anchors):
+        """
+        Replace the anchors with a copy of anchors, such as the anchors saved by a writer in another process
+        """
+        if len(anchors):
+            self._anchors = np.array(anchors, dtype=self.AnchorType)
+
+    def add_gap(self, sample_index, gap_time, host_time=None, wrap_period=None):
+        """
+        Re-anchor after samples lost before sample_index.
+
+        :param gap_time: duration of the lost samples counted from the packet numbers
+        :param host_time: host time of the sample at sample_index estimated from the arrival time
+        :param wrap_period: duration of a full cycle of the packet number. Cycles of lost packets
+            not counted from the packet numbers are added when host_time is later by about a cycle or more.
+        """
+        if not self.period:
+            return
+        anchor_time = self.get_epoch(sample_index) + gap_time
+        if host_time is not None and wrap_period:
+            wraps = round((host_time - anchor_time) / wrap_period)
+            if wraps > 0:
+                anchor_time += wraps * wrap_period
+        self.set_anchor(sample_index, anchor_time)
+
+    def get_epoch(self, sample_indices):
+        """
+        Return the host time of samples in seconds since the epoch
+        """
+        if not self.period:
+            raise ValueError('Sample rate is not set')
+        return self.start_time + self.get_seconds(sample_indices)
+
+    def get_seconds(self, sample_indices):
+        """
+        Return the time of samples in seconds since sample 0,
+        or the sample indices as float without the sample rate
+        """
+        indices = np.asarray(sample_indices)
+        if not self.period:
+            return indices.astype(np.float64)
+        if len(self._anchors) == 1:
+            return indices * self.period
+        k = np.searchsorted(self._anchors['sample_index'], indices, side='right') - 1
+        k = np.maximum(k, 0)
+        anchors = self._anchors[k]
+        return (anchors['time'] - self.start_time) + (indices - anchors['sample_index']) * self.period
+
+    def get_datetime64(self, sample_indices):
+        """
+        Return the host time of samples as datetime64 in nanoseconds
+        """
+        seconds = self.get_seconds(sample_indices)
+        if not self.period:
+            raise ValueError('Sample rate is not set')
+        # The start time and the offsets are converted separately to keep nanoseconds
+        start = np.datetime64(int(round(self.start_time * 1e9)), 'ns')
+        return start + np.round(seconds * 1e9).astype('timedelta64[ns]')
+
+    def find_sample_index(self, seconds):
+        """
+        Return the sample indices, as float, at the times in seconds since sample 0
+        """
+        seconds = np.asarray(seconds, dtype=np.float64)
+        if not self.period:
+            return seconds
+        anchor_seconds = self._anchors['time'] - self.start_time
+        k = np.maximum(np.searchsorted(anchor_seconds, seconds, side='right') - 1, 0)
+        indices = self._anchors['sample_index'][k] + (seconds - anchor_seconds[k]) * self.sample_rate
+        # Times within a gap fall on the first sample after the gap
+        following = np.minimum(k + 1, len(self._anchors) - 1)
+        limit = np.where(following > k, self._anchors['sample_index'][following], np.inf)
+        return np.minimum(indices, limit)
@@ -0,0 +1,262 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import numpy as np
+
+
+class PacketTracker:
+    """
+    Loss accounting of streamed packets from the 8-bit packet numbers in the packet headers,
+    and a side array of the packet status byte aligned with the sample index.
+
+    The packet number wraps around from 255 to 0. A packet number behind the last one
+    by less than half of the range is counted as reordered if it is missing in a recent gap,
+    or as a duplicate otherwise, not as a new gap. Reordered and duplicate packets are left out
+    of the data: the add methods return which packets to keep, and the gap stays,
+    with the late packet counted as lost, so that the samples stay in order
+    and the anchors of the timebase at the gaps stay valid.
+    More than 255 consecutive lost packets cannot be detected from the packet number alone.
+    With the packet rate and the arrival timestamps of the packets, the whole cycles
+    of the packet number lost between two packets are counted from the time elapsed between them,
+    when it is longer than half of a cycle. Arrival times delayed by more than half of a cycle,
+    by a stalled receiver for example, are then counted as lost cycles. Use timestamps taken
+    when the packets are read from the socket, such as those of the receiver thread.
+    The sample index counts the samples kept, without the lost samples.
+    Corrupt packets are counted with their sample index, and their packet numbers are not used.
+    """
+    StatusType = np.dtype([('sample_index', '<i8'), ('status', 'u1')])
+    NumberRange = 256
+    HalfRange = 128
+
+    def __init__(self, samples_per_packet, capacity=1024, packet_rate=None):
+        """
+        :param packet_rate: packets per second of the stream, to count lost cycles of the packet number
+            from the arrival timestamps
+        """
+        self.samples_per_packet = samples_per_packet
+        self.capacity = capacity
+        self.packet_rate = packet_rate
+        self.reset()
+
+    def reset(self):
+        self.last_number = None
+        self.last_status = 0
+        self.last_time = None         # Arrival timestamp of the packet with the last packet number
+        self.sample_index = 0         # Index of the next sample received
+        self.received_packets = 0
+        self.lost_packets = 0
+        self.reordered_packets = 0
+        self.duplicate_packets = 0
+        self.corrupt_packets = 0
+        self.gaps = []                # List of (sample index, lost packets) at each gap
+        self._gap_numbers = []        # List of the packet numbers missing in each gap
+        self.corrupt = []             # List of the first sample index of corrupt packets
+        self._status = np.zeros(self.capacity, dtype=self.StatusType)
+        self._status_count = 0
+
+    @property
+    def lost_samples(self):
+        return self.lost_packets * self.samples_per_packet
+
+    def add_packet(self, packet_number, status=0, valid=True, timestamp=None):
+        """
+        Account for a single packet received
+
+        :param timestamp: optional arrival time of the packet in seconds
+        :returns: False if the packet is reordered or a duplicate, and left out of the data
+        """
+        self.received_packets += 1
+        if not valid:
+            self.corrupt_packets += 1
+            self.corrupt.append(self.sample_index)
+            # The packet number of a corrupt packet is not reliable. It is assumed to be the next one.
+            if self.last_number is not None:
+                self.last_number = (self.last_number + 1) & 0xff
+                self.last_time = timestamp
+        elif self.last_number is not None and ((packet_number - self.last_number) & 0xff != 1
+                                               or self._get_elapsed_packets(timestamp) >= self.HalfRange):
+            if not self._account(packet_number, self.sample_index, timestamp):
+                return False
+        else:
+            self.last_number = packet_number
+            self.last_time = timestamp
+        if valid and status != self.last_status:
+            self._add_status(np.array([self.sample_index]), np.array([status]))
+            self.last_status = status
+        self.sample_index += self.samples_per_packet
+        return True
+
+    def add_packets(self, packet_numbers, statuses=None, valid=None, timestamps=None):
+        """
+        Account for a batch of packets in the order received
+
+        :param packet_numbers: uint8 array of the packet numbers
+        :param statuses: optional uint8 array of the status bytes
+        :param valid: optional bool array that is False for corrupt packets
+        :param timestamps: optional float64 array of the arrival times in seconds
+        :returns: None if all the packets are kept, or a bool array that is False
+            for the packets reordered or duplicate, and left out of the data
+        """
+        count = len(packet_numbers)
+        if count == 0:
+            return None
+        if valid is not None and not np.all(valid):
+            return self._add_corrupt(packet_numbers, statuses, valid, timestamps)
+
+        numbers = packet_numbers.astype(np.int32)
+        first = numbers[0] - 1 if self.last_number is None else self.last_number
+        deltas = np.diff(numbers, prepend=first) & 0xff
+        if timestamps is None or not self.packet_rate:
+            times = None
+            in_time = True
+        else:
+            times = np.asarray(timestamps, dtype=np.float64)
+            previous = times[0] if self.last_time is None else self.last_time
+            in_time = np.all(np.diff(times, prepend=previous) * self.packet_rate < self.HalfRange)
+        kept = None
+        if np.all(deltas == 1) and in_time:
+            self.last_number = int(numbers[-1])
+            self.last_time = None if times is None else float(times[-1])
+        else:
+            # Rare: loss, reordering, duplicates or a long interval in the batch
+            kept = np.ones(count, dtype=bool)
+            sample_index = self.sample_index
+            for i, number in enumerate(numbers.tolist()):
+                kept[i] = self._account(number, sample_index, None if times is None else float(times[i]))
+                if kept[i]:
+                    sample_index += self.samples_per_packet
+            if kept.all():
+                kept = None
+            else:
+                count = int(kept.sum())
+                if statuses is not None:
+                    statuses = statuses[kept]
+
+        self.received_packets += len(packet_numbers)
+        if statuses is not None and count:
+            previous = np.concatenate(([self.last_status], statuses[:-1]))
+            changes = np.flatnonzero(statuses != previous)
+            if changes.size:
+                self._add_status(self.sample_index + changes * self.samples_per_packet, statuses[changes])
+            self.last_status = int(statuses[-1])
+        self.sample_index += count * self.samples_per_packet
+        return kept
+
+    def _add_corrupt(self, packet_numbers, statuses, valid, timestamps):
+        # Rare: account for the packets one by one
+        kept = np.ones(len(packet_numbers), dtype=bool)
+        for i in range(len(packet_numbers)):
+            kept[i] = self.add_packet(int(packet_numbers[i]),
+                                      self.last_status if statuses is None else int(statuses[i]),
+                                      bool(valid[i]),
+                                      None if timestamps is None else float(timestamps[i]))
+        return None if kept.all() else kept
+
+    def _get_elapsed_packets(self, timestamp):
+        # Number of packet periods since the packet with the last packet number, 0 without timestamps
+        if timestamp is None or self.last_time is None or not self.packet_rate:
+            return 0.0
+        return (timestamp - self.last_time) * self.packet_rate
+
+    def _account(self, packet_number, sample_index, timestamp=None):
+        # Returns False if the packet is left out of the data
+        if self.last_number is None:
+            self.last_number = packet_number
+            self.last_time = timestamp
+            return True
+        delta = (packet_number - self.last_number) & 0xff
+        forward = 0 < delta < self.HalfRange
+        elapsed = self._get_elapsed_packets(timestamp)
+        if elapsed >= self.HalfRange:
+            # The packet is too late to be reordered. Whole cycles of the packet number
+            # lost before it are counted from the time elapsed.
+            cycles = max(int(np.floor((elapsed - delta) / self.NumberRange + 0.5)), 0)
+            delta += cycles * self.NumberRange
+            forward = delta > 0
+        if delta == 0:
+            self.duplicate_packets += 1
+            return False
+        if forward:
+            if delta > 1:
+                self.lost_packets += delta - 1
+                self.gaps.append((sample_index, delta - 1))
+                self._gap_numbers.append([(self.last_number + i) & 0xff for i in range(1, delta)])
+            self.last_number = packet_number
+            self.last_time = timestamp
+            return True
+
+        # A late packet was counted as lost when the packets after it arrived.
+        # It is too late to put it in order, and the gap is kept.
+        index = self._find_gap(packet_number, sample_index)
+        if index is None:
+            self.duplicate_packets += 1
+        else:
+            self.reordered_packets += 1
+            self._gap_numbers[index].remove(packet_number)
+        return False
+
+    def _find_gap(self, packet_number, sample_index):
+        # Index of the latest gap missing the packet number, within half of the range of packet numbers
+        oldest = sample_index - self.HalfRange * self.samples_per_packet
+        for index in range(len(self.gaps) - 1, -1, -1):
+            if self.gaps[index][0] < oldest:
+                break
+            if packet_number in self._gap_numbers[index]:
+                return index
+        return None
+
+    def _add_status(self, sample_indices, statuses):
+        final = self._status_count + len(sample_indices)
+        if final > len(self._status):
+            grown = np.zeros(max(2 * len(self._status), final), dtype=self.StatusType)
+            grown[:self._status_count] = self._status[:self._status_count]
+            self._status = grown
+        self._status['sample_index'][self._status_count: final] = sample_indices
+        self._status['status'][self._status_count: final] = statuses
+        self._status_count = final
+
+    def get_status_changes(self):
+        """
+        Return a structured array of the sample index and the status byte
+        where the status changed. The status before the first change is 0.
+        """
+        return self._status[:self._status_count]
+
+    def get_status(self, sample_indices):
+        """
+        Return the status byte of the packets holding the samples at sample_indices
+        """
+        changes = self.get_status_changes()
+        positions = np.searchsorted(changes['sample_index'], sample_indices, side='right')
+        status = np.concatenate(([0], changes['status']))
+        return status[positions]
+
+    def find_status(self, mask):
+        """
+        Return a list of (start, stop) sample index ranges where any of the status bits in mask is set
+        """
+        changes = self.get_status_changes()
+        ranges = []
+        start = None
+        for index, status in zip(changes['sample_index'], changes['status']):
+            if status & mask and start is None:
+                start = int(index)
+            elif not status & mask and start is not None:
+                ranges.append((start, int(index)))
+                start = None
+        if start is not None:
+            ranges.append((start, self.sample_index))
+        return ranges
+
+    def get_counters(self):
+        return {
+            'received': self.received_packets,
+            'lost': self.lost_packets,
+            'lost_samples': self.lost_samples,
+            'reordered': self.reordered_packets,
+            'duplicates': self.duplicate_packets,
+            'corrupt': self.corrupt_packets,
+            'gaps': len(self.gaps),
+        }
@@ -93,6 +93,9 @@ class VisaInterface(Interface):
 
     def clear_buffer(self):
         self._visa.clear()
+        # Bytes read ahead by BinaryBlockReader are stale after clearing
+        if getattr(self, '_binary_block_reader', None) is not None:
+            self._binary_block_reader.clear()
 
     def get_visa_instrument(self):
         return self._visa
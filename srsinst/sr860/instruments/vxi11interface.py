@@ -73,6 +73,7 @@ class Vxi11Interface(Interface):
         Read a fixed number of bytes. VXI11 read_raw returns all the data contained
         in the last packet that covers the length of data.
         It could return larger than the specified size of data.
+        BinaryBlockReader keeps the surplus bytes for the next read.
         """
         reply = self._vxi.read_raw(length)
         return reply
@@ -94,6 +95,9 @@ class Vxi11Interface(Interface):
 
     def clear_buffer(self):
         self._vxi.clear()
+        # Bytes read ahead by BinaryBlockReader are stale after clearing
+        if getattr(self, '_binary_block_reader', None) is not None:
+            self._binary_block_reader.clear()
 
     def get_info(self):
         return {'type': self.type,
@@ -0,0 +1,53 @@
+##! 
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##! 
+
+import time
+import numpy as np
+
+from srsinst.sr860.instruments.keys import Keys
+
+
+class SpectrumPlot:
+    """Plot of the amplitude spectral density of streaming data from a WelchSpectrum
+    """
+    def __init__(self, fig, spectrum):
+        self.figure = fig
+        self.spectrum = spectrum
+        self.update_rate = 5  # Hz
+        self.update_period = 1.0 / self.update_rate
+
+        self.ax = self.figure.subplots()
+        frequencies = self.spectrum.get_frequencies()
+        self.line, = self.ax.semilogy(frequencies, np.ones_like(frequencies), color='#00d000')
+
+        unit = 'deg' if self.spectrum.source == 'th' else 'V'
+        if self.spectrum.source == Keys.XY:
+            self.ax.set_xlabel('Offset from reference frequency (Hz)')
+        else:
+            self.ax.set_xlabel('Frequency (Hz)')
+        self.ax.set_ylabel('{}/sqrt(Hz)'.format(unit))
+        self.ax.set_title('{} spectrum, {:.4g} Hz resolution'.format(self.spectrum.source,
+                                                                    self.spectrum.resolution))
+        self.ax.set_xlim(frequencies[0], frequencies[-1])
+
+        self.init_plot = True
+        self.last_updated_time = time.time()
+
+    def request_plot_update(self):
+        current_time = time.time()
+        if current_time - self.last_updated_time < self.update_period:
+            return False
+
+        frequencies, asd = self.spectrum.get_amplitude_spectrum()
+        if asd is None:
+            return False
+        self.line.set_data(frequencies, asd)
+        if self.init_plot or self.spectrum.segment_count < 10:
+            self.ax.relim()
+            self.ax.autoscale_view(scalex=False)
+            self.init_plot = False
+
+        self.last_updated_time = current_time
+        return True
@@ -27,8 +27,9 @@ class TwoByTwoShareXPlot:
         li11, = self.ax[1][1].plot(self.data.time[:2], self.data.th[:2], color='orange')
         self.line = [li00, li01, li10, li11]
 
+        self.initial_points = 10000  # Data points in the initial x range
         self.xlim_min = 0.0
-        self.xlim_max = 10000
+        self.xlim_max = self.initial_points
         self.ax[0][0].set_xlim(self.xlim_min, self.xlim_max)
 
         self.ax[0][0].margins(y=2.0)
@@ -41,41 +42,44 @@ class TwoByTwoShareXPlot:
         self.ax[1][0].set_title('R')
         self.ax[1][1].set_title('Theta')
 
-        self.index_min = 0
-        self.index_max = 1
-        self.index_step = 1
-
         self.ax[0][0].callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.ax[0][1].callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.ax[1][0].callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.ax[1][1].callbacks.connect('xlim_changed', self.on_xlim_changed)
 
         self.init_plot = True
+        self.init_xlim = True
         self.init_time = time.time()
         self.last_updated_time = self.init_time
 
     def on_xlim_changed(self, event_ax):
-        x_min, x_max = event_ax.get_xlim()
-        self.xlim_min = int(x_min)
-        self.xlim_max = int(x_max) + 1
-
-        self.index_step = (self.xlim_max - self.xlim_min) // self.max_points_in_plot
-        if self.index_step < 1:
-            self.index_step = 1
-        data_points = self.data.get_data_size()
-        self.index_min = self.xlim_min if self.xlim_min > 0 else 0
-        self.index_max = self.xlim_max if self.xlim_max < data_points else data_points
+        self.xlim_min, self.xlim_max = event_ax.get_xlim()
 
     def request_plot_update(self):
         current_time = time.time()
         if current_time - self.last_updated_time < self.update_period:
             return False
 
+        # Find the indices from the time values, because the buffer
+        # may not hold data from the beginning of the stream.
         data_size = self.data.get_data_size()
-        if data_size < self.xlim_max:
-            self.index_max = data_size
-
-        s = slice(self.index_min, self.index_max, self.index_step)
+        if self.init_xlim and data_size > 1:
+            # Span the initial x range with the same number of points in the time unit of the buffer
+            t0, t1 = self.data.time[:2]
+            self.ax[0][0].set_xlim(t0, t0 + self.initial_points * (t1 - t0))
+            xlabel = 'Time (s)' if self.data.sample_rate else 'Sample index'
+            self.ax[1][0].set_xlabel(xlabel)
+            self.ax[1][1].set_xlabel(xlabel)
+            self.init_xlim = False
+
+        index_min, index_max = self.data.find_index((self.xlim_min, self.xlim_max))
+        index_min = index_min - 1 if index_min > 0 else 0
+        index_max = index_max + 1 if index_max < data_size else data_size
+        index_step = (index_max - index_min) // self.max_points_in_plot
+        if index_step < 1:
+            index_step = 1
+
+        s = slice(index_min, index_max, index_step)
         ti = self.data.time[s]
         self.line[0].set_data(ti, self.data.x[s])
         self.line[1].set_data(ti, self.data.y[s])
@@ -108,13 +112,15 @@ class TwoByTwoShareXPlot:
         """
         Save streaming data to file
         """
-        data_index = self.last_data_point
-        self.data_points = self.data.get_data_size()
+        first_index = self.data.get_first_index()
+        self.data_points = first_index + self.data.get_data_size()
+        data_index = max(self.last_data_point, first_index)
 
         while data_index < self.data_points:
+            i = data_index - first_index
             task.add_to_table_in_file('Stream Data',
-                self.data.time[data_index],
-                self.data.x[data_index],
-                self.data.y[data_index])
+                self.data.time[i],
+                self.data.x[i],
+                self.data.y[i])
             data_index += 1
         self.last_data_point = self.data_points
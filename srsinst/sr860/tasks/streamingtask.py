@@ -3,13 +3,20 @@
 ##! Subject to the MIT License
 ##! 
 
+import os
 import time
 
 from srsgui import Task
 from srsgui import IntegerInput, FloatInput, ListInput, IntegerListInput
 
 from srsinst.sr860 import SR860, get_sr860
-from srsinst.sr860.instruments.components import DataStream
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.components import DataStream, DataStreamBuffer
+from srsinst.sr860.instruments.streambuffers import RollingDataStreamBuffer, CompactDataStreamBuffer, \
+                                                  MappedDataStreamBuffer, SharedDataStreamBuffer
+from srsinst.sr860.instruments.streamdecimator import BlockMeanDecimator, CicDecimator, MinMaxDecimator
+from srsinst.sr860.instruments.streamstatistics import RunningStatistics
+from srsinst.sr860.instruments.streampublisher import StreamPublisher, StreamSubscriber
 
 from srsinst.sr860.plots.twobytwosharexplot import TwoByTwoShareXPlot
 
@@ -21,6 +28,26 @@ class StreamingTask(Task):
     PacketSize = 'packet size'
     Rate = 'rate divider'
     Port = 'udp port'
+    BufferType = 'buffer type'
+    Decimation = 'decimation'
+    DecimationFilter = 'decimation filter'
+
+    StreamFileName = 'stream.dat'
+    SharedMemoryName = 'sr860_stream'
+
+    BufferClassDict = {
+        'rolling': RollingDataStreamBuffer,
+        'fixed': DataStreamBuffer,
+        'compact': CompactDataStreamBuffer,
+        'memory-mapped': MappedDataStreamBuffer,
+        'shared memory': SharedDataStreamBuffer,
+    }
+
+    DecimatorClassDict = {
+        'block mean': BlockMeanDecimator,
+        'CIC': CicDecimator,
+        'min/max': MinMaxDecimator,
+    }
 
     input_parameters = {
         Duration:   IntegerInput(3600, ' s', 1, 360000, 1),
@@ -28,7 +55,10 @@ class StreamingTask(Task):
         DataFormat: ListInput(list(DataStream.FormatDict.keys())),
         PacketSize: IntegerListInput([1024, 512, 256, 128]),
         Rate:       IntegerInput(4, '  (2^n) ', 0, 20, 1),
-        Port:       IntegerInput(1865, '', 1024, 65535, 1)
+        Port:       IntegerInput(1865, '', 1024, 65535, 1),
+        BufferType: ListInput(list(BufferClassDict.keys())),
+        Decimation: IntegerInput(1, ' ', 1, 1000000, 1),
+        DecimationFilter: ListInput(list(DecimatorClassDict.keys())),
     }
 
     def setup(self):
@@ -44,6 +74,43 @@ class StreamingTask(Task):
         self.lia.stream.rate = self.get_input_parameter(self.Rate)
         self.lia.stream.port = self.get_input_parameter(self.Port)
 
+        if isinstance(self.lia.stream.data, SharedDataStreamBuffer):
+            try:
+                self.lia.stream.data.close()  # Shared by the previous run
+            except BufferError:
+                self.logger.warning('Shared buffer of the previous run stays mapped while its plot is in use')
+        buffer_class = self.BufferClassDict[self.input_parameters[self.BufferType].text]
+        if buffer_class is MappedDataStreamBuffer:
+            data_dir = '.'
+            if self.session_handler and self.session_handler.data_dir:
+                data_dir = self.session_handler.data_dir
+            data_buffer = MappedDataStreamBuffer(self.lia.stream.data_buffer_size,
+                                                 file_name=os.path.join(data_dir, self.StreamFileName))
+        elif buffer_class is SharedDataStreamBuffer:
+            data_buffer = SharedDataStreamBuffer(self.lia.stream.data_buffer_size, name=self.SharedMemoryName)
+            self.logger.info('Stream buffer is shared as {}'.format(self.SharedMemoryName))
+        else:
+            data_buffer = buffer_class(self.lia.stream.data_buffer_size)
+        self.lia.stream.set_data_buffer(data_buffer)
+
+        decimation = self.get_input_parameter(self.Decimation)
+        decimator = None
+        if decimation > 1:
+            decimator_class = self.DecimatorClassDict[self.input_parameters[self.DecimationFilter].text]
+            decimator = decimator_class(decimation)
+            self.logger.info('Decimation: {} by {}'.format(self.input_parameters[self.DecimationFilter].text,
+                                                           decimation))
+            if isinstance(data_buffer, CompactDataStreamBuffer) and \
+                    self.input_parameters[self.DataFormat].text == Keys.Int16:
+                self.logger.info('Decimated int16 data is stored as float32')
+        self.lia.stream.set_decimator(decimator)
+        # Consumers of the stored blocks run in subscriber threads, off the receiving loop
+        self.publisher = StreamPublisher()
+        self.lia.stream.set_publisher(self.publisher)
+        self.lia.stream.set_statistics(None)
+        self.statistics = RunningStatistics(names=('x', 'y'))
+        self.publisher.subscribe('statistics', self.on_statistics_block, policy=StreamSubscriber.Block)
+
         self.duration_value = self.get_input_parameter(self.Duration)
         self.max_rate = self.lia.stream.max_rate
         self.sample_rate = self.max_rate / 2 ** self.lia.stream.rate
@@ -57,25 +124,34 @@ class StreamingTask(Task):
                                  )
                          )
 
-        self.plot = TwoByTwoShareXPlot(self.figure, self.lia.stream.data)
+        self.setup_plot()
 
         # Mark the time 0
         self.init_time = time.time()
 
+    def setup_plot(self):
+        self.plot = TwoByTwoShareXPlot(self.figure, self.lia.stream.data)
+
+    def on_statistics_block(self, block, first_index):
+        self.statistics.add_block(block)
+
     def test(self):
         if self.get_input_parameter(self.Channels) == 0:
             raise ValueError('Channel X is not allowed,Choose other multiple channels')
 
-        self.last_p_id = 0
-        self.lia.stream.start()
+        lost_packets = 0
+        self.lia.stream.start(threaded=True)
+        reader = self.lia.stream.reader
         while time.time() - self.init_time < self.duration_value:
-            block, p_id = self.lia.stream.receive_packet()
-            self.lia.stream.data.add_data_block(*block)
+            block, p_ids = reader.receive_blocks()
+            if len(p_ids) == 0:
+                continue
+            self.lia.stream.store_block(block)
 
-            if self.last_p_id and p_id - self.last_p_id > 1:
+            if reader.tracker.lost_packets != lost_packets:
                 self.logger.warning('{} missing packet(s) before ID:{}'
-                                    .format(p_id - self.last_p_id - 1, p_id))
-            self.last_p_id = p_id
+                                    .format(reader.tracker.lost_packets - lost_packets, p_ids[-1]))
+                lost_packets = reader.tracker.lost_packets
             self.notify_data_available()
 
             if not self.is_running():
@@ -86,4 +162,32 @@ class StreamingTask(Task):
             self.request_figure_update()
 
     def cleanup(self):
+        counters = self.lia.stream.get_receiver_counters()
         self.lia.stream.stop()
+        loss = self.lia.stream.get_loss_counters()
+        if loss:
+            self.logger.info('Packets received: {received}, lost: {lost} ({lost_samples} samples), '
+                             'reordered: {reordered}, duplicates: {duplicates}, corrupt: {corrupt}'
+                             .format(**loss))
+        if isinstance(self.lia.stream.data, MappedDataStreamBuffer):
+            self.lia.stream.data.flush()
+
+        self.publisher.close()
+        for name, subscriber in self.publisher.get_counters().items():
+            self.logger.info('Subscriber {}: {} blocks, {} dropped, max lag {:.3f} s'
+                             .format(name, subscriber['delivered_blocks'], subscriber['dropped_blocks'],
+                                     subscriber['max_lag']))
+
+        # The rate of the data buffer is known after streaming started
+        self.statistics.sample_rate = self.lia.stream.data.sample_rate
+        results = self.statistics.get_results()
+        for name in ('x', 'y'):
+            if name in results:
+                self.logger.info('{}: mean {:.6e}, std {:.6e}, min {:.6e}, max {:.6e}'
+                                 .format(name.upper(), results[name]['mean'], results[name]['std'],
+                                         results[name]['min'], results[name]['max']))
+        if self.session_handler is not None and self.session_handler.is_file_open:
+            self.add_dict_to_file('stream statistics', results)
+        if counters.get('dropped'):
+            self.logger.warning('{} packet(s) dropped in {} overflow(s) of the receive ring'
+                                .format(counters['dropped'], counters['overflows']))
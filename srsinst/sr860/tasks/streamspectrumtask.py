@@ -0,0 +1,66 @@
+##! 
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##! 
+
+import copy
+
+from srsgui import IntegerInput, FloatInput, ListInput
+
+from srsinst.sr860.instruments.streamspectrum import WelchSpectrum
+from srsinst.sr860.instruments.streampublisher import StreamSubscriber
+from srsinst.sr860.plots.spectrumplot import SpectrumPlot
+from srsinst.sr860.tasks.streamingtask import StreamingTask
+
+
+class StreamSpectrumTask(StreamingTask):
+    """
+    Stream data and plot the spectral density of the data as it arrives,
+    from the running average kept by WelchSpectrum
+    """
+    Source = 'spectrum source'
+    Resolution = 'resolution'
+    Window = 'window'
+    Averages = 'averages'
+
+    input_parameters = copy.deepcopy(StreamingTask.input_parameters)
+    input_parameters.update({
+        Source:     ListInput(list(WelchSpectrum.SourceDict.keys())),
+        Resolution: FloatInput(1.0, ' Hz', 0.0001, 100000.0, 0.1),
+        Window:     ListInput(list(WelchSpectrum.WindowDict.keys())),
+        Averages:   IntegerInput(0, '  (0 for all)', 0, 100000, 1),
+    })
+
+    def setup_plot(self):
+        sample_rate = self.sample_rate
+        if self.lia.stream.decimator is not None:
+            sample_rate = self.lia.stream.decimator.get_output_rate(sample_rate)
+        source = self.input_parameters[self.Source].text
+        averages = self.get_input_parameter(self.Averages)
+        resolution = self.get_input_parameter(self.Resolution)
+        self.spectrum = WelchSpectrum(sample_rate,
+                                      resolution=resolution,
+                                      window=self.input_parameters[self.Window].text,
+                                      averages=averages if averages > 0 else None,
+                                      source=source)
+        self.logger.info('Spectrum of {}: {} points, {:.4g} Hz resolution'
+                         .format(source, self.spectrum.segment_size, self.spectrum.resolution))
+        if self.spectrum.resolution > resolution:
+            self.logger.warning('Requested resolution of {} Hz is limited to {:.4g} Hz by the maximum '
+                                'segment size of {} points'
+                                .format(resolution, self.spectrum.resolution, WelchSpectrum.MaxSegmentSize))
+        elif self.spectrum.segment_size == WelchSpectrum.MinSegmentSize:
+            self.logger.warning('Requested resolution of {} Hz is {:.4g} Hz with the minimum '
+                                'segment size of {} points'
+                                .format(resolution, self.spectrum.resolution, WelchSpectrum.MinSegmentSize))
+        self.plot = SpectrumPlot(self.figure, self.spectrum)
+        # Segments continue across blocks, so no block may be dropped
+        self.publisher.subscribe('spectrum', self.on_spectrum_block, policy=StreamSubscriber.Block)
+
+    def on_spectrum_block(self, block, first_index):
+        self.spectrum.add_block(block)
+
+    def cleanup(self):
+        super().cleanup()
+        self.logger.info('{} segments averaged, {} skipped with missing samples'
+                         .format(self.spectrum.segment_count, self.spectrum.skipped_count))
@@ -0,0 +1,317 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import threading
+
+import pytest
+import numpy as np
+
+from srsgui.inst.exceptions import InstCommunicationError
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.components import DataCapture
+from srsinst.sr860.instruments.captureexport import CaptureExporter
+from srsinst.sr860.instruments.binaryblock import get_binary_block_reader
+
+
+class FakeCaptureComm:
+    """
+    Capture buffer of an instrument behind an interface that reads ahead like VXI-11 read_raw():
+    _read_binary() returns at least read_size bytes when they are available,
+    more than the length requested.
+    """
+    def __init__(self, data, config=Keys.XYRT, buffer_kilobytes=None, rate=1.0, read_size=5000):
+        raw = np.ascontiguousarray(data, dtype=DataCapture.DataType).tobytes()
+        kilobytes = buffer_kilobytes if buffer_kilobytes else (len(raw) + 1023) // 1024
+        self.buffer = bytearray(raw.ljust(kilobytes * 1024, b'\0'))
+        self.config = config
+        self.data_bytes = len(raw)
+        self.rate = rate
+        self.state = 0
+        self.read_size = read_size
+        self.requests = []
+        self.read_count = 0
+        self.pending = bytearray()
+        self._lock = threading.Lock()
+
+    def get_lock(self):
+        return self._lock
+
+    def query_text(self, cmd):
+        replies = {
+            'CAPTURECFG?': DataCapture.ChannelDict[self.config],
+            'CAPTUREBYTES?': self.data_bytes,
+            'CAPTURELEN?': len(self.buffer) // 1024,
+            'CAPTURERATE?': self.rate,
+            'CAPTURESTAT?': self.state,
+        }
+        return str(replies[cmd])
+
+    def send(self, cmd):
+        self._send(cmd)
+
+    def _send(self, cmd):
+        name, _, args = cmd.partition(' ')
+        if name != 'CAPTUREGET?':
+            return
+        start_kb, count_kb = (int(arg) for arg in args.split(','))
+        self.requests.append((start_kb, count_kb))
+        block = bytes(self.buffer[start_kb * 1024: (start_kb + count_kb) * 1024])
+        length = str(len(block)).encode()
+        self.pending += b'#' + str(len(length)).encode() + length + block + b'\n'
+
+    def _read_binary(self, length=4):
+        self.read_count += 1
+        size = max(length, self.read_size)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+
+def make_capture(data, config=Keys.XYRT, **kwargs):
+    capture = SR860().capture
+    capture.comm = FakeCaptureComm(data, config, **kwargs)
+    return capture
+
+
+def make_data(rows, columns, seed=0):
+    return np.random.default_rng(seed).standard_normal((rows, columns)).astype(np.float32)
+
+
+@pytest.mark.parametrize('config, columns', [(Keys.X, 1), (Keys.XY, 2), (Keys.XYRT, 4)])
+def test_get_all_data_in_blocks(config, columns):
+    data = make_data(30001, columns)
+    capture = make_capture(data, config)
+    out = capture.get_all_data()
+    assert out.dtype == np.float32
+    assert out.shape == (columns, 30001)
+    assert np.array_equal(out, data.T)
+
+    kilobytes = (data.nbytes + 1023) // 1024
+    assert capture.comm.requests[0] == (0, min(kilobytes, DataCapture.MaxBlockKilobytes))
+    assert len(capture.comm.requests) == -(-kilobytes // DataCapture.MaxBlockKilobytes)
+
+
+def test_get_all_data_empty_buffer():
+    capture = make_capture(np.empty((0, 2)), Keys.RT)
+    assert capture.get_all_data().shape == (2, 0)
+    assert capture.comm.requests == []
+
+
+def test_follower_reads_only_new_rows():
+    data = make_data(512, 2)
+    capture = make_capture(data, Keys.XY, buffer_kilobytes=4)
+    comm = capture.comm
+    comm.state = 1 << DataCapture.CaptureStateBitDict[Keys.InProgress]
+    comm.data_bytes = 1000
+    follower = capture.get_follower()
+    assert np.array_equal(follower.read(), data[:125].T)
+
+    comm.data_bytes = 3004
+    assert np.array_equal(follower.read(), data[125:375].T)
+    assert comm.requests[-1] == (0, 3)
+    assert follower.read().shape == (2, 0)
+
+    # The writer goes around the end of the buffer
+    new_data = make_data(100, 2, seed=1)
+    comm.buffer[:800] = new_data.tobytes()
+    comm.state |= 1 << DataCapture.CaptureStateBitDict[Keys.Wrapped]
+    comm.data_bytes = 800
+    assert np.array_equal(follower.read(), np.concatenate((data[375:], new_data)).T)
+    assert follower.read_rows == 512 + 100
+    assert follower.overruns == 0
+
+
+def test_follower_resynchronizes_after_overrun():
+    data = make_data(512, 2)
+    capture = make_capture(data, Keys.XY, buffer_kilobytes=4)
+    comm = capture.comm
+    comm.data_bytes = 3000
+    follower = capture.get_follower()
+    assert follower.read().shape == (2, 375)
+
+    # The writer laps the reader before the next read
+    comm.state = 1 << DataCapture.CaptureStateBitDict[Keys.Wrapped]
+    comm.data_bytes = 3200
+    block = follower.read()
+    assert follower.overruns == 1
+    assert np.array_equal(block, np.concatenate((data[400:], data[:400])).T)
+
+
+def test_follower_stops_with_the_capture():
+    data = make_data(300, 4)
+    capture = make_capture(data, Keys.XYRT)
+    blocks = list(capture.get_follower(poll_interval=0.0))
+    assert len(blocks) == 1
+    assert np.array_equal(blocks[0], data.T)
+
+
+@pytest.mark.parametrize('key', [
+    slice(None), slice(None, None, -1), slice(-300, -10, 7), slice(9000, 100, -13),
+    slice(5000, 5000), slice(130, 131), slice(-20000, 20000, 257),
+])
+def test_capture_buffer_slices(key):
+    data = make_data(10000, 2)
+    buffer = make_capture(data, Keys.XY).buffer
+    assert len(buffer) == 10000
+    assert buffer.shape == (2, 10000)
+    out = buffer[key]
+    assert out.shape == data[key].T.shape
+    assert np.array_equal(out, data[key].T)
+
+
+def test_capture_buffer_index():
+    data = make_data(1000, 4)
+    buffer = make_capture(data, Keys.XYRT).buffer
+    assert np.array_equal(buffer[0], data[0])
+    assert np.array_equal(buffer[-1], data[-1])
+    assert np.array_equal(buffer[np.int64(700)], data[700])
+    with pytest.raises(IndexError):
+        buffer[1000]
+    with pytest.raises(IndexError):
+        buffer[-1001]
+
+
+def test_capture_buffer_cache():
+    data = make_data(10000, 2)
+    capture = make_capture(data, Keys.XY)
+    buffer = capture.buffer
+    comm = capture.comm
+
+    buffer[0:1000]
+    assert comm.requests == [(0, 8)]
+    buffer[900:100:-3]
+    assert len(comm.requests) == 1
+    assert buffer.get_counters() == {'requests': 1, 'cached_kilobytes': 8, 'hits': 8, 'misses': 8}
+
+    # Only the kilobytes missing in the cache are read, in runs up to MaxBlockKilobytes
+    buffer[::-1]
+    assert comm.requests[1:] == [(8, 64), (72, 7)]
+    assert buffer.get_counters()['cached_kilobytes'] == 79
+
+    buffer.cache_size = 4
+    assert np.array_equal(buffer[2000:2100], data[2000:2100].T)
+    assert list(buffer.cache) == [77, 78, 15, 16]
+    assert len(comm.requests) == 3
+
+    # A new capture clears the cache
+    comm.buffer[:80] = data[:10][::-1].tobytes()
+    capture.start()
+    assert np.array_equal(buffer[:10], data[:10][::-1].T)
+    assert comm.requests[-1] == (0, 1)
+
+
+@pytest.mark.parametrize('config, columns', [(Keys.X, 1), (Keys.RT, 2), (Keys.XYRT, 4)])
+def test_export_raw(tmp_path, config, columns):
+    data = make_data(20001, columns)
+    capture = make_capture(data, config, rate=78125.0)
+    file_name = str(tmp_path / 'capture.dat')
+    progress = []
+    result = CaptureExporter(capture, block_kilobytes=16).export(
+        file_name, callback=lambda transferred, total, rate: progress.append((transferred, total)))
+    assert result['format'] == CaptureExporter.Raw
+    assert result['data_points'] == 20001
+    assert result['bytes'] == data.nbytes
+    assert progress[-1] == (data.nbytes, data.nbytes)
+    assert len(progress) == len(capture.comm.requests) == -(-data.nbytes // (16 * 1024))
+
+    header, out = CaptureExporter.read_raw(file_name)
+    assert header['columns'] == columns
+    assert header['channel'] == DataCapture.ChannelDict[config]
+    assert header['sample_rate'] == 78125.0
+    assert np.array_equal(out, data.T)
+
+
+def test_export_npy(tmp_path):
+    data = make_data(5000, 4)
+    file_name = str(tmp_path / 'capture.npy')
+    result = make_capture(data).export(file_name)
+    assert result['format'] == CaptureExporter.Npy
+    out = np.load(file_name)
+    assert out.dtype == DataCapture.DataType
+    assert np.array_equal(out, data)
+
+
+def test_export_csv(tmp_path):
+    data = make_data(3000, 2)
+    file_name = str(tmp_path / 'capture.csv')
+    make_capture(data, Keys.RT).export(file_name)
+    with open(file_name) as f:
+        assert f.readline().strip() == 'R,Theta'
+    out = np.loadtxt(file_name, delimiter=',', skiprows=1, dtype=np.float32)
+    assert np.array_equal(out, data)
+
+
+def test_export_invalid_format(tmp_path):
+    capture = make_capture(make_data(10, 4))
+    with pytest.raises(ValueError):
+        capture.export(str(tmp_path / 'capture.dat'), 'hdf5')
+    capture.export(str(tmp_path / 'capture.npy'))
+    with pytest.raises(ValueError):
+        CaptureExporter.read_raw(str(tmp_path / 'capture.npy'))
+
+
+class ReadIntoComm:
+    """
+    Interface that reads into the buffer of the caller, a few bytes at a time, like a serial port
+    """
+    def __init__(self, data, chunk_size=3):
+        self.pending = bytearray(data)
+        self.chunk_size = chunk_size
+
+    def _read_binary_into(self, view):
+        size = min(len(view), len(self.pending), self.chunk_size)
+        view[:size] = self.pending[:size]
+        del self.pending[:size]
+        return size
+
+
+def test_block_reader_keeps_surplus_bytes():
+    comm = FakeCaptureComm(np.empty((0, 1)), read_size=4096)
+    comm.pending += b'#15hello\r\n#210abcdefghij\n#14wxyz'
+    reader = get_binary_block_reader(comm)
+    assert get_binary_block_reader(comm) is reader
+
+    assert reader.read_block() == b'hello'
+    assert comm.read_count == 1
+    assert reader.get_surplus_size() == len(b'\r\n#210abcdefghij\n#14wxyz')
+
+    # The second and third blocks are read from the surplus bytes, after the terminators
+    buffer = bytearray(4)
+    assert reader.read_block_into(buffer) == 4
+    assert buffer == b'abcd'
+    assert reader.read_block() == b'wxyz'
+    assert comm.read_count == 1
+    assert reader.get_surplus_size() == 0
+
+    comm.pending += b'#12ok\n'
+    reader.clear()
+    assert reader.read_block() == b'ok'
+    assert reader.get_surplus_size() == 1
+
+
+def test_block_reader_into_array():
+    data = make_data(1000, 2)
+    comm = ReadIntoComm(b'#48000' + data.tobytes() + b'\n')
+    reader = get_binary_block_reader(comm)
+    out = np.empty((1000, 2), dtype=np.float32)
+    assert reader.read_block_into(out) == 8000
+    assert np.array_equal(out, data)
+    assert reader.get_surplus_size() == 0
+    assert comm.pending == b'\n'
+
+
+@pytest.mark.parametrize('data, error', [
+    (b'X', ValueError),
+    (b'#0abc', ValueError),
+    (b'#15abc', InstCommunicationError),
+    (b'', InstCommunicationError),
+])
+def test_block_reader_errors(data, error):
+    comm = FakeCaptureComm(np.empty((0, 1)), read_size=1)
+    comm.pending += data
+    with pytest.raises(error):
+        get_binary_block_reader(comm).read_block()
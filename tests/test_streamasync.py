@@ -0,0 +1,118 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import socket
+import asyncio
+
+import pytest
+import numpy as np
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.streamasync import StreamProtocol
+from srsinst.sr860.instruments.streamemulator import StreamPacketGenerator
+
+
+class PausingTransport:
+    def __init__(self):
+        self.paused = False
+        self.pause_count = 0
+
+    def pause_reading(self):
+        self.paused = True
+        self.pause_count += 1
+
+    def resume_reading(self):
+        self.paused = False
+
+
+def receive(protocol, count):
+    for i in range(count):
+        protocol.datagram_received(bytes([i]), ('127.0.0.1', 1865))
+
+
+def get_packets(protocol, max_count, timeout=1.0):
+    packets = asyncio.run(protocol.get_packets(max_count, timeout))
+    return [packet[0] for packet, _ in packets]
+
+
+def test_drop_oldest_keeps_latest_packets():
+    protocol = StreamProtocol(4, StreamProtocol.DropOldest)
+    protocol.connection_made(PausingTransport())
+    receive(protocol, 10)
+    assert protocol.get_counters() == {'received': 10, 'dropped': 6, 'pending': 4}
+    assert not protocol.transport.paused
+    assert get_packets(protocol, 3) == [6, 7, 8]
+    assert get_packets(protocol, 3) == [9]
+    assert protocol.get_counters() == {'received': 10, 'dropped': 6, 'pending': 0}
+
+
+def test_block_pauses_reading_until_half_is_taken():
+    protocol = StreamProtocol(4, StreamProtocol.Block)
+    protocol.connection_made(PausingTransport())
+    receive(protocol, 5)
+    assert protocol.paused and protocol.transport.paused
+    assert protocol.get_counters() == {'received': 5, 'dropped': 0, 'pending': 5}
+
+    assert get_packets(protocol, 2) == [0, 1]
+    assert protocol.transport.paused
+    assert get_packets(protocol, 1) == [2]
+    assert not protocol.paused and not protocol.transport.paused
+
+    receive(protocol, 3)
+    assert protocol.transport.pause_count == 2
+    assert get_packets(protocol, 10) == [3, 4, 0, 1, 2]
+    assert protocol.get_counters() == {'received': 8, 'dropped': 0, 'pending': 0}
+
+
+def test_block_drops_newest_without_pause():
+    protocol = StreamProtocol(4, StreamProtocol.Block)
+    protocol.connection_made(object())
+    receive(protocol, 7)
+    assert protocol.get_counters() == {'received': 7, 'dropped': 3, 'pending': 4}
+    assert get_packets(protocol, 10) == [0, 1, 2, 3]
+
+
+def test_get_packets_ends():
+    protocol = StreamProtocol(4)
+    with pytest.raises(asyncio.TimeoutError):
+        get_packets(protocol, 1, timeout=0.01)
+    protocol.error_received(OSError('unreachable'))
+    with pytest.raises(OSError):
+        get_packets(protocol, 1)
+    protocol.connection_lost(None)
+    assert get_packets(protocol, 1) == []
+    with pytest.raises(ValueError):
+        StreamProtocol(4, 'drop-newest')
+
+
+def test_blocks_receive_every_packet_with_block_policy():
+    generator = StreamPacketGenerator(Keys.XY, Keys.Float32, 512)
+    packets = generator.make_packets(40)
+    stream = SR860().stream
+    stream.listen(Keys.XY, Keys.Float32, 512, generator.sample_rate)
+    address = ('127.0.0.1', stream.udp_socket.getsockname()[1])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for packet in packets:
+            sender.sendto(packet.data, address)
+
+    async def consume():
+        blocks = []
+        count = 0
+        async for block, packet_numbers in stream.blocks(max_packets=3, queue_size=8,
+                                                         policy=StreamProtocol.Block, start=False):
+            blocks.append(block.copy())
+            count += len(packet_numbers)
+            if count == len(packets):
+                assert stream.get_receiver_counters()['dropped'] == 0
+                break
+        return np.concatenate(blocks, axis=1)
+
+    data = asyncio.run(consume())
+    assert data.shape == (4, 40 * generator.samples_per_packet)
+    assert np.allclose(data[2], np.hypot(data[0], data[1]))
+    assert stream.get_loss_counters()['lost'] == 0
+    # The protocol counters are kept after the generator stops streaming
+    assert stream.get_receiver_counters() == {'received': 40, 'dropped': 0, 'pending': 0}
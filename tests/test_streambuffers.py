@@ -0,0 +1,238 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import os
+import sys
+import subprocess
+import pytest
+import numpy as np
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.streamdecimator import BlockMeanDecimator
+from srsinst.sr860.instruments.streambuffers import RollingDataStreamBuffer, CompactDataStreamBuffer, \
+    MappedDataStreamBuffer, SharedDataStreamBuffer
+
+
+def make_block(start, count):
+    x = np.arange(start, start + count, dtype=np.float64)
+    return x, -x, 2 * x, 3 * x
+
+
+def test_rolling_wraparound():
+    data = RollingDataStreamBuffer(100, Keys.XYRT, Keys.Float32, 1000.0)
+    data.add_data_block(*make_block(0, 70))
+    data.add_data_block(*make_block(70, 60))
+    assert data.get_data_size() == 100
+    assert data.get_first_index() == 30
+    assert data.get_total_size() == 130
+    assert np.array_equal(data.x, np.arange(30, 130))
+    assert np.array_equal(data.th, 3 * np.arange(30, 130))
+    assert np.allclose(data.time, np.arange(30, 130) / 1000.0)
+    assert np.array_equal(data.get_latest(5)[2], -np.arange(125, 130))
+
+    # Only the latest points of a block larger than the buffer are kept
+    data.add_data_block(*make_block(130, 250))
+    assert np.array_equal(data.x, np.arange(280, 380))
+    assert np.array_equal(data.r, 2 * np.arange(280, 380))
+
+
+def test_rolling_x_channel():
+    data = RollingDataStreamBuffer(100)
+    data.add_data_block(np.arange(150, dtype=np.float32))
+    assert np.array_equal(data.x, np.arange(50, 150))
+    assert np.isnan(data.y).all() and np.isnan(data.th).all()
+
+
+def test_compact_derives_columns_not_streamed():
+    data = CompactDataStreamBuffer(100, Keys.XY, Keys.Float32, 1000.0)
+    x, y = np.float32([3, 0, -1]), np.float32([4, 2, 0])
+    data.add_data_block(x, y)
+    assert data.raw.shape == (100, 2)
+    assert np.allclose(data.r[:], [5, 2, 1])
+    assert np.allclose(data.th[:], [np.degrees(np.arctan2(4, 3)), 90, 180])
+    assert np.allclose(data.time[1:], [0.001, 0.002])
+    assert np.array_equal(data.find_index([0.0015]), [2])
+
+
+def test_compact_int16_storage():
+    data = CompactDataStreamBuffer(100, Keys.XY, Keys.Int16)
+    data.add_data_block(np.float32([3, -5]), np.float32([4, 12]))
+    assert data.raw.dtype == np.int16
+    assert np.array_equal(data.x[:], [3, -5])
+    assert np.allclose(data.r[:], [5, 13])
+
+
+def test_mapped_grows_and_reader_follows(tmp_path):
+    file_name = str(tmp_path / 'stream.dat')
+    writer = MappedDataStreamBuffer(50, Keys.XY, Keys.Float32, 1000.0, file_name=file_name)
+    reader = None
+    try:
+        writer.add_data_block(*make_block(0, 30)[:2])
+        writer.flush()
+        reader = MappedDataStreamBuffer(file_name=file_name, read_only=True)
+        assert reader.channel == Keys.XY and reader.sample_rate == 1000.0
+        assert reader.get_data_size() == 30
+
+        # The file grows by the chunk size, and the reader maps the grown file
+        writer.add_data_block(*make_block(30, 60)[:2])
+        writer.flush()
+        assert writer.get_buffer_size() == 100
+        assert reader.get_data_size() == 90
+        assert np.array_equal(reader.y[:], -np.arange(90))
+        assert np.allclose(reader.r[85:], np.hypot(np.arange(85, 90), np.arange(85, 90)))
+    finally:
+        if reader is not None:
+            reader.close()
+        writer.close()
+
+
+def test_mapped_reader_has_anchors_of_writer(tmp_path):
+    file_name = str(tmp_path / 'stream.dat')
+    writer = MappedDataStreamBuffer(100, Keys.XY, Keys.Float32, 1000.0, file_name=file_name)
+    reader = MappedDataStreamBuffer(file_name=file_name, read_only=True)
+    try:
+        # As DataStream.update_timebase() anchors the first block and a gap of lost packets
+        writer.timebase.set_anchor(0, 1000.0)
+        writer.add_data_block(*make_block(0, 30)[:2])
+        writer.timebase.add_gap(30, 0.5)
+        writer.add_data_block(*make_block(30, 20)[:2])
+        writer.flush()
+
+        assert reader.get_data_size() == 50
+        assert np.allclose(reader.time[:], writer.time[:])
+        assert reader.time[30] == pytest.approx(0.53)
+        assert np.array_equal(reader.get_datetime(), writer.get_datetime())
+        assert reader.timebase.start_time == 1000.0
+        assert float(reader.header['start_time']) == 1000.0
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_shared_reader_has_times_of_writer():
+    name = 'sr860_test_{}'.format(os.getpid())
+    writer = SharedDataStreamBuffer(100, Keys.XYRT, Keys.Float32, 1000.0, name=name)
+    reader = SharedDataStreamBuffer(name=name, create=False)
+    try:
+        writer.timebase.set_anchor(0, 1000.0)
+        writer.add_data_block(*make_block(0, 30))
+        writer.timebase.add_gap(30, 0.5)
+        writer.add_data_block(*make_block(30, 20))
+
+        assert reader.time[30] == pytest.approx(0.53)
+        assert np.array_equal(reader.get_datetime(), writer.get_datetime())
+        assert reader.get_datetime(30) == np.datetime64(1000530000000, 'ns')
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_shared_reader_columns_follow_writer():
+    name = 'sr860_test_{}'.format(os.getpid())
+    writer = SharedDataStreamBuffer(100, Keys.XYRT, Keys.Float32, 1000.0, name=name)
+    reader = SharedDataStreamBuffer(name=name, create=False)
+    try:
+        assert len(reader.x) == 0
+        writer.add_data_block(*make_block(0, 30))
+        assert np.array_equal(reader.x, np.arange(30))
+        writer.add_data_block(*make_block(30, 90))
+        assert np.array_equal(reader.y, -np.arange(20, 120))
+        assert np.allclose(reader.time, np.arange(20, 120) / 1000.0)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_shared_close_with_views_in_use():
+    name = 'sr860_test_{}'.format(os.getpid())
+    writer = SharedDataStreamBuffer(100, Keys.XYRT, Keys.Float32, name=name)
+    writer.add_data_block(*make_block(0, 10))
+    reader = SharedDataStreamBuffer(name=name, create=False)
+    reader_x = reader.x
+    writer_r = writer.r
+    kept = writer.y.copy()
+
+    with pytest.raises(BufferError):
+        reader.close()
+    with pytest.raises(BufferError):
+        writer.close()
+    # The name is removed by the first close of the writer, and can be used again
+    with pytest.raises(FileNotFoundError):
+        SharedDataStreamBuffer(name=name, create=False)
+    assert np.array_equal(reader_x, np.arange(10))
+    assert np.array_equal(writer_r, 2 * np.arange(10))
+
+    del reader_x, writer_r
+    reader.close()
+    writer.close()
+    assert reader.memory is None and writer.memory is None
+    assert np.array_equal(kept, -np.arange(10))
+
+
+def test_shared_reader_process_keeps_block():
+    name = 'sr860_test_{}'.format(os.getpid())
+    writer = SharedDataStreamBuffer(100, Keys.XYRT, Keys.Float32, name=name)
+    try:
+        writer.add_data_block(*make_block(0, 10))
+        code = ('from srsinst.sr860.instruments.streambuffers import SharedDataStreamBuffer\n'
+                'reader = SharedDataStreamBuffer(name="{}", create=False)\n'
+                'print(reader.get_data_size())\n'
+                'reader.close()\n'.format(name))
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        assert result.stdout.strip() == '10', result.stderr
+        # The block is not removed when the reader process exits
+        reader = SharedDataStreamBuffer(name=name, create=False)
+        assert np.array_equal(reader.x, np.arange(10))
+        reader.close()
+    finally:
+        writer.close()
+
+
+def test_compact_int16_keeps_nan():
+    data = CompactDataStreamBuffer(100, Keys.XY, Keys.Int16)
+    x = np.array([1, 2, np.nan, 4], dtype=np.float32)
+    data.add_data_block(x, -x)
+    assert np.array_equal(data.x[:], x, equal_nan=True)
+    assert np.array_equal(data.y[:], -x, equal_nan=True)
+    assert np.isnan(data.r[2]) and np.isnan(data.th[2])
+    assert data.x[1] == 2
+
+
+def test_mapped_int16_reader_keeps_nan(tmp_path):
+    file_name = str(tmp_path / 'stream.dat')
+    writer = MappedDataStreamBuffer(100, Keys.XYRT, Keys.Int16, file_name=file_name)
+    x = np.array([1, 2, np.nan, 4], dtype=np.float32)
+    writer.add_data_block(x, x, x, x)
+    writer.flush()
+    reader = MappedDataStreamBuffer(file_name=file_name, read_only=True)
+    assert np.array_equal(reader.th[:], x, equal_nan=True)
+    reader.close()
+    writer.close()
+
+
+def test_decimated_int16_is_stored_as_float32():
+    stream = SR860().stream
+    stream.set_data_buffer(CompactDataStreamBuffer(100))
+    stream.set_decimator(BlockMeanDecimator(2))
+    stream._prepare_decoding(Keys.XY, Keys.Int16, 1024, 1000.0)
+    x = np.array([[1, 2, 3, 5]], dtype=np.float32)
+    stream.store_block(np.concatenate((x, -x)))
+    assert stream.data.raw.dtype == np.float32
+    assert np.array_equal(stream.data.x[:], [1.5, 4.0])
+    assert np.array_equal(stream.data.y[:], [-1.5, -4.0])
+
+
+def test_decimator_is_not_set_while_streaming_int16():
+    stream = SR860().stream
+    stream.set_data_buffer(CompactDataStreamBuffer(100))
+    stream.listen(Keys.XY, Keys.Int16, 1024, 1000.0)
+    try:
+        with pytest.raises(ValueError):
+            stream.set_decimator(BlockMeanDecimator(2))
+    finally:
+        stream.stop()
+    stream.set_decimator(BlockMeanDecimator(2))
@@ -0,0 +1,71 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.streamdecimator import CicDecimator, MinMaxDecimator
+
+
+def process_in_blocks(decimator, data, block_size):
+    blocks = [decimator.process(data[:, i: i + block_size]) for i in range(0, data.shape[1], block_size)]
+    return np.concatenate(blocks, axis=1)
+
+
+def cic_reference(data, factor, order):
+    kernel = np.ones(1)
+    for _ in range(order):
+        kernel = np.convolve(kernel, np.ones(factor))
+    kernel /= kernel.sum()
+    filtered = np.array([np.convolve(row, kernel, mode='valid') for row in data.astype(np.float64)])
+    return filtered[:, ::factor]
+
+
+@pytest.mark.parametrize('factor, order', [(1, 3), (2, 1), (5, 3), (16, 2), (10, 5)])
+def test_cic_matches_convolution(factor, order):
+    data = np.random.default_rng(1).standard_normal((2, 2000)).astype(np.float32)
+    expected = cic_reference(data, factor, order)
+    for block_size in (37, 256, 2000):
+        out = process_in_blocks(CicDecimator(factor, order), data, block_size)
+        assert out.dtype == np.float32
+        assert out.shape == expected.shape
+        assert np.allclose(out, expected, atol=1e-5)
+
+
+def test_cic_large_factor():
+    decimator = CicDecimator(100000, 3)
+    offset = np.full((1, 1000000), 2.5, dtype=np.float32)
+    out = process_in_blocks(decimator, offset, 65536)
+    assert out.shape == (1, (1000000 - 3 * 99999 - 1) // 100000 + 1)
+    assert np.allclose(out, 2.5)
+    assert decimator.get_output_rate(1.25e6) == pytest.approx(12.5)
+
+
+def test_cic_polar_rows():
+    phase = np.linspace(0, 20 * np.pi, 4000)
+    x, y = np.cos(phase), np.sin(phase)
+    data = np.stack((x, y, np.hypot(x, y), np.degrees(np.arctan2(y, x)))).astype(np.float32)
+    out = CicDecimator(8, 2).process(data)
+    assert np.allclose(out[2], np.hypot(out[0], out[1]), atol=1e-6)
+    assert np.allclose(out[3], np.degrees(np.arctan2(out[1], out[0])), atol=1e-3)
+
+
+def test_min_max_envelope():
+    data = np.random.default_rng(2).standard_normal((4, 1003)).astype(np.float32)
+    groups = data[:, :1000].reshape(4, 100, 10)
+    for block_size in (7, 64, 1003):
+        out = process_in_blocks(MinMaxDecimator(10), data, block_size)
+        assert out.shape == (4, 200)
+        assert np.array_equal(out[:, 0::2], groups.min(axis=2))
+        assert np.array_equal(out[:, 1::2], groups.max(axis=2))
+    assert MinMaxDecimator(10).get_output_rate(1000.0) == pytest.approx(200.0)
+
+
+def test_min_max_reset_drops_pending():
+    decimator = MinMaxDecimator(4)
+    assert decimator.process(np.arange(3, dtype=np.float32).reshape(1, 3)).shape == (1, 0)
+    decimator.reset()
+    out = decimator.process(np.arange(10, 14, dtype=np.float32).reshape(1, 4))
+    assert out.tolist() == [[10.0, 13.0]]
@@ -0,0 +1,73 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import struct
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.streamdecoder import StreamDecoder
+
+
+def make_packet(number, channel, data_format, packet_size, little_endian=False):
+    code = 'h' if data_format == Keys.Int16 else 'f'
+    count = packet_size // struct.calcsize(code)
+    values = (np.arange(count) % 97 - 40) * (number % 3 + 1)
+    if data_format == Keys.Float32:
+        values = values * 0.37
+    header = struct.pack('>I', number & 0xff)
+    return header + struct.pack('{}{}{}'.format('<' if little_endian else '>', count, code), *values)
+
+
+def unpack_reference(packet, channel, data_format, packet_size, little_endian=False):
+    # Decode a packet with struct, as DataStream.receive_packet did before StreamDecoder
+    code = 'h' if data_format == Keys.Int16 else 'f'
+    count = packet_size // struct.calcsize(code)
+    values = np.array(struct.unpack_from('{}{}{}'.format('<' if little_endian else '>', count, code),
+                                         packet, 4), dtype=np.float64)
+    columns = values.reshape(-1, StreamDecoder.ColumnDict[channel]).T
+    if channel == Keys.XY:
+        x, y = columns
+        return np.array([x, y, np.hypot(x, y), np.degrees(np.arctan2(y, x))])
+    if channel == Keys.RT:
+        r, th = columns
+        return np.array([r * np.cos(np.radians(th)), r * np.sin(np.radians(th)), r, th])
+    return columns
+
+
+@pytest.mark.parametrize('little_endian', [False, True])
+@pytest.mark.parametrize('data_format', [Keys.Float32, Keys.Int16])
+@pytest.mark.parametrize('channel', [Keys.X, Keys.XY, Keys.RT, Keys.XYRT])
+def test_decode_matches_struct_unpack(channel, data_format, little_endian):
+    packet_size = 256
+    decoder = StreamDecoder(channel, data_format, packet_size, little_endian)
+    for number in range(3):
+        packet = make_packet(number, channel, data_format, packet_size, little_endian)
+        block = decoder.decode(packet)
+        assert block.shape == (decoder.rows, decoder.samples_per_packet)
+        assert np.allclose(block, unpack_reference(packet, channel, data_format, packet_size, little_endian),
+                           rtol=1e-5, atol=1e-4)
+
+
+def test_parse_header():
+    packet = bytes([0x21, 0x03, 0x10, 0xfe]) + bytes(1024)
+    assert StreamDecoder.parse_header(packet) == (0xfe, 0, 1, 3, 0x21)
+
+
+@pytest.mark.parametrize('channel', [Keys.X, Keys.XY, Keys.RT, Keys.XYRT])
+def test_decode_packets_matches_struct_unpack(channel):
+    packet_size = 128
+    decoder = StreamDecoder(channel, Keys.Float32, packet_size)
+    packets = [make_packet(number, channel, Keys.Float32, packet_size) for number in range(250, 260)]
+    # Rows of a slab can be longer than the packets, as the slots of PacketRing
+    slab = np.zeros((len(packets), packet_size + 4 + 16), dtype=np.uint8)
+    for i, packet in enumerate(packets):
+        slab[i, :len(packet)] = np.frombuffer(packet, dtype=np.uint8)
+    block, packet_numbers = decoder.decode_packets(slab)
+    expected = np.concatenate([unpack_reference(packet, channel, Keys.Float32, packet_size)
+                               for packet in packets], axis=1)
+    assert block.shape == (decoder.rows, len(packets) * decoder.samples_per_packet)
+    assert np.allclose(block, expected, rtol=1e-5, atol=1e-4)
+    assert list(packet_numbers) == [number % 256 for number in range(250, 260)]
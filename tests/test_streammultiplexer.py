@@ -0,0 +1,108 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import time
+import socket
+
+import pytest
+import numpy as np
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.components import DataStreamBuffer
+from srsinst.sr860.instruments.streamemulator import StreamPacketGenerator
+from srsinst.sr860.instruments.streammultiplexer import StreamMultiplexer
+
+
+def make_stream(generator):
+    stream = SR860().stream
+    stream.set_data_buffer(DataStreamBuffer(100000, generator.channel))
+    stream.listen(generator.channel, generator.data_format, generator.packet_size, generator.sample_rate)
+    return stream
+
+
+def send_packets(stream, packets):
+    address = ('127.0.0.1', stream.udp_socket.getsockname()[1])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for packet in packets:
+            sender.sendto(packet.data, address)
+
+
+def poll_until(multiplexer, total, timeout=5.0):
+    received = 0
+    start_time = time.time()
+    while received < total and time.time() - start_time < timeout:
+        received += multiplexer.poll(0.1)
+    return received
+
+
+def test_streams_are_routed_to_their_buffers():
+    generators = {
+        'x': StreamPacketGenerator(Keys.X, Keys.Float32, 512),
+        'xy': StreamPacketGenerator(Keys.XY, Keys.Int16, 1024),
+        'xyrt': StreamPacketGenerator(Keys.XYRT, Keys.Float32, 1024),
+    }
+    packet_counts = {'x': 7, 'xy': 13, 'xyrt': 20}
+    streams = {name: make_stream(generator) for name, generator in generators.items()}
+    multiplexer = StreamMultiplexer(max_packets=4)
+    try:
+        for name, stream in streams.items():
+            multiplexer.register(name, stream)
+        with pytest.raises(KeyError):
+            multiplexer.register('x', streams['x'])
+
+        for name, stream in streams.items():
+            send_packets(stream, generators[name].make_packets(packet_counts[name]))
+        assert poll_until(multiplexer, sum(packet_counts.values())) == sum(packet_counts.values())
+
+        statistics = multiplexer.get_statistics()
+        for name, stream in streams.items():
+            samples = packet_counts[name] * generators[name].samples_per_packet
+            assert stream.data.get_data_size() == samples
+            assert statistics[name]['packets'] == packet_counts[name]
+            assert statistics[name]['samples'] == samples
+            assert statistics[name]['lost'] == 0
+        assert np.isnan(streams['x'].data.y[0])
+        assert not np.isnan(streams['xy'].data.y[0])
+    finally:
+        multiplexer.close()
+        for stream in streams.values():
+            stream.stop()
+    assert multiplexer.streams == {}
+
+
+def test_callback_receives_blocks_of_its_stream():
+    generators = [StreamPacketGenerator(Keys.XY, Keys.Float32, 512),
+                  StreamPacketGenerator(Keys.RT, Keys.Float32, 512)]
+    streams = [make_stream(generator) for generator in generators]
+    received = {}
+
+    def callback(name, block, packet_numbers):
+        received.setdefault(name, []).append(block.copy())
+
+    multiplexer = StreamMultiplexer()
+    try:
+        multiplexer.register('a', streams[0], callback)
+        multiplexer.register('b', streams[1], callback)
+        send_packets(streams[0], generators[0].make_packets(5))
+        send_packets(streams[1], generators[1].make_packets(3))
+        assert poll_until(multiplexer, 8) == 8
+
+        # Blocks passed to the callback are not stored
+        assert streams[0].data.get_data_size() == 0
+        a = np.concatenate(received['a'], axis=1)
+        b = np.concatenate(received['b'], axis=1)
+        assert a.shape[1] == 5 * generators[0].samples_per_packet
+        assert b.shape[1] == 3 * generators[1].samples_per_packet
+
+        # An unregistered stream is not served
+        multiplexer.unregister('b')
+        send_packets(streams[1], generators[1].make_packets(2))
+        assert poll_until(multiplexer, 1, timeout=0.3) == 0
+        assert 'b' not in multiplexer.get_statistics()
+    finally:
+        multiplexer.close()
+        for stream in streams:
+            stream.stop()
@@ -0,0 +1,147 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import threading
+
+import pytest
+import numpy as np
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.components import DataStreamBuffer
+from srsinst.sr860.instruments.streamemulator import StreamPacketGenerator
+from srsinst.sr860.instruments.streampublisher import StreamPublisher, StreamSubscriber
+
+BlockSize = 10
+
+
+class SlowConsumer:
+    """
+    Callback that stalls in the first block until released
+    """
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.first_indices = []
+
+    def __call__(self, block, first_index):
+        self.started.set()
+        self.released.wait(5.0)
+        self.first_indices.append(first_index)
+
+
+def make_block(i):
+    return np.full((4, BlockSize), i, dtype=np.float32)
+
+
+def publish_while_stalled(policy, block_timeout=1.0):
+    publisher = StreamPublisher()
+    consumer = SlowConsumer()
+    subscriber = publisher.subscribe('slow', consumer, queue_size=2, policy=policy, block_timeout=block_timeout)
+    publisher.publish(make_block(0))
+    assert consumer.started.wait(5.0)
+    for i in range(1, 6):
+        publisher.publish(make_block(i))
+    return publisher, consumer, subscriber
+
+
+@pytest.mark.parametrize('policy, delivered', [
+    (StreamSubscriber.DropOldest, [0, 4, 5]),
+    (StreamSubscriber.DropNewest, [0, 1, 2]),
+    (StreamSubscriber.Block, [0, 1, 2]),
+])
+def test_slow_subscriber_policy(policy, delivered):
+    publisher, consumer, subscriber = publish_while_stalled(policy, block_timeout=0.01)
+    assert subscriber.get_lag()[:2] == (2, 2 * BlockSize)
+    counters = publisher.get_counters()['slow']
+    assert counters['dropped_blocks'] == 3
+    assert counters['dropped_samples'] == 3 * BlockSize
+
+    consumer.released.set()
+    publisher.close()
+    assert consumer.first_indices == [i * BlockSize for i in delivered]
+    assert subscriber.delivered_blocks == 3
+    assert subscriber.next_index == (delivered[-1] + 1) * BlockSize
+    assert publisher.sample_index == 6 * BlockSize
+
+
+def test_block_policy_waits_for_room():
+    publisher = StreamPublisher()
+    consumer = SlowConsumer()
+    subscriber = publisher.subscribe('slow', consumer, queue_size=2, policy=StreamSubscriber.Block,
+                                     block_timeout=5.0)
+    publisher.publish(make_block(0))
+    assert consumer.started.wait(5.0)
+    timer = threading.Timer(0.1, consumer.released.set)
+    timer.start()
+    for i in range(1, 6):
+        publisher.publish(make_block(i))
+    publisher.close()
+    timer.join()
+    assert consumer.first_indices == [i * BlockSize for i in range(6)]
+    assert subscriber.dropped_blocks == 0
+
+
+def test_slow_subscriber_does_not_stall_others():
+    publisher = StreamPublisher()
+    slow = SlowConsumer()
+    received = []
+    publisher.subscribe('slow', slow, queue_size=1)
+    fast = publisher.subscribe('fast', lambda block, first_index: received.append(block), queue_size=100)
+    block = make_block(0)
+    publisher.publish(block)
+    assert slow.started.wait(5.0)
+    for i in range(1, 20):
+        publisher.publish(make_block(i))
+    block[:] = -1
+    publisher.unsubscribe('fast')
+    assert fast.delivered_blocks == 20
+    assert [int(b[0, 0]) for b in received] == list(range(20))
+    assert not received[0].flags.writeable
+    assert publisher.get_counters()['slow']['dropped_blocks'] == 18
+
+    slow.released.set()
+    publisher.close(drain=False)
+    with pytest.raises(KeyError):
+        publisher.subscribe('slow', slow)
+
+
+def test_callback_errors_are_counted():
+    publisher = StreamPublisher()
+
+    def callback(block, first_index):
+        if first_index == BlockSize:
+            raise RuntimeError('failed')
+
+    subscriber = publisher.subscribe('faulty', callback)
+    for i in range(3):
+        publisher.publish(make_block(i))
+    publisher.close()
+    assert subscriber.errors == 1
+    assert subscriber.delivered_blocks == 3
+
+
+def test_stream_publishes_stored_blocks(tmp_path):
+    file_name = str(tmp_path / 'packets.dat')
+    generator = StreamPacketGenerator(Keys.XYRT, Keys.Float32, 1024)
+    generator.write_packet_file(file_name, 20)
+    stream = SR860().stream
+    stream.set_data_buffer(DataStreamBuffer(10000))
+    publisher = StreamPublisher()
+    blocks = []
+    publisher.subscribe('copy', lambda block, first_index: blocks.append((first_index, block)))
+    stream.set_publisher(publisher)
+    stream.replay(file_name)
+    for _ in range(4):
+        block, packet_numbers = stream.reader.receive_packets(5)
+        stream.store_block(block)
+    stream.stop()
+    publisher.close()
+
+    samples = 20 * generator.samples_per_packet
+    assert [first_index for first_index, _ in blocks] == [i * samples // 4 for i in range(4)]
+    data = np.concatenate([block for _, block in blocks], axis=1)
+    assert np.array_equal(data[0], stream.data.x[:samples])
+    assert np.array_equal(data[3], stream.data.th[:samples])
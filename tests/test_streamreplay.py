@@ -0,0 +1,128 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860 import SR860
+from srsinst.sr860.instruments.keys import Keys
+from srsinst.sr860.instruments.components import DataStreamBuffer
+from srsinst.sr860.instruments.streambuffers import RollingDataStreamBuffer, CompactDataStreamBuffer
+from srsinst.sr860.instruments.streamrecorder import PacketRecorder
+from srsinst.sr860.instruments.streamemulator import StreamPacketGenerator
+
+
+@pytest.mark.parametrize('buffer_class', [DataStreamBuffer, RollingDataStreamBuffer, CompactDataStreamBuffer])
+def test_x_channel_blocks_are_2d(tmp_path, buffer_class):
+    file_name = str(tmp_path / 'packets.dat')
+    generator = StreamPacketGenerator(Keys.X, Keys.Float32, 512)
+    generator.write_packet_file(file_name, 10)
+    stream = SR860().stream
+    stream.set_data_buffer(buffer_class(10000))
+    stream.replay(file_name)
+    block, packet_number = stream.receive_packet()
+    assert block.shape == (1, generator.samples_per_packet)
+    stream.store_block(block)
+    block, packet_numbers = stream.reader.receive_packets()
+    assert block.shape == (1, 9 * generator.samples_per_packet)
+    stream.store_block(block)
+    stream.stop()
+    assert stream.data.get_data_size() == 10 * generator.samples_per_packet
+    assert np.isnan(stream.data.y[0])
+
+
+def test_threaded_replay_drops_no_packet(tmp_path):
+    file_name = str(tmp_path / 'packets.dat')
+    StreamPacketGenerator(Keys.XYRT, Keys.Float32, 1024).write_packet_file(file_name, 8000)
+
+    stream = SR860().stream
+    stream.replay(file_name, threaded=True, ring_size=256)
+    received = 0
+    while True:
+        block, packet_numbers = stream.reader.receive_blocks(timeout=5.0)
+        if len(packet_numbers) == 0:
+            break
+        received += len(packet_numbers)
+    assert stream.reader.receiver.finished
+    assert received == 8000
+    assert stream.get_receiver_counters()['dropped'] == 0
+    assert stream.get_loss_counters()['lost'] == 0
+    stream.stop()
+    assert stream.get_receiver_counters() == {}
+
+
+def test_late_packet_is_left_out(tmp_path):
+    file_name = str(tmp_path / 'packets.dat')
+    generator = StreamPacketGenerator(Keys.XYRT, Keys.Float32, 1024)
+    slab = generator.make_packets(20)[[0, 1, 2, 3, 4, 6, 5, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19]]
+    recorder = PacketRecorder(file_name, Keys.XYRT, Keys.Float32, 1024, sample_rate=generator.sample_rate)
+    recorder.write_packets(slab, [slab.shape[1]] * len(slab), [0.0] * len(slab))
+    recorder.close()
+
+    stream = SR860().stream
+    stream.replay(file_name)
+    block, packet_numbers = stream.reader.receive_packets()
+    stream.store_block(block)
+    stream.stop()
+    assert packet_numbers.tolist() == [0, 1, 2, 3, 4, 6] + list(range(7, 20))
+    counters = stream.get_loss_counters()
+    assert counters['reordered'] == 1
+    assert counters['lost'] == 1
+    assert stream.data.get_data_size() == 19 * generator.samples_per_packet
+    assert np.all(np.diff(stream.data.th[:stream.data.get_data_size()]) > 0)
+
+
+def test_packet_file_in_chunks(tmp_path):
+    file_name = str(tmp_path / 'packets.dat')
+    StreamPacketGenerator(Keys.XY, Keys.Int16, 256).write_packet_file(file_name, 2500, chunk_size=1000)
+    stream = SR860().stream
+    stream.replay(file_name)
+    block, packet_numbers = stream.reader.receive_packets(max_packets=4000)
+    stream.stop()
+    assert len(packet_numbers) == 2500
+    assert np.array_equal(packet_numbers, np.arange(2500) % 256)
+    assert stream.get_loss_counters()['lost'] == 0
+
+
+def write_packets_with_content(file_name, option, content):
+    generator = StreamPacketGenerator(Keys.XY, Keys.Float32, 512)
+    slab = generator.make_packets(200)
+    slab[:, 2] = (slab[:, 2] & 0xf0) | content
+    recorder = PacketRecorder(file_name, Keys.XY, Keys.Float32, 512, option, generator.sample_rate)
+    recorder.write_packets(slab, [slab.shape[1]] * len(slab), [0.0] * len(slab))
+    recorder.close()
+    return generator
+
+
+def test_integrity_check_is_opt_in():
+    stream = SR860().stream
+    assert stream.get_option_value() == 0
+    assert stream.get_option_value(integrity_check=True) == stream.OptionBitDict[Keys.DataIntegrityChecking]
+
+
+def test_content_code_is_trusted_only_when_checked(tmp_path, caplog):
+    # A content code other than the one expected, as from a firmware that sets it differently
+    file_name = str(tmp_path / 'unchecked.dat')
+    generator = write_packets_with_content(file_name, 0, 0x0f)
+    stream = SR860().stream
+    stream.replay(file_name)
+    block, packet_numbers = stream.reader.receive_packets(max_packets=200)
+    stream.stop()
+    assert len(packet_numbers) == 200
+    assert not np.isnan(block).any()
+    assert stream.get_loss_counters()['corrupt'] == 0
+
+    file_name = str(tmp_path / 'checked.dat')
+    write_packets_with_content(file_name, stream.OptionBitDict[Keys.DataIntegrityChecking], 0x0f)
+    stream.replay(file_name)
+    with caplog.at_level('ERROR'):
+        for _ in range(4):
+            block, packet_numbers = stream.reader.receive_packets(max_packets=50)
+            assert np.isnan(block).all()
+    stream.stop()
+    assert stream.get_loss_counters()['corrupt'] == 200
+    reports = [record for record in caplog.records if 'failed verification' in record.getMessage()]
+    assert len(reports) == 1
+    assert block.shape[1] == 50 * generator.samples_per_packet
@@ -0,0 +1,25 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.streamspectrum import WelchSpectrum
+
+
+def test_segment_size_is_limited():
+    spectrum = WelchSpectrum(1.25e6, resolution=0.0001)
+    assert spectrum.segment_size == WelchSpectrum.MaxSegmentSize
+    assert spectrum.resolution == pytest.approx(1.25e6 / WelchSpectrum.MaxSegmentSize)
+
+    spectrum = WelchSpectrum(1000.0, resolution=1000.0, source='x')
+    assert spectrum.segment_size == WelchSpectrum.MinSegmentSize
+    assert len(spectrum.get_frequencies()) == WelchSpectrum.MinSegmentSize // 2 + 1
+
+
+def test_resolution_rounds_to_power_of_2():
+    spectrum = WelchSpectrum(1000.0, resolution=3.0)
+    assert spectrum.segment_size == 512
+    assert spectrum.resolution == pytest.approx(1000.0 / 512)
@@ -0,0 +1,96 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.streamstatistics import RunningStatistics
+
+
+def allan_reference(row, m):
+    # Overlapping Allan deviation from the means of every pair of adjacent windows of m samples,
+    # leaving out the pairs with a NaN sample
+    means = np.convolve(row, np.ones(m) / m, mode='valid')
+    d = means[m:] - means[:-m]
+    d = d[~np.isnan(d)]
+    return np.sqrt(np.mean(d ** 2) / 2.0) if len(d) else None
+
+
+def add_in_blocks(statistics, data, seed=0):
+    random = np.random.default_rng(seed)
+    start = 0
+    while start < data.shape[1]:
+        size = int(random.integers(1, 700))
+        statistics.add_block(data[:, start: start + size])
+        start += size
+
+
+def make_data(columns, seed=1):
+    random = np.random.default_rng(seed)
+    noise = random.standard_normal((4, columns))
+    walk = np.cumsum(random.standard_normal((4, columns)), axis=1) * 0.01
+    return (1000.0 + noise + walk).astype(np.float32)
+
+
+def test_moments_match_numpy():
+    data = make_data(20000)
+    statistics = RunningStatistics(names=('x', 'r', 'th'), chunk_size=256)
+    add_in_blocks(statistics, data)
+    rows = data[[0, 2, 3]].astype(np.float64)
+    assert statistics.total_samples == 20000
+    assert np.array_equal(statistics.count, [20000] * 3)
+    assert np.allclose(statistics.mean, rows.mean(axis=1), rtol=0, atol=1e-9)
+    assert np.allclose(statistics.get_std(), rows.std(axis=1, ddof=1), rtol=1e-9)
+    assert np.array_equal(statistics.min, rows.min(axis=1))
+    assert np.array_equal(statistics.max, rows.max(axis=1))
+
+    results = statistics.get_results()
+    assert set(results) == {'samples', 'sample_rate', 'x', 'r', 'th'}
+    assert results['th']['count'] == 20000
+
+
+@pytest.mark.parametrize('chunk_size', [64, 65536])
+def test_allan_deviation_matches_brute_force(chunk_size):
+    data = make_data(6000)
+    statistics = RunningStatistics(sample_rate=100.0, octaves=12, chunk_size=chunk_size)
+    add_in_blocks(statistics, data)
+    for row in range(4):
+        taus, adev = statistics.get_allan_deviation(row)
+        # Taus up to 2048 samples fit in 6000 samples
+        assert np.allclose(taus, 2.0 ** np.arange(12) / 100.0)
+        expected = [allan_reference(data[row].astype(np.float64), 2 ** k) for k in range(12)]
+        assert np.allclose(adev, expected, rtol=1e-6)
+
+
+def test_nan_samples_are_left_out():
+    data = make_data(3000)
+    data[1, [10, 11, 500, 2999]] = np.nan
+    data[2, 1500:1700] = np.nan
+    statistics = RunningStatistics(octaves=8, chunk_size=100)
+    add_in_blocks(statistics, data)
+
+    rows = data.astype(np.float64)
+    assert np.array_equal(statistics.count, (~np.isnan(rows)).sum(axis=1))
+    assert np.allclose(statistics.mean, np.nanmean(rows, axis=1), rtol=0, atol=1e-9)
+    assert np.allclose(statistics.get_std(), np.nanstd(rows, axis=1, ddof=1), rtol=1e-9)
+    assert np.array_equal(statistics.min, np.nanmin(rows, axis=1))
+    for row in range(4):
+        taus, adev = statistics.get_allan_deviation(row)
+        expected = [allan_reference(rows[row], int(m)) for m in taus]
+        assert np.allclose(adev, expected, rtol=1e-6)
+
+
+def test_rows_change_resets():
+    statistics = RunningStatistics(octaves=4)
+    statistics.add_block(np.arange(10, dtype=np.float32))
+    assert statistics.row_indices == [0]
+    taus, adev = statistics.get_allan_deviation(0)
+    assert taus.tolist() == [1.0, 2.0, 4.0]
+    assert np.allclose(adev, [1 / np.sqrt(2), np.sqrt(2), 2 * np.sqrt(2)])
+    assert statistics.get_allan_deviation(1)[0].size == 0
+
+    statistics.add_block(np.ones((4, 5), dtype=np.float32))
+    assert statistics.total_samples == 5
+    assert np.array_equal(statistics.mean, np.ones(4))
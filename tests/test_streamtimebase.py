@@ -0,0 +1,71 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.streamtimebase import StreamTimebase
+
+SampleRate = 1000.0
+SamplesPerPacket = 64
+WrapPeriod = 256 * SamplesPerPacket / SampleRate
+
+
+def make_timebase():
+    return StreamTimebase(SampleRate, start_time=1000.0)
+
+
+def test_gap_shifts_following_samples():
+    timebase = make_timebase()
+    timebase.add_gap(640, 3 * SamplesPerPacket / SampleRate)
+    seconds = timebase.get_seconds([0, 639, 640, 700])
+    assert seconds == pytest.approx([0.0, 0.639, 0.640 + 0.192, 0.700 + 0.192])
+    assert timebase.get_epoch(640) == pytest.approx(1000.832)
+    # Times within the gap fall on the first sample after it
+    assert timebase.find_sample_index([0.5, 0.7, 0.9]) == pytest.approx([500.0, 640.0, 708.0])
+
+
+@pytest.mark.parametrize('cycles, jitter', [(0, 0.0), (0, 0.4), (1, 0.0), (1, -0.3), (1, 0.3), (3, 0.2)])
+def test_wrap_period_adds_uncounted_cycles(cycles, jitter):
+    # The packet numbers count 3 lost packets, and the arrival time shows cycles of 256 more
+    timebase = make_timebase()
+    gap_time = 3 * SamplesPerPacket / SampleRate
+    lost_time = gap_time + cycles * WrapPeriod
+    host_time = 1000.0 + 0.640 + lost_time + jitter * WrapPeriod
+    timebase.add_gap(640, gap_time, host_time, WrapPeriod)
+    assert timebase.get_seconds(640) == pytest.approx(0.640 + lost_time)
+
+
+def test_wrap_period_does_not_move_anchor_back():
+    timebase = make_timebase()
+    gap_time = 3 * SamplesPerPacket / SampleRate
+    timebase.add_gap(640, gap_time, 1000.0 + 0.640 + gap_time - 2 * WrapPeriod, WrapPeriod)
+    assert timebase.get_seconds(640) == pytest.approx(0.640 + gap_time)
+    timebase.add_gap(1280, gap_time, 1000.0 + 1.280 + 2 * gap_time + 0.9 * WrapPeriod, None)
+    assert timebase.get_seconds(1280) == pytest.approx(1.280 + 2 * gap_time)
+
+
+def test_gap_anchors_replace_later_anchors():
+    timebase = make_timebase()
+    timebase.add_gap(100, 1.0)
+    timebase.add_gap(200, 1.0)
+    timebase.add_gap(150, 0.5)
+    assert timebase.get_anchors()['sample_index'].tolist() == [0, 100, 150]
+    assert timebase.get_seconds(200) == pytest.approx(1.7)
+
+
+def test_datetime64_keeps_nanoseconds():
+    timebase = StreamTimebase(1.25e6, start_time=1700000000.123456789)
+    times = timebase.get_datetime64([0, 1, 1250000])
+    assert (times[1] - times[0]) == np.timedelta64(800, 'ns')
+    assert (times[2] - times[0]) == np.timedelta64(1, 's')
+
+
+def test_without_sample_rate():
+    timebase = StreamTimebase()
+    timebase.add_gap(10, 1.0)
+    assert timebase.get_seconds([0, 10, 20]).tolist() == [0.0, 10.0, 20.0]
+    with pytest.raises(ValueError):
+        timebase.get_epoch(0)
@@ -0,0 +1,152 @@
+##!
+##! Copyright(c) 2023 Stanford Research Systems, All rights reserved
+##! Subject to the MIT License
+##!
+
+import pytest
+import numpy as np
+
+from srsinst.sr860.instruments.streamtracker import PacketTracker
+from srsinst.sr860.instruments.streamtimebase import StreamTimebase
+
+
+def numbers(*values):
+    return np.array(values, dtype=np.uint8)
+
+
+def test_wrap_is_not_a_gap():
+    tracker = PacketTracker(64)
+    tracker.add_packets(numbers(*range(250, 256)))
+    tracker.add_packets(numbers(*range(0, 6)))
+    for number in range(6, 10):
+        tracker.add_packet(number)
+    counters = tracker.get_counters()
+    assert counters['received'] == 16
+    assert counters['lost'] == 0
+    assert counters['gaps'] == 0
+    assert tracker.sample_index == 16 * 64
+
+
+def test_gap_across_wrap():
+    tracker = PacketTracker(64)
+    tracker.add_packets(numbers(253, 254, 1, 2))
+    assert tracker.lost_packets == 2
+    assert tracker.gaps == [(2 * 64, 2)]
+
+
+def test_reorder_keeps_gap():
+    tracker = PacketTracker(64)
+    kept = tracker.add_packets(numbers(10, 12, 11, 13))
+    assert kept.tolist() == [True, True, False, True]
+    counters = tracker.get_counters()
+    assert counters['received'] == 4
+    assert counters['lost'] == 1
+    assert counters['reordered'] == 1
+    assert tracker.gaps == [(64, 1)]
+    assert tracker.sample_index == 3 * 64
+
+
+def test_reorder_across_wrap_and_batches():
+    tracker = PacketTracker(64)
+    assert tracker.add_packets(numbers(253, 254, 0)) is None
+    assert tracker.gaps == [(2 * 64, 1)]
+    assert not tracker.add_packet(255)
+    assert tracker.add_packets(numbers(1, 2)) is None
+    assert tracker.lost_packets == 1
+    assert tracker.reordered_packets == 1
+    assert tracker.gaps == [(2 * 64, 1)]
+    assert tracker.sample_index == 5 * 64
+
+    # The late packet fills its gap once. Another copy is a duplicate.
+    assert not tracker.add_packet(255)
+    assert tracker.duplicate_packets == 1
+
+
+def test_reorder_over_many_wraps():
+    tracker = PacketTracker(64)
+    order = np.arange(1000).reshape(-1, 4)[:, [0, 2, 1, 3]].ravel()
+    kept = tracker.add_packets((order % 256).astype(np.uint8))
+    assert np.all(np.diff(order[kept]) > 0)
+    counters = tracker.get_counters()
+    assert counters['received'] == 1000
+    assert counters['lost'] == 250
+    assert counters['reordered'] == 250
+    assert counters['duplicates'] == 0
+    assert tracker.gaps == [(i * 3 * 64 + 64, 1) for i in range(250)]
+    assert tracker.sample_index == 750 * 64
+
+
+@pytest.mark.parametrize('burst', [256, 300, 600])
+def test_long_burst_counted_from_timestamps(burst):
+    packet_rate = 1000.0
+    positions = np.concatenate((np.arange(10), np.arange(10 + burst, 30 + burst)))
+    timestamps = 100.0 + positions / packet_rate
+
+    tracker = PacketTracker(64, packet_rate=packet_rate)
+    tracker.add_packets(numbers(*(positions[:15] % 256)), timestamps=timestamps[:15])
+    tracker.add_packets(numbers(*(positions[15:] % 256)), timestamps=timestamps[15:])
+    assert tracker.lost_packets == burst
+    assert tracker.gaps == [(10 * 64, burst)]
+
+    single = PacketTracker(64, packet_rate=packet_rate)
+    for number, timestamp in zip(positions % 256, timestamps):
+        single.add_packet(int(number), timestamp=timestamp)
+    assert single.lost_packets == burst
+    assert single.gaps == [(10 * 64, burst)]
+
+
+def test_long_burst_needs_timestamps():
+    positions = np.concatenate((np.arange(10), np.arange(10 + 256, 30 + 256)))
+    tracker = PacketTracker(64, packet_rate=1000.0)
+    tracker.add_packets(numbers(*(positions % 256)))
+    assert tracker.lost_packets == 0
+
+
+def test_jitter_is_not_a_lost_cycle():
+    packet_rate = 1000.0
+    timestamps = 100.0 + np.arange(20) / packet_rate
+    timestamps[10:] += 100 / packet_rate  # Delayed by less than half of a cycle
+    tracker = PacketTracker(64, packet_rate=packet_rate)
+    tracker.add_packets(numbers(*range(20)), timestamps=timestamps)
+    tracker.add_packets(numbers(20, 21, 23), timestamps=timestamps[-1] + np.array([1, 2, 4]) / packet_rate)
+    assert tracker.lost_packets == 1
+    assert tracker.gaps == [(22 * 64, 1)]
+
+
+def test_late_packets_in_one_gap():
+    tracker = PacketTracker(64)
+    kept = tracker.add_packets(numbers(0, 4, 2, 5, 3))
+    assert kept.tolist() == [True, True, False, True, False]
+    assert tracker.lost_packets == 3
+    assert tracker.reordered_packets == 2
+    assert tracker.gaps == [(64, 3)]
+    assert not tracker.add_packet(1)
+    assert tracker.reordered_packets == 3
+    assert tracker.duplicate_packets == 0
+    assert tracker.gaps == [(64, 3)]
+
+
+def test_old_packet_is_a_duplicate():
+    tracker = PacketTracker(64)
+    kept = tracker.add_packets(numbers(0, 1, 2, 3, 1))
+    assert kept.tolist() == [True, True, True, True, False]
+    counters = tracker.get_counters()
+    assert counters['duplicates'] == 1
+    assert counters['reordered'] == 0
+    assert counters['lost'] == 0
+
+
+def test_timebase_after_reorder():
+    sample_rate = 1000.0
+    tracker = PacketTracker(10)
+    timebase = StreamTimebase(sample_rate, start_time=0.0)
+    tracker.add_packets(numbers(0, 1, 3))
+    timebase.add_gap(tracker.gaps[0][0], tracker.gaps[0][1] * 10 / sample_rate)
+    assert timebase.get_seconds(20) == pytest.approx(0.03)
+
+    # The late packet is left out, and the samples after the gap keep their times
+    assert not tracker.add_packet(2)
+    tracker.add_packet(4)
+    assert tracker.sample_index == 40
+    assert len(tracker.gaps) == 1
+    assert timebase.get_seconds(30) == pytest.approx(0.04)